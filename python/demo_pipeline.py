@@ -1,7 +1,10 @@
 import os
 from pipeline_impl.specialized_director import SpecializedAssetFactory, PipelineDirector, Director
-from pipeline.data_access_interface import NotFoundError, TaskSchedulerNotAvailable  # export
+from pipeline.data_access_interface import NotFoundError, TaskSchedulerNotAvailable, DependencyCycleError, ReadOnlyError, ChangeLogTrimmedError, WriteLockBusyError  # export
+from pipeline.cached_data_access import CachedDataAccessInterface
+from pipeline.completion_queue import GroupCommitCompletionQueue
 from pipeline_impl.sqlite_data_manager import SqliteDataManagerWithLifeblood
+from pipeline_impl.sharded_data_manager import ShardedDataManager
 from pipeline_impl.lifeblood_task_scheduler import LifebloodDataScheduler
 from pipeline_impl.asset_uri_handler import AssetUriHandler
 from pipeline_impl.asset_version_uri_handler import AssetVersionUriHandler
@@ -9,8 +12,31 @@ from pipeline_impl.asset_version_uri_handler import AssetVersionUriHandler
 
 lb_addr = ('127.0.0.1', 1384)
 __scheduler = LifebloodDataScheduler(lb_addr)
-__dm = SqliteDataManagerWithLifeblood(os.path.join(os.environ['PIPELINE_ROOT'], 'smth.db'), __scheduler)
-__scheduler.add_task_completion_callback_receiver(__dm)
+if os.environ.get('PIPELINE_SNAPSHOT_DB'):
+    # farm workers may read from a frozen snapshot made by tools/export_snapshot.py
+    __dm = SqliteDataManagerWithLifeblood(os.environ['PIPELINE_SNAPSHOT_DB'], __scheduler,
+                                         maintain_dependency_closure=True,  # closure is used if it was exported
+                                         read_only=True)
+elif int(os.environ.get('PIPELINE_SHARD_COUNT', '1')) > 1:
+    # shard count and order must stay the same for the lifetime of the data
+    __dm = ShardedDataManager.from_sqlite_paths([os.path.join(os.environ['PIPELINE_ROOT'], f'smth_shard{i}.db')
+                                                 for i in range(int(os.environ['PIPELINE_SHARD_COUNT']))], __scheduler)
+else:
+    __dm = SqliteDataManagerWithLifeblood(os.path.join(os.environ['PIPELINE_ROOT'], 'smth.db'), __scheduler,
+                                         maintain_dependency_closure=os.environ.get('PIPELINE_DEPENDENCY_CLOSURE') == '1')
+if os.environ.get('PIPELINE_L1_CACHE') == '1':
+    # for long-running processes: cache lookups in memory, changes from other processes are picked up every few seconds
+    __l1_sync_interval = float(os.environ.get('PIPELINE_L1_CACHE_SYNC_INTERVAL', '5'))
+    if isinstance(__dm, ShardedDataManager):
+        # shards have no common change feed, so each shard gets a cache of its own
+        __dm = ShardedDataManager([CachedDataAccessInterface(shard, sync_interval=__l1_sync_interval) for shard in __dm.get_shards()], __scheduler)
+    else:
+        __dm = CachedDataAccessInterface(__dm, sync_interval=__l1_sync_interval)
+if os.environ.get('PIPELINE_COMPLETION_GROUP_COMMIT_WINDOW'):
+    # bursts of finished tasks are written in one transaction instead of one each
+    __scheduler.add_task_completion_callback_receiver(GroupCommitCompletionQueue(__dm, window=float(os.environ['PIPELINE_COMPLETION_GROUP_COMMIT_WINDOW'])))
+else:
+    __scheduler.add_task_completion_callback_receiver(__dm)
 __director: PipelineDirector = PipelineDirector(__dm)
 __director.register_uri_handler(AssetUriHandler(__director))
 __director.register_uri_handler(AssetVersionUriHandler(__director))
@@ -19,3 +45,17 @@ __director.register_uri_handler(AssetVersionUriHandler(__director))
 def get_director() -> PipelineDirector:
     assert __director is not None
     return __director
+
+
+def get_sqlite_data_manager() -> SqliteDataManagerWithLifeblood:
+    """
+    the single sqlite database behind director's data accessor, for maintenance only sqlite can do
+
+    :raises RuntimeError: if data is not kept in a single sqlite database, like when it is sharded
+    """
+    data_accessor = get_director().get_data_accessor()
+    if isinstance(data_accessor, CachedDataAccessInterface):
+        data_accessor = data_accessor.get_backend()
+    if not isinstance(data_accessor, SqliteDataManagerWithLifeblood):
+        raise RuntimeError(f'pipeline data is not kept in a single sqlite database, it is accessed through {type(data_accessor).__name__}')
+    return data_accessor
@@ -1,147 +1,261 @@
-import json
-import os
+import time
 from .asset_data import AssetData, AssetVersionData, DataState, AssetTemplateData
-from .data_access_interface import DataAccessInterface
+from .data_access_interface import DataAccessInterface, DependencyCycleError, NotFoundError
 from .future import FutureResult, CompletedFuture
 from .utils import normalize_version, denormalize_version, VersionType
 from .generation_task_parameters import GenerationTaskParameters, EnvironmentResolverParameters
+from .version_locks import get_version_lock_context
 
-from typing import Union, Tuple, List, Optional, Iterable, Type, Dict, Set
+from typing import Any, Union, Tuple, List, Optional, Iterable, Type, Dict, Set
 
 
 class DataNotYetAvailable(Exception):
     pass
 
 
+_missing_field = object()
+
+
 class Asset:
-    def __init__(self, asset_path_id: str, data_provider: DataAccessInterface):
-        self.__asset_data: AssetData = data_provider.get_asset_data(asset_path_id)
+    # assets are often held in large numbers only for their path_id, so they are kept compact,
+    # and asset data is only fetched when something other than path_id is needed
+    __slots__ = ('__path_id', '__asset_data', '__data_provider', '__weakref__')
+
+    def __init__(self, asset_path_id: str, data_provider: DataAccessInterface, asset_data: Optional[AssetData] = None):
+        """
+        :param asset_data: already fetched data of this asset, otherwise it is fetched on first access
+        """
+        self.__path_id = asset_path_id
+        self.__asset_data: Optional[AssetData] = asset_data
         self.__data_provider = data_provider
 
+    def __get_asset_data(self) -> AssetData:
+        if self.__asset_data is None:
+            self.__asset_data = self.__data_provider.get_asset_data(self.__path_id)
+        return self.__asset_data
+
     @property
     def path_id(self):
-        return self.__asset_data.path_id
+        return self.__path_id
 
     @property
     def name(self):
-        return self.__asset_data.name
+        return self.__get_asset_data().name
 
     @property
     def description(self):
-        return self.__asset_data.description
+        return self.__get_asset_data().description
 
     def get_latest_version(self) -> "AssetVersion":
         version_data = self._get_data_provider().get_asset_version_data(self.path_id, None)
-        return self.get_version(version_data.version_id)
+        return self._version_from_data(version_data)
 
     def get_default_version(self) -> "AssetVersion":
-        # default version for an asset may be locked in the environment
-        mapping = json.loads(os.environ.get('LBATTR_locked_asset_versions', '{}'))
-
-        asset_ver_pathid = mapping.get(self.path_id)
+        # default version for an asset may be locked in the environment, or in current lock context
+        asset_ver_pathid = get_version_lock_context().get_locked_version_path_id(self.path_id)
         if asset_ver_pathid:
             # TODO: sanity check that mapped version belongs to this asset
             return self._get_version_class().from_path_id(self._get_data_provider(), asset_ver_pathid)
         return self.get_latest_version()
 
     def get_version(self, version_id: VersionType) -> "AssetVersion":
+        """
+        :raises NotFoundError: if there is no such version
+        """
         version_id = normalize_version(version_id)
+        # fetched right away, as existence is checked anyway
+        return self._version_from_data(self._get_data_provider().get_asset_version_data(self.path_id, version_id))
 
-        return self._get_version_class()(self, version_id)
+    def _version_from_data(self, version_data: AssetVersionData) -> "AssetVersion":
+        """
+        version object for already fetched version data of this asset
+        """
+        return self._get_version_class()(self, version_data.version_id, version_data=version_data)
+
+    def _new_version_data(self, version_id: Optional[VersionType] = None,
+                          creation_task_parameters: Optional[GenerationTaskParameters] = None) -> AssetVersionData:
+        if version_id is not None:
+            version_id = normalize_version(version_id)
+        return AssetVersionData(None,
+                                self.path_id,
+                                version_id,
+                                creation_task_parameters or GenerationTaskParameters({}, {}, EnvironmentResolverParameters('', {})),
+                                DataState.NOT_COMPUTED,
+                                None,
+                                None)
 
     def _create_single_new_generic_version(self, version_id: Optional[VersionType] = None,
                                            creation_task_parameters: Optional[GenerationTaskParameters] = None,
                                            dependencies: Iterable["AssetVersion"] = ()) -> "AssetVersion":
-        if version_id is not None:
-            version_id = normalize_version(version_id)
-        version_data = AssetVersionData(None,
-                                        self.path_id,
-                                        version_id,
-                                        creation_task_parameters or GenerationTaskParameters({}, {}, EnvironmentResolverParameters('', {})),
-                                        DataState.NOT_COMPUTED,
-                                        None,
-                                        None)
+        version_data = self._new_version_data(version_id, creation_task_parameters)
         version_data = self._get_data_provider().publish_new_asset_version(self.path_id, version_data, [dep.path_id for dep in dependencies])
-        return self._get_version_class()(self, version_data.version_id)
+        return self._version_from_data(version_data)
+
+    @staticmethod
+    def _create_new_generic_versions(data_provider: DataAccessInterface,
+                                     version_specs: Iterable[Tuple["Asset", Optional[VersionType], Optional[GenerationTaskParameters], Iterable["AssetVersion"]]]) -> Tuple[List["AssetVersion"], List["AssetVersion"]]:
+        """
+        publish all versions described by version_specs in one go, then trigger templates relevant to all of them at once,
+        all in one data provider's transaction, so as atomic as that transaction is, see create_new_generic_version
+
+        :returns: newly created asset versions in version_specs order, and ALL other asset versions whos creation was triggered by them
+        """
+        version_specs = list(version_specs)
+        with data_provider.transaction():
+            version_datas = data_provider.publish_new_asset_versions([(asset.path_id,
+                                                                       asset._new_version_data(version_id, creation_task_parameters),
+                                                                       [dep.path_id for dep in dependencies])
+                                                                      for asset, version_id, creation_task_parameters, dependencies in version_specs])
+            new_versions = [asset._version_from_data(version_data) for (asset, *_), version_data in zip(version_specs, version_datas)]
+            triggered_versions = Asset._trigger_asset_templates(data_provider, new_versions)
+        return new_versions, triggered_versions
+
+    def create_new_generic_versions(self, version_specs: Iterable[Tuple[Optional[VersionType], Optional[GenerationTaskParameters], Iterable["AssetVersion"]]]) -> Tuple[List["AssetVersion"], List["AssetVersion"]]:
+        """
+        create many versions of this asset in a single transaction, with the same atomicity as create_new_generic_version.
+        version_specs elements are (version_id, creation_task_parameters, dependencies), same as in create_new_generic_version
+
+        :returns: newly created asset versions, and ALL other asset versions whos creation was triggered by them
+        """
+        return self._create_new_generic_versions(self._get_data_provider(),
+                                                 ((self, version_id, creation_task_parameters, dependencies)
+                                                  for version_id, creation_task_parameters, dependencies in version_specs))
 
     def create_new_generic_version(self, version_id: Optional[VersionType] = None,
                                    creation_task_parameters: Optional[GenerationTaskParameters] = None,
                                    dependencies: Iterable["AssetVersion"] = (),
                                    create_template_from_locks: bool = False) -> Tuple["AssetVersion", List["AssetVersion"]]:
         """
+        version, everything it triggers and the template are all created in one data provider's transaction.
+
+        NOTE: that makes it all or nothing only where data provider's transaction is atomic.
+        with ShardedDataManager it is only atomic per shard: if the cascade spans shards and one of them fails to commit,
+        what was written to the shards committed before it stays.
+        it also may fail with WriteLockBusyError under contention instead of waiting, then nothing is written and it may be retried
+
         :returns: newly created asset version, and ALL other asset versions whos creation was triggered by that version
         """
         if version_id is not None:
             version_id = normalize_version(version_id)
-        new_version = self._create_single_new_generic_version(version_id, creation_task_parameters, dependencies)
-
-        # trigger all downstream asset version creation
-        triggered_versions = self._trigger_relevant_asset_templates_nonrecursive(new_version)
-
-        # create new templates if needed
-        if create_template_from_locks and creation_task_parameters:
-            # split dependencies into dynamic and static ones based on the lock dict
-            locks = creation_task_parameters.version_lock_mapping
-            if len(locks) > 0:  # template only makes sense if there are dynamic versions
-                # only deps that are not part of the lock, static deps
-                template_version_deps = [x.path_id for x in dependencies if x.path_id not in set(locks.values())]
-                trigger_asset_pathids = list(locks.keys())
-                self._get_data_provider().create_asset_template(AssetTemplateData(self.path_id, creation_task_parameters),
-                                                                trigger_asset_pathids,
-                                                                template_version_deps)
+        dependencies = list(dependencies)
+        with self._get_data_provider().transaction():
+            new_version = self._create_single_new_generic_version(version_id, creation_task_parameters, dependencies)
+
+            # trigger all downstream asset version creation
+            triggered_versions = self._trigger_relevant_asset_templates_nonrecursive(new_version)
+
+            # create new templates if needed
+            if create_template_from_locks and creation_task_parameters:
+                # split dependencies into dynamic and static ones based on the lock dict
+                locks = creation_task_parameters.version_lock_mapping
+                if len(locks) > 0:  # template only makes sense if there are dynamic versions
+                    # only deps that are not part of the lock, static deps
+                    template_version_deps = [x.path_id for x in dependencies if x.path_id not in set(locks.values())]
+                    trigger_asset_pathids = list(locks.keys())
+                    self._get_data_provider().create_asset_template(AssetTemplateData(self.path_id, creation_task_parameters),
+                                                                    trigger_asset_pathids,
+                                                                    template_version_deps)
         return new_version, triggered_versions
 
     def _trigger_relevant_asset_templates_nonrecursive(self, asset_version: "AssetVersion") -> List["AssetVersion"]:
-        asset = asset_version.asset
-        # first construct tree and order
-        order = []
-        preorder = []
-        repeats = set()
-        template_to_inputs: Dict[str, Set[str]] = {}
-        templates: Dict[str, AssetTemplateData] = {}
-        new_vers: Dict[str, str] = {asset.path_id: asset_version.path_id}
-
-        queue_of_stuff = [(asset.path_id, x) for x in self._get_data_provider().get_asset_templates_triggered_by(asset.path_id)]
-        for triggered_path_id, template_data in queue_of_stuff:
-            preorder.insert(0, template_data.asset_path_id)
-            template_to_inputs.setdefault(template_data.asset_path_id, set()).add(triggered_path_id)
-            if template_data.asset_path_id not in templates:
-                templates[template_data.asset_path_id] = template_data
-            queue_of_stuff.extend((template_data.asset_path_id, x) for x in self._get_data_provider().get_asset_templates_triggered_by(template_data.asset_path_id))
-
-        for path_id in preorder:
-            if path_id in repeats:
-                continue
-            repeats.add(path_id)
-            order.insert(0, path_id)
-
-        assert len(order) == len(set(order)), 'something is way wrong'
-
-        # now we have the order of version creation in which all inputs are created first
-        triggered_versions = []
-        for path_id in order:
-            template_data = templates[path_id]
-            # first update template's locked versions
-            for input_path_id in template_to_inputs[path_id]:
-                assert input_path_id in new_vers, 'cannot be!'
-                assert input_path_id in template_data.data_producer_task_attrs.version_lock_mapping
-                template_data.data_producer_task_attrs.version_lock_mapping[input_path_id] = new_vers[input_path_id]
-            # save updated template
-            self._get_data_provider().update_asset_template_data(template_data)
+        return self._trigger_asset_templates(self._get_data_provider(), (asset_version,))
 
-            fixed_dependencies = [AssetVersion.from_path_id(self._get_data_provider(), x) for x in self._get_data_provider().get_template_fixed_dependencies(template_data.asset_path_id)]
-            dependencies = {*fixed_dependencies,
-                            *(AssetVersion.from_path_id(self._get_data_provider(), x) for x in template_data.data_producer_task_attrs.version_lock_mapping.values())}
+    @staticmethod
+    def _trigger_asset_templates(data_provider: DataAccessInterface, asset_versions: Iterable["AssetVersion"]) -> List["AssetVersion"]:
+        """
+        trigger creation of new versions from all templates downstream of given versions.
+        if several given versions belong to the same asset - the last one is used.
 
-            new_version = Asset(path_id, self._get_data_provider()) \
-                              ._create_single_new_generic_version(None,
-                                                                  creation_task_parameters=template_data.data_producer_task_attrs,
-                                                                  dependencies=dependencies)
-            triggered_versions.append(new_version)
-            new_vers[path_id] = new_version.path_id
+        the whole cascade is one transaction, templates are updated and their versions published level by level
+        """
+        new_vers: Dict[str, str] = {asset_version.asset.path_id: asset_version.path_id for asset_version in asset_versions}
+
+        with data_provider.transaction():
+            # whole downstream template graph comes in one go
+            template_to_inputs: Dict[str, Set[str]] = {}
+            templates: Dict[str, AssetTemplateData] = {}
+            for input_path_id, template_data in data_provider.get_asset_templates_downstream_of(new_vers):
+                templates.setdefault(template_data.asset_path_id, template_data)
+                template_to_inputs.setdefault(template_data.asset_path_id, set()).add(input_path_id)
+            if not templates:
+                return []
+
+            levels = Asset._template_creation_levels(template_to_inputs)
+            fixed_dependencies = data_provider.get_templates_fixed_dependencies(templates)
+
+            # dependencies are only needed as path_ids.
+            # the ones not created by this cascade are checked to exist all at once
+            existing_dependencies = set()
+            for path_id, template_data in templates.items():
+                existing_dependencies.update(fixed_dependencies.get(path_id, ()))
+                existing_dependencies.update(version_path_id for asset_path_id, version_path_id in template_data.data_producer_task_attrs.version_lock_mapping.items()
+                                             if asset_path_id not in template_to_inputs[path_id])
+            missing = existing_dependencies.difference(x.path_id for x in data_provider.get_asset_version_datas_from_path_id(existing_dependencies))
+            if missing:
+                raise NotFoundError(f'asset templates depend on versions that do not exist: {", ".join(sorted(missing))}')
+
+            # all inputs of a level are created by previous levels
+            triggered_versions = []
+            for level in levels:
+                # first update templates' locked versions
+                for path_id in level:
+                    template_data = templates[path_id]
+                    for input_path_id in template_to_inputs[path_id]:
+                        assert input_path_id in new_vers, 'cannot be!'
+                        assert input_path_id in template_data.data_producer_task_attrs.version_lock_mapping
+                        template_data.data_producer_task_attrs.version_lock_mapping[input_path_id] = new_vers[input_path_id]
+                # save updated templates
+                data_provider.update_asset_template_datas([templates[path_id] for path_id in level])
+
+                assets = [Asset(path_id, data_provider) for path_id in level]
+                batch = []
+                for asset in assets:
+                    template_data = templates[asset.path_id]
+                    batch.append((asset.path_id,
+                                  asset._new_version_data(None, template_data.data_producer_task_attrs),
+                                  list(dict.fromkeys([*fixed_dependencies.get(asset.path_id, ()),
+                                                      *template_data.data_producer_task_attrs.version_lock_mapping.values()]))))
+                for asset, version_data in zip(assets, data_provider.publish_new_asset_versions(batch)):
+                    new_version = asset._version_from_data(version_data)
+                    triggered_versions.append(new_version)
+                    new_vers[asset.path_id] = new_version.path_id
 
         return triggered_versions
 
+    @staticmethod
+    def _template_creation_levels(template_to_inputs: Dict[str, Set[str]]) -> List[List[str]]:
+        """
+        split templates into levels, each one having all of its templates' inputs among templates of previous levels (Kahn's algorithm).
+        inputs that are not templates here are already created, so they do not constrain the order
+        """
+        input_count: Dict[str, int] = {}
+        dependants: Dict[str, List[str]] = {}
+        for path_id, inputs in template_to_inputs.items():
+            template_inputs = [x for x in inputs if x in template_to_inputs]
+            input_count[path_id] = len(template_inputs)
+            for input_path_id in template_inputs:
+                dependants.setdefault(input_path_id, []).append(path_id)
+
+        levels = []
+        level = [path_id for path_id, count in input_count.items() if count == 0]
+        ordered_count = 0
+        while level:
+            levels.append(level)
+            ordered_count += len(level)
+            next_level = []
+            for path_id in level:
+                for dependant in dependants.get(path_id, ()):
+                    input_count[dependant] -= 1
+                    if input_count[dependant] == 0:
+                        next_level.append(dependant)
+            level = next_level
+
+        if ordered_count != len(input_count):
+            # whatever is left either is in a cycle or is downstream of one
+            stuck = sorted(path_id for path_id, count in input_count.items() if count > 0)
+            raise DependencyCycleError(f'asset templates trigger each other in a cycle, cannot create versions for: {", ".join(stuck)}')
+        return levels
+
     def _trigger_relevant_asset_templates(self, asset_version: "AssetVersion") -> List["AssetVersion"]:
         """
         trigger creation of new versions from all relevant templates for which asset_path_id is input.
@@ -187,15 +301,46 @@ class Asset:
 
 
 class AssetVersion:
-    def __init__(self, asset: Asset, version_id: VersionType):
+    __slots__ = ('__asset', '__version_id', '__path_id', '__snapshot_max_age', '__snapshot', '__snapshot_time', '__field_cache', '__weakref__')
+
+    def __init__(self, asset: Asset, version_id: VersionType, snapshot_max_age: Optional[float] = 0.0, *,
+                 version_data: Optional[AssetVersionData] = None, path_id: Optional[str] = None):
+        """
+        :param snapshot_max_age: how old (in seconds) can the snapshot of mutable version state be before it is re-read.
+                                 None means snapshot is only updated by explicit refresh().
+                                 computed data is never changed, so once data is AVAILABLE - snapshot is never re-read implicitly
+        :param version_data: already fetched state of this version to be used as the snapshot.
+                             if not given - handle only carries ids, and the state is fetched on first access to it,
+                             which is also when a version that does not exist is noticed
+        :param path_id: path_id of the version, if known, so that it can be given without fetching the state
+        """
         self.__asset = asset
         self.__version_id = normalize_version(version_id)
-        self._fresh_asset_version_data()  # this will raise if asset+version_id are invalid
+        self.__snapshot_max_age = snapshot_max_age
+        self.__field_cache: Optional[Dict[str, Any]] = None  # most versions never have fields requested
+        self.__snapshot: Optional[AssetVersionData] = version_data
+        self.__snapshot_time = time.monotonic()
+        # these never change for a version
+        self.__path_id = version_data.path_id if version_data is not None else path_id
 
     @classmethod
     def from_path_id(cls, data_provider: DataAccessInterface, version_path_id: str) -> "AssetVersion":
         data = data_provider.get_asset_version_data_from_path_id(version_path_id)
-        return cls(Asset(data.asset_path_id, data_provider), data.version_id)
+        return cls(Asset(data.asset_path_id, data_provider), data.version_id, version_data=data)
+
+    @classmethod
+    def from_path_ids(cls, data_provider: DataAccessInterface, version_path_ids: Iterable[str]) -> List["AssetVersion"]:
+        """
+        batched from_path_id, versions that do not exist are omitted
+        """
+        assets: Dict[str, Asset] = {}
+        result = []
+        for data in data_provider.get_asset_version_datas_from_path_id(version_path_ids):
+            asset = assets.get(data.asset_path_id)
+            if asset is None:
+                asset = assets[data.asset_path_id] = Asset(data.asset_path_id, data_provider)
+            result.append(cls(asset, data.version_id, version_data=data))
+        return result
 
     @property
     def version_id(self) -> VersionType:
@@ -209,50 +354,97 @@ class AssetVersion:
     def data_provider(self) -> DataAccessInterface:
         return self.__asset._get_data_provider()
 
+    def refresh(self) -> AssetVersionData:
+        """
+        re-read version state from data provider
+        """
+        self.__snapshot = self.data_provider.get_asset_version_data(self.__asset.path_id, self.__version_id)
+        self.__snapshot_time = time.monotonic()
+        self.__path_id = self.__snapshot.path_id
+        return self.__snapshot
+
+    def __loaded_snapshot(self) -> AssetVersionData:
+        if self.__snapshot is None:
+            return self.refresh()
+        return self.__snapshot
+
+    def set_snapshot_max_age(self, snapshot_max_age: Optional[float]):
+        self.__snapshot_max_age = snapshot_max_age
+
     def _fresh_asset_version_data(self) -> AssetVersionData:
-        return self.data_provider.get_asset_version_data(self.__asset.path_id, self.__version_id)
+        return self.refresh()
+
+    def _snapshot_asset_version_data(self) -> AssetVersionData:
+        if self.__snapshot is None:  # first access, nothing to be stale yet
+            return self.refresh()
+        snapshot = self.__snapshot
+        if snapshot.data_availability == DataState.AVAILABLE \
+                or self.__snapshot_max_age is None \
+                or time.monotonic() - self.__snapshot_time <= self.__snapshot_max_age:
+            return snapshot
+        # until data is available - nothing but availability changes, so check that cheaply first
+        if self.data_provider.get_data_availability(self.__path_id) == snapshot.data_availability:
+            self.__snapshot_time = time.monotonic()
+            return snapshot
+        return self.refresh()
 
     def schedule_data_calculation_if_needed(self) -> FutureResult:
-        data = self._fresh_asset_version_data()
+        data = self.__loaded_snapshot()
+        if data.data_availability != DataState.AVAILABLE:
+            data = self.refresh()  # scheduling decisions are never made on a stale snapshot
         if data.data_availability == DataState.AVAILABLE:
             return CompletedFuture(True)
         return self.data_provider.schedule_data_computation_for_asset_version(data.path_id)
 
+    @property
+    def data_producer_task_attrs(self) -> GenerationTaskParameters:
+        return self.__loaded_snapshot().data_producer_task_attrs
+
     # AssetVersionData access
     @property
     def path_id(self):
-        data = self._fresh_asset_version_data()
-        return data.path_id
+        if self.__path_id is None:
+            self.refresh()
+        return self.__path_id
 
     def is_data_available(self,):
-        return self._fresh_asset_version_data().data_availability == DataState.AVAILABLE
+        return self._snapshot_asset_version_data().data_availability == DataState.AVAILABLE
 
     def get_data(self):
-        data = self._fresh_asset_version_data()
+        data = self._snapshot_asset_version_data()
         return data.data
 
     def has_field(self, key: str):
-        if not self.is_data_available():
-            raise DataNotYetAvailable()
-        data = self._fresh_asset_version_data()
-        return key in data.data
+        return key in self.get_fields((key,))
 
     def get_field(self, key: str):
+        return self.get_fields((key,))[key]
+
+    def get_fields(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        get given data fields, fields that do not exist in data are omitted.
+        fields are fetched individually without decoding whole data, and cached, as computed data never changes
+        """
         if not self.is_data_available():
             raise DataNotYetAvailable()
-        data = self._fresh_asset_version_data()
-        return data.data[key]
+        keys = list(keys)
+        if self.__field_cache is None:
+            self.__field_cache = {}
+        missing_keys = [key for key in keys if key not in self.__field_cache]
+        if missing_keys:
+            fields = self.data_provider.get_asset_version_data_fields(self.path_id, missing_keys)
+            for key in missing_keys:
+                self.__field_cache[key] = fields.get(key, _missing_field)
+        return {key: self.__field_cache[key] for key in keys if self.__field_cache[key] is not _missing_field}
 
     # TODO: all dependencies are SUPPOSED to return instances of proper classes, not of this one
     #  therefore they need to know director, but i don't want this class to depend on director
     #  so hmmmmmm...
     def get_dependencies(self) -> List["AssetVersion"]:
-        data = self._fresh_asset_version_data()
-        return [AssetVersion.from_path_id(self.data_provider, x) for x in self.data_provider.get_version_dependencies(data.path_id)]
+        return AssetVersion.from_path_ids(self.data_provider, self.data_provider.get_version_dependencies(self.path_id))
 
     def get_dependants(self) -> List["AssetVersion"]:
-        data = self._fresh_asset_version_data()
-        return [AssetVersion.from_path_id(self.data_provider, x) for x in self.data_provider.get_dependent_versions(data.path_id)]
+        return AssetVersion.from_path_ids(self.data_provider, self.data_provider.get_dependent_versions(self.path_id))
 
     def add_dependencies(self, dependencies: Iterable["AssetVersion"]):
         self.data_provider.add_dependencies(self.path_id, (dep.path_id for dep in dependencies))
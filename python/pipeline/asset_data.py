@@ -2,6 +2,7 @@ import json
 from enum import Enum
 from dataclasses import dataclass
 from .generation_task_parameters import GenerationTaskParameters
+from .instrumentation import timed_json_loads
 
 from typing import List, Optional, Tuple
 
@@ -17,6 +18,7 @@ class AssetData:
     path_id: str
     name: str
     description: str
+    type_name: Optional[str] = None  # filled by data accessors, so that asset type does not need a separate lookup
 
 
 @dataclass
@@ -30,6 +32,65 @@ class AssetVersionData:
     data: Optional[dict]
 
 
+class LazyAssetVersionData(AssetVersionData):
+    """
+    AssetVersionData that keeps data_producer_task_attrs and data serialized until they are first accessed
+    """
+    def __init__(self, path_id: str, asset_path_id: str, version_id: Tuple[int, int, int],
+                 serialized_data_producer_task_attrs: str, data_availability: DataState, data_calculator_id: str,
+                 serialized_data: Optional[str]):
+        # not calling dataclass __init__, as it would overwrite lazy fields
+        self.path_id = path_id
+        self.asset_path_id = asset_path_id
+        self.version_id = version_id
+        self.data_availability = data_availability
+        self.data_calculator_id = data_calculator_id
+        self.__serialized_task_attrs = serialized_data_producer_task_attrs
+        self.__task_attrs = None
+        self.__serialized_data = serialized_data
+        self.__data = None
+
+    @property
+    def data_producer_task_attrs(self) -> GenerationTaskParameters:
+        if self.__serialized_task_attrs is not None:
+            self.__task_attrs = GenerationTaskParameters.deserialize(self.__serialized_task_attrs)
+            self.__serialized_task_attrs = None
+        return self.__task_attrs
+
+    @data_producer_task_attrs.setter
+    def data_producer_task_attrs(self, value: GenerationTaskParameters):
+        self.__serialized_task_attrs = None
+        self.__task_attrs = value
+
+    @property
+    def data(self) -> Optional[dict]:
+        if self.__serialized_data is not None:
+            self.__data = timed_json_loads(self.__serialized_data)
+            self.__serialized_data = None
+        return self.__data
+
+    @data.setter
+    def data(self, value: Optional[dict]):
+        self.__serialized_data = None
+        self.__data = value
+
+    def serialized_data_producer_task_attrs(self) -> str:
+        """
+        data_producer_task_attrs serialized. if they were not accessed yet - the original string, without decoding it
+        """
+        if self.__serialized_task_attrs is not None:
+            return self.__serialized_task_attrs
+        return self.__task_attrs.serialize()
+
+    def serialized_data(self) -> Optional[str]:
+        """
+        data serialized. if it was not accessed yet - the original string, without decoding it
+        """
+        if self.__serialized_data is not None:
+            return self.__serialized_data
+        return json.dumps(self.__data) if self.__data is not None else None
+
+
 @dataclass
 class AssetTemplateData:
     asset_path_id: str
@@ -37,3 +98,33 @@ class AssetTemplateData:
 
     def __hash__(self):
         return hash(self.asset_path_id)
+
+
+class ChangeType(Enum):
+    ASSET_CREATED = 0
+    VERSION_PUBLISHED = 1
+    VERSION_DATA_STATE_CHANGED = 2
+    TEMPLATE_CHANGED = 3
+    DEPENDENCY_ADDED = 4
+    DEPENDENCY_REMOVED = 5
+
+
+@dataclass
+class ChangeRecord:
+    """
+    one entry of data change feed.
+    path_id is the path_id of whatever changed: asset, asset version, or asset of template.
+    for dependency changes path_id is the dependant, other_path_id is what it depends on.
+    for published versions other_path_id is version's asset
+    """
+    seq: int
+    change_type: ChangeType
+    path_id: str
+    other_path_id: Optional[str] = None
+
+
+@dataclass
+class DependencyEdge:
+    dependant: str
+    depends_on: str
+    depth: int
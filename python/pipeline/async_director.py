@@ -0,0 +1,208 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import Executor, ThreadPoolExecutor
+from .asset import Asset, AssetVersion
+from .asset_data import AssetData, AssetVersionData, AssetTemplateData, DataState, DependencyEdge, ChangeRecord
+from .data_access_interface import DataAccessInterface
+from .director import Director
+from .future import FutureResult
+from .uri import Uri
+from .version_locks import get_version_lock_context
+
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple, Union
+
+
+class AsyncRunner:
+    """
+    runs blocking calls on a bounded executor.
+    identical calls (by key) that are already in flight are not run again, instead callers share the result.
+    calls run in a copy of caller's context, so context variables (version locks, director session, instrumentation)
+    are the same as in the caller. coalesced calls run in the context of the first caller
+
+    one runner should be used from a single event loop
+    """
+    def __init__(self, max_concurrency: int = 8, executor: Optional[Executor] = None):
+        self.__own_executor = executor is None
+        self.__executor = executor or ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='pipeline_async')
+        self.__max_concurrency = max_concurrency
+        self.__semaphore: Optional[asyncio.Semaphore] = None
+        self.__in_flight: Dict[Hashable, asyncio.Future] = {}
+
+    async def run(self, key: Optional[Hashable], func: Callable, *args) -> Any:
+        """
+        run func(*args) in executor.
+        if key is not None - concurrent calls with the same key are coalesced into one
+        """
+        if key is None:
+            return await self.__run(func, *args)
+        future = self.__in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self.__run(func, *args))
+            self.__in_flight[key] = future
+            future.add_done_callback(lambda _: self.__in_flight.pop(key, None))
+        # shielded, so that one cancelled caller does not cancel the call for everyone else
+        return await asyncio.shield(future)
+
+    async def __run(self, func: Callable, *args) -> Any:
+        if self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.__max_concurrency)
+        async with self.__semaphore:
+            # run_in_executor does not pass context to the executor thread by itself
+            context = contextvars.copy_context()
+            return await asyncio.get_running_loop().run_in_executor(self.__executor, functools.partial(context.run, func, *args))
+
+    def in_flight_count(self) -> int:
+        return len(self.__in_flight)
+
+    def shutdown(self, wait: bool = True):
+        if self.__own_executor:
+            self.__executor.shutdown(wait=wait)
+
+
+class AsyncDataAccessInterface:
+    """
+    asyncio front for any DataAccessInterface.
+    read requests are coalesced, write requests are always executed
+    """
+    def __init__(self, data_accessor: DataAccessInterface, runner: Optional[AsyncRunner] = None, max_concurrency: int = 8):
+        self.__data_accessor = data_accessor
+        self.__runner = runner or AsyncRunner(max_concurrency)
+
+    def get_data_accessor(self) -> DataAccessInterface:
+        return self.__data_accessor
+
+    def get_runner(self) -> AsyncRunner:
+        return self.__runner
+
+    async def __read(self, method_name: str, *args):
+        return await self.__runner.run((method_name, *args), getattr(self.__data_accessor, method_name), *args)
+
+    async def __write(self, method_name: str, *args):
+        return await self.__runner.run(None, getattr(self.__data_accessor, method_name), *args)
+
+    async def get_asset_data(self, asset_path_id: str) -> AssetData:
+        return await self.__read('get_asset_data', asset_path_id)
+
+    async def get_asset_type_name(self, asset_path_id: str) -> str:
+        return await self.__read('get_asset_type_name', asset_path_id)
+
+    async def get_asset_datas(self, asset_path_ids: Iterable[str]) -> List[AssetData]:
+        return await self.__read('get_asset_datas', tuple(asset_path_ids))
+
+    async def get_asset_version_data(self, asset_path_id: str, version_id: Optional[Tuple[int, int, int]]) -> AssetVersionData:
+        return await self.__read('get_asset_version_data', asset_path_id, tuple(version_id) if version_id is not None else None)
+
+    async def get_asset_version_data_from_path_id(self, asset_version_path_id: str) -> AssetVersionData:
+        return await self.__read('get_asset_version_data_from_path_id', asset_version_path_id)
+
+    async def get_asset_version_datas_from_path_id(self, asset_version_path_ids: Iterable[str]) -> List[AssetVersionData]:
+        return await self.__read('get_asset_version_datas_from_path_id', tuple(asset_version_path_ids))
+
+    async def get_data_availabilities(self, asset_version_path_ids: Iterable[str]) -> Dict[str, DataState]:
+        return await self.__read('get_data_availabilities', tuple(asset_version_path_ids))
+
+    async def get_asset_versions_data_fields(self, asset_version_path_ids: Iterable[str], keys: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        return await self.__read('get_asset_versions_data_fields', tuple(asset_version_path_ids), tuple(keys))
+
+    async def get_version_dependencies(self, version_path_id: str) -> List[str]:
+        return await self.__read('get_version_dependencies', version_path_id)
+
+    async def get_dependent_versions(self, version_path_id: str) -> List[str]:
+        return await self.__read('get_dependent_versions', version_path_id)
+
+    async def get_transitive_dependencies(self, version_path_ids: Iterable[str], max_depth: Optional[int] = None) -> List[DependencyEdge]:
+        return await self.__read('get_transitive_dependencies', tuple(version_path_ids), max_depth)
+
+    async def get_transitive_dependants(self, version_path_ids: Iterable[str], max_depth: Optional[int] = None) -> List[DependencyEdge]:
+        return await self.__read('get_transitive_dependants', tuple(version_path_ids), max_depth)
+
+    async def get_asset_templates_triggered_by(self, asset_path_id: str) -> List[AssetTemplateData]:
+        return await self.__read('get_asset_templates_triggered_by', asset_path_id)
+
+    async def get_changes_since(self, seq: int, limit: Optional[int] = None) -> List[ChangeRecord]:
+        return await self.__read('get_changes_since', seq, limit)
+
+    async def get_last_change_seq(self) -> int:
+        return await self.__read('get_last_change_seq')
+
+    async def schedule_data_computation_for_asset_version(self, path_id: str) -> FutureResult:
+        # scheduling the same version twice at the same time makes no sense, so this one is coalesced too
+        return await self.__read('schedule_data_computation_for_asset_version', path_id)
+
+    async def publish_new_asset_version(self, asset_path_id: str, version_data: AssetVersionData, dependencies: Iterable[str]) -> AssetVersionData:
+        return await self.__write('publish_new_asset_version', asset_path_id, version_data, tuple(dependencies))
+
+    async def publish_new_asset_versions(self, batch: Iterable[Tuple[str, AssetVersionData, Iterable[str]]]) -> List[AssetVersionData]:
+        return await self.__write('publish_new_asset_versions', [(pid, data, tuple(deps)) for pid, data, deps in batch])
+
+    async def add_dependencies(self, version_path_id: str, dependency_path_ids: Iterable[str]):
+        return await self.__write('add_dependencies', version_path_id, tuple(dependency_path_ids))
+
+    async def remove_dependencies(self, version_path_id: str, dependency_path_ids: Iterable[str]):
+        return await self.__write('remove_dependencies', version_path_id, tuple(dependency_path_ids))
+
+
+class AsyncDirector:
+    """
+    asyncio front for a Director.
+    everything is run with the wrapped director on a bounded executor, identical concurrent lookups are coalesced.
+    lookups are only coalesced with ones made with the same version locks, and never inside a director session,
+    as results of those depend on caller's context
+    """
+    def __init__(self, director: Director, max_concurrency: int = 8, executor: Optional[Executor] = None):
+        self.__director = director
+        self.__runner = AsyncRunner(max_concurrency, executor)
+        self.__data_accessor = AsyncDataAccessInterface(director.get_data_accessor(), self.__runner)
+
+    def get_director(self) -> Director:
+        return self.__director
+
+    def get_data_accessor(self) -> AsyncDataAccessInterface:
+        return self.__data_accessor
+
+    def __key(self, *key) -> Optional[Hashable]:
+        if self.__director.in_session():
+            return None
+        return (*key, frozenset(get_version_lock_context().locks().items()))
+
+    async def fetch_uri(self, uri: Union[Uri, str]) -> Any:
+        return await self.__runner.run(self.__key('fetch_uri', str(uri)), self.__director.fetch_uri, uri)
+
+    async def fetch_uris(self, uris: Iterable[Union[Uri, str]]) -> List[Any]:
+        return list(await asyncio.gather(*(self.fetch_uri(uri) for uri in uris)))
+
+    async def is_uri_dynamic(self, uri: Union[Uri, str]) -> bool:
+        return await self.__runner.run(self.__key('is_uri_dynamic', str(uri)), self.__director.is_uri_dynamic, uri)
+
+    async def get_asset(self, path_id: str) -> Asset:
+        return await self.__runner.run(self.__key('get_asset', path_id), self.__director.get_asset, path_id)
+
+    async def get_asset_version(self, path_id: str) -> AssetVersion:
+        return await self.__runner.run(self.__key('get_asset_version', path_id), self.__director.get_asset_version, path_id)
+
+    async def get_asset_versions(self, path_ids: Iterable[str]) -> List[AssetVersion]:
+        path_ids = tuple(path_ids)
+        return await self.__runner.run(self.__key('get_asset_versions', path_ids), self.__director.get_asset_versions, path_ids)
+
+    async def get_assets(self, path_ids: Iterable[str]) -> List[Asset]:
+        path_ids = tuple(path_ids)
+        return await self.__runner.run(self.__key('get_assets', path_ids), self.__director.get_assets, path_ids)
+
+    async def get_dependencies(self, asset_version: AssetVersion) -> List[AssetVersion]:
+        return await self.__runner.run(self.__key('get_dependencies', asset_version.path_id), asset_version.get_dependencies)
+
+    async def get_dependants(self, asset_version: AssetVersion) -> List[AssetVersion]:
+        return await self.__runner.run(self.__key('get_dependants', asset_version.path_id), asset_version.get_dependants)
+
+    async def schedule_data_calculation_if_needed(self, asset_version: AssetVersion) -> FutureResult:
+        return await self.__runner.run(self.__key('schedule_data_calculation_if_needed', asset_version.path_id), asset_version.schedule_data_calculation_if_needed)
+
+    async def wait_for_result(self, future: FutureResult) -> Any:
+        """
+        wait for pipeline's FutureResult without blocking the event loop
+        """
+        return await self.__runner.run(None, future.wait_for_result)
+
+    def shutdown(self, wait: bool = True):
+        self.__runner.shutdown(wait)
@@ -0,0 +1,500 @@
+import json
+import time
+import threading
+from contextlib import contextmanager
+from .asset_data import AssetData, AssetVersionData, LazyAssetVersionData, AssetTemplateData, DataState, DependencyEdge, ChangeType, ChangeRecord
+from .data_access_interface import DataAccessInterface, ChangeLogTrimmedError
+from .future import FutureResult
+from .generation_task_parameters import GenerationTaskParameters
+from .task_scheduling_interface import TaskSchedulingResultReportReceiver
+
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+class CachedDataAccessInterface(DataAccessInterface, TaskSchedulingResultReportReceiver):
+    """
+    write-through L1 cache in front of any DataAccessInterface, for a single long-running process.
+
+    lookups by key (assets, versions, direct dependencies, templates) are cached,
+    graph-wide queries (leaves, transitive walks) always go to the backend.
+    writes go to the backend and drop affected cache entries.
+
+    changes made by other processes are picked up from backend's change feed by sync(),
+    called explicitly or automatically before reads if sync_interval is given.
+    register this object, not the backend, as scheduler's task completion receiver,
+    otherwise completions will only be seen on sync
+    """
+    def __init__(self, backend: DataAccessInterface, sync_interval: Optional[float] = None):
+        """
+        :param backend: data accessor with a change feed. to cache a ShardedDataManager - wrap each of its shards instead
+        :param sync_interval: if not None - reads check backend's change feed if last check was longer than that many seconds ago
+        """
+        super().__init__(backend.get_task_scheduler())
+        self.__backend = backend
+        self.__sync_interval = sync_interval
+        self.__lock = threading.Lock()
+        # invalidations done inside current thread's transaction(), None outside of one
+        self.__local = threading.local()
+        # any invalidation bumps generation, results fetched from backend before that are not cached
+        self.__generation = 0
+        try:
+            self.__last_seq = backend.get_last_change_seq()
+        except NotImplementedError:
+            raise ValueError('backend has no change feed to keep cache in sync with') from None
+        self.__last_sync_time = time.monotonic()
+
+        self.__assets: Dict[str, AssetData] = {}
+        self.__asset_type_names: Dict[str, str] = {}
+        # versions are kept serialized, so that every read produces independent objects
+        self.__versions: Dict[str, Tuple[str, Tuple[int, int, int], str, DataState, Any, Optional[str]]] = {}
+        self.__version_path_ids: Dict[Tuple[str, Tuple[int, int, int]], str] = {}
+        self.__latest_version_path_ids: Dict[str, str] = {}
+        self.__dependencies: Dict[str, Tuple[str, ...]] = {}
+        self.__dependants: Dict[str, Tuple[str, ...]] = {}
+        self.__templates: Dict[str, Optional[str]] = {}
+        self.__templates_triggered_by: Dict[str, Tuple[str, ...]] = {}
+        self.__template_fixed_dependencies: Dict[str, Tuple[str, ...]] = {}
+
+    def get_backend(self) -> DataAccessInterface:
+        return self.__backend
+
+    # cache maintenance
+
+    def sync(self):
+        """
+        drop cache entries changed in the backend since the last sync
+        """
+        now = time.monotonic()
+        try:
+            changes = self.__backend.get_changes_since(self.__last_seq)
+        except ChangeLogTrimmedError:
+            last_seq = self.__backend.get_last_change_seq()
+            self.clear()
+            self.__last_seq = last_seq
+        else:
+            if changes:
+                with self.__lock:
+                    for change in changes:
+                        self.__invalidate(change.change_type, change.path_id, change.other_path_id)
+                self.__last_seq = changes[-1].seq
+        self.__last_sync_time = now
+
+    def clear(self):
+        with self.__lock:
+            self.__generation += 1
+            for cache in (self.__assets, self.__asset_type_names, self.__versions, self.__version_path_ids,
+                          self.__latest_version_path_ids, self.__dependencies, self.__dependants,
+                          self.__templates, self.__templates_triggered_by, self.__template_fixed_dependencies):
+                cache.clear()
+
+    def __maybe_sync(self):
+        if self.__sync_interval is not None and time.monotonic() - self.__last_sync_time > self.__sync_interval:
+            self.sync()
+
+    def __invalidate(self, change_type: ChangeType, path_id: str, other_path_id: Optional[str] = None):
+        # must be called under lock
+        self.__generation += 1
+        pending = getattr(self.__local, 'pending', None)
+        if pending is not None:
+            pending.append((change_type, path_id, other_path_id))
+        if change_type == ChangeType.VERSION_PUBLISHED:
+            self.__latest_version_path_ids.pop(other_path_id, None)
+        elif change_type == ChangeType.VERSION_DATA_STATE_CHANGED:
+            self.__versions.pop(path_id, None)
+        elif change_type == ChangeType.TEMPLATE_CHANGED:
+            self.__templates.pop(path_id, None)
+            self.__template_fixed_dependencies.pop(path_id, None)
+            self.__templates_triggered_by.clear()
+        elif change_type in (ChangeType.DEPENDENCY_ADDED, ChangeType.DEPENDENCY_REMOVED):
+            self.__dependencies.pop(path_id, None)
+            self.__dependants.pop(other_path_id, None)
+
+    def __invalidate_now(self, change_type: ChangeType, path_id: str, other_path_id: Optional[str] = None):
+        with self.__lock:
+            self.__invalidate(change_type, path_id, other_path_id)
+
+    def __cache_version(self, version_data: AssetVersionData):
+        # must be called under lock
+        if isinstance(version_data, LazyAssetVersionData):
+            # whatever backend has not decoded yet is cached as it is, without decoding and encoding it again
+            task_attrs = version_data.serialized_data_producer_task_attrs()
+            data = version_data.serialized_data()
+        else:
+            task_attrs = version_data.data_producer_task_attrs.serialize()
+            data = json.dumps(version_data.data) if version_data.data is not None else None
+        self.__versions[version_data.path_id] = (version_data.asset_path_id,
+                                                 tuple(version_data.version_id),
+                                                 task_attrs,
+                                                 version_data.data_availability,
+                                                 version_data.data_calculator_id,
+                                                 data)
+        self.__version_path_ids[(version_data.asset_path_id, tuple(version_data.version_id))] = version_data.path_id
+
+    def __cached_version(self, path_id: str) -> Optional[AssetVersionData]:
+        # must be called under lock
+        cached = self.__versions.get(path_id)
+        if cached is None:
+            return None
+        asset_path_id, version_id, task_attrs, availability, calculator_id, data = cached
+        return LazyAssetVersionData(path_id, asset_path_id, version_id, task_attrs, availability, calculator_id, data)
+
+    # getters
+
+    def get_asset_type_name(self, asset_path_id: str):
+        self.__maybe_sync()
+        with self.__lock:
+            type_name = self.__asset_type_names.get(asset_path_id)
+        if type_name is None:
+            type_name = self.__backend.get_asset_type_name(asset_path_id)
+            with self.__lock:  # asset types never change
+                self.__asset_type_names[asset_path_id] = type_name
+        return type_name
+
+    def get_asset_datas(self, asset_path_ids: Iterable[str]) -> List[AssetData]:
+        self.__maybe_sync()
+        asset_path_ids = list(asset_path_ids)
+        with self.__lock:
+            missing = [x for x in asset_path_ids if x not in self.__assets]
+        if missing:
+            fetched = self.__backend.get_asset_datas(missing)
+            with self.__lock:  # assets never change
+                for asset_data in fetched:
+                    self.__assets[asset_data.path_id] = asset_data
+                    if asset_data.type_name is not None:
+                        self.__asset_type_names[asset_data.path_id] = asset_data.type_name
+        with self.__lock:
+            return [AssetData(x.path_id, x.name, x.description, x.type_name) for x in (self.__assets.get(path_id) for path_id in asset_path_ids) if x is not None]
+
+    def get_asset_version_datas(self, asset_path_id_version_pairs: Iterable[Tuple[str, Optional[Tuple[int, int, int]]]]) -> List[AssetVersionData]:
+        self.__maybe_sync()
+        pairs = [(asset_path_id, tuple(version_id) if version_id is not None else None) for asset_path_id, version_id in asset_path_id_version_pairs]
+        with self.__lock:
+            path_ids = [self.__latest_version_path_ids.get(asset_path_id) if version_id is None else self.__version_path_ids.get((asset_path_id, version_id))
+                        for asset_path_id, version_id in pairs]
+            missing = [pair for pair, path_id in zip(pairs, path_ids) if path_id is None or path_id not in self.__versions]
+            generation = self.__generation
+        if missing:
+            fetched = self.__backend.get_asset_version_datas(missing)
+            with self.__lock:
+                if generation == self.__generation:
+                    for version_data in fetched:
+                        self.__cache_version(version_data)
+                    for asset_path_id, version_id in missing:
+                        if version_id is None:
+                            latest = max((x for x in fetched if x.asset_path_id == asset_path_id), key=lambda x: x.version_id, default=None)
+                            if latest is not None:
+                                self.__latest_version_path_ids[asset_path_id] = latest.path_id
+            if generation != self.__generation:  # changed while we were fetching, just give what backend gave
+                return self.__backend.get_asset_version_datas(pairs)
+        result = []
+        with self.__lock:
+            for asset_path_id, version_id in pairs:
+                if version_id is None:
+                    path_id = self.__latest_version_path_ids.get(asset_path_id)
+                else:
+                    path_id = self.__version_path_ids.get((asset_path_id, version_id))
+                version_data = self.__cached_version(path_id) if path_id is not None else None
+                if version_data is not None:
+                    result.append(version_data)
+        return result
+
+    def get_asset_version_datas_from_path_id(self, asset_version_path_ids: Iterable[str]) -> List[AssetVersionData]:
+        self.__maybe_sync()
+        asset_version_path_ids = list(asset_version_path_ids)
+        with self.__lock:
+            missing = [x for x in asset_version_path_ids if x not in self.__versions]
+            generation = self.__generation
+        fetched = {}
+        if missing:
+            fetched = {x.path_id: x for x in self.__backend.get_asset_version_datas_from_path_id(missing)}
+            with self.__lock:
+                if generation == self.__generation:
+                    for version_data in fetched.values():
+                        self.__cache_version(version_data)
+        result = []
+        with self.__lock:
+            for path_id in asset_version_path_ids:
+                version_data = self.__cached_version(path_id) or fetched.get(path_id)
+                if version_data is not None:
+                    result.append(version_data)
+        return result
+
+    def get_data_availabilities(self, asset_version_path_ids: Iterable[str]) -> Dict[str, DataState]:
+        self.__maybe_sync()
+        asset_version_path_ids = list(asset_version_path_ids)
+        with self.__lock:
+            cached = {x: self.__versions[x][3] for x in asset_version_path_ids if x in self.__versions}
+        missing = [x for x in asset_version_path_ids if x not in cached]
+        if missing:
+            cached.update(self.__backend.get_data_availabilities(missing))
+        return {x: cached[x] for x in asset_version_path_ids if x in cached}
+
+    def get_asset_versions_data_fields(self, asset_version_path_ids: Iterable[str], keys: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        self.__maybe_sync()
+        asset_version_path_ids = list(asset_version_path_ids)
+        with self.__lock:
+            all_cached = all(x in self.__versions for x in asset_version_path_ids)
+        if not all_cached:
+            return self.__backend.get_asset_versions_data_fields(asset_version_path_ids, keys)
+        return super().get_asset_versions_data_fields(asset_version_path_ids, keys)
+
+    def get_leaf_asset_version_pathids(self, *,
+                                       asset_type_name: Optional[str] = None,
+                                       asset_path_id_prefix: Optional[str] = None,
+                                       after_path_id: Optional[str] = None,
+                                       limit: Optional[int] = None) -> List[str]:
+        return self.__backend.get_leaf_asset_version_pathids(asset_type_name=asset_type_name,
+                                                             asset_path_id_prefix=asset_path_id_prefix,
+                                                             after_path_id=after_path_id,
+                                                             limit=limit)
+
+    def get_asset_datas_page(self, *,
+                             type_name: Optional[str] = None,
+                             prefix: Optional[str] = None,
+                             after_path_id: Optional[str] = None,
+                             limit: Optional[int] = None) -> List[AssetData]:
+        return self.__backend.get_asset_datas_page(type_name=type_name, prefix=prefix, after_path_id=after_path_id, limit=limit)
+
+    def get_asset_version_datas_page(self, *,
+                                     asset_path_id: Optional[str] = None,
+                                     state: Optional[DataState] = None,
+                                     after_path_id: Optional[str] = None,
+                                     limit: Optional[int] = None) -> List[AssetVersionData]:
+        # full listings would just push everything else out of the cache, so pages are not cached
+        return self.__backend.get_asset_version_datas_page(asset_path_id=asset_path_id, state=state, after_path_id=after_path_id, limit=limit)
+
+    # setters
+
+    @contextmanager
+    def transaction(self, wait: bool = True) -> Iterator[None]:
+        """
+        backend's transaction.
+        entries invalidated inside it are invalidated again once it commits, as until then other threads could still cache
+        the old state, and the whole cache is dropped on rollback, as reads inside could have cached what was rolled back
+        """
+        if getattr(self.__local, 'pending', None) is not None:  # nested - just join the outer one
+            with self.__backend.transaction(wait):
+                yield
+            return
+        pending = self.__local.pending = []
+        try:
+            with self.__backend.transaction(wait):
+                yield
+        except BaseException:
+            self.__local.pending = None
+            self.clear()
+            raise
+        self.__local.pending = None
+        with self.__lock:
+            for change in pending:
+                self.__invalidate(*change)
+
+    def publish_new_asset_version(self, asset_path_id: str, version_data: AssetVersionData, dependencies: Iterable[str]) -> AssetVersionData:
+        dependencies = list(dependencies)
+        try:
+            return self.__backend.publish_new_asset_version(asset_path_id, version_data, dependencies)
+        finally:
+            self.__invalidate_published(((asset_path_id, version_data.path_id, dependencies),))
+
+    def publish_new_asset_versions(self, batch: Iterable[Tuple[str, AssetVersionData, Iterable[str]]]) -> List[AssetVersionData]:
+        batch = [(asset_path_id, version_data, list(dependencies)) for asset_path_id, version_data, dependencies in batch]
+        try:
+            return self.__backend.publish_new_asset_versions(batch)
+        finally:
+            self.__invalidate_published([(asset_path_id, version_data.path_id, dependencies) for asset_path_id, version_data, dependencies in batch])
+
+    def __invalidate_published(self, published: Iterable[Tuple[str, Optional[str], List[str]]]):
+        # invalidation also happens on failure, as it's not known how far backend got
+        with self.__lock:
+            for asset_path_id, path_id, dependencies in published:
+                self.__invalidate(ChangeType.VERSION_PUBLISHED, path_id, asset_path_id)
+                for dep in dependencies:
+                    self.__invalidate(ChangeType.DEPENDENCY_ADDED, path_id, dep)
+
+    def create_new_asset(self, asset_type: str, asset_data: AssetData) -> AssetData:
+        return self.__backend.create_new_asset(asset_type, asset_data)
+
+    # templates
+
+    def get_asset_template_datas_for_asset_path_id(self, asset_path_ids: Iterable[str]) -> List[AssetTemplateData]:
+        self.__maybe_sync()
+        asset_path_ids = list(asset_path_ids)
+        with self.__lock:
+            missing = [x for x in asset_path_ids if x not in self.__templates]
+            generation = self.__generation
+        if missing:
+            fetched = {x.asset_path_id: x.data_producer_task_attrs.serialize() for x in self.__backend.get_asset_template_datas_for_asset_path_id(missing)}
+            with self.__lock:
+                if generation == self.__generation:
+                    for asset_path_id in missing:
+                        self.__templates[asset_path_id] = fetched.get(asset_path_id)  # None marks assets without template
+                else:
+                    return self.__backend.get_asset_template_datas_for_asset_path_id(asset_path_ids)
+        with self.__lock:
+            attrs = [(x, self.__templates.get(x)) for x in asset_path_ids]
+        return [AssetTemplateData(x, GenerationTaskParameters.deserialize(attr)) for x, attr in attrs if attr is not None]
+
+    def create_asset_template(self, asset_template_data: AssetTemplateData,
+                                    trigger_asset_path_ids: Iterable[str],
+                                    asset_version_dependencies: Iterable[str]) -> AssetTemplateData:
+        try:
+            return self.__backend.create_asset_template(asset_template_data, trigger_asset_path_ids, asset_version_dependencies)
+        finally:
+            self.__invalidate_now(ChangeType.TEMPLATE_CHANGED, asset_template_data.asset_path_id)
+
+    def update_asset_template_data(self, asset_template_data: AssetTemplateData):
+        try:
+            return self.__backend.update_asset_template_data(asset_template_data)
+        finally:
+            self.__invalidate_now(ChangeType.TEMPLATE_CHANGED, asset_template_data.asset_path_id)
+
+    def update_asset_template_datas(self, asset_template_datas: Iterable[AssetTemplateData]):
+        asset_template_datas = list(asset_template_datas)
+        try:
+            return self.__backend.update_asset_template_datas(asset_template_datas)
+        finally:
+            with self.__lock:
+                for asset_template_data in asset_template_datas:
+                    self.__invalidate(ChangeType.TEMPLATE_CHANGED, asset_template_data.asset_path_id)
+
+    def get_asset_templates_triggered_by(self, asset_path_id: str) -> List[AssetTemplateData]:
+        self.__maybe_sync()
+        with self.__lock:
+            template_path_ids = self.__templates_triggered_by.get(asset_path_id)
+            generation = self.__generation
+        if template_path_ids is None:
+            templates = self.__backend.get_asset_templates_triggered_by(asset_path_id)
+            with self.__lock:
+                if generation == self.__generation:
+                    self.__templates_triggered_by[asset_path_id] = tuple(x.asset_path_id for x in templates)
+            return templates
+        return self.get_asset_template_datas_for_asset_path_id(template_path_ids)
+
+    def get_asset_templates_downstream_of(self, asset_path_ids: Iterable[str]) -> List[Tuple[str, AssetTemplateData]]:
+        # one backend query is cheaper than walking the graph through the cache when part of it is missing
+        return self.__backend.get_asset_templates_downstream_of(asset_path_ids)
+
+    def get_template_fixed_dependencies(self, asset_path_id: str) -> Iterable[str]:
+        self.__maybe_sync()
+        with self.__lock:
+            deps = self.__template_fixed_dependencies.get(asset_path_id)
+            generation = self.__generation
+        if deps is None:
+            deps = tuple(self.__backend.get_template_fixed_dependencies(asset_path_id))
+            with self.__lock:
+                if generation == self.__generation:
+                    self.__template_fixed_dependencies[asset_path_id] = deps
+        return list(deps)
+
+    def get_templates_fixed_dependencies(self, asset_path_ids: Iterable[str]) -> Dict[str, List[str]]:
+        self.__maybe_sync()
+        asset_path_ids = list(asset_path_ids)
+        with self.__lock:
+            result = {x: self.__template_fixed_dependencies[x] for x in asset_path_ids if x in self.__template_fixed_dependencies}
+            generation = self.__generation
+        missing = [x for x in asset_path_ids if x not in result]
+        if missing:
+            fetched = self.__backend.get_templates_fixed_dependencies(missing)
+            fetched = {x: tuple(fetched.get(x, ())) for x in missing}
+            with self.__lock:
+                if generation == self.__generation:
+                    self.__template_fixed_dependencies.update(fetched)
+            result.update(fetched)
+        return {x: list(result[x]) for x in asset_path_ids if result[x]}
+
+    # change feed
+
+    def get_changes_since(self, seq: int, limit: Optional[int] = None) -> List[ChangeRecord]:
+        return self.__backend.get_changes_since(seq, limit)
+
+    def get_last_change_seq(self) -> int:
+        return self.__backend.get_last_change_seq()
+
+    # scheduling execution
+
+    def schedule_data_computation_for_asset_version(self, path_id: str) -> FutureResult:
+        try:
+            return self.__backend.schedule_data_computation_for_asset_version(path_id)
+        finally:
+            self.__invalidate_now(ChangeType.VERSION_DATA_STATE_CHANGED, path_id)
+
+    def data_computation_completed_callback(self, path_id: str, data: dict):
+        if not isinstance(self.__backend, TaskSchedulingResultReportReceiver):
+            raise NotImplementedError('backend does not receive task completion reports')
+        try:
+            return self.__backend.data_computation_completed_callback(path_id, data)
+        finally:
+            self.__invalidate_now(ChangeType.VERSION_DATA_STATE_CHANGED, path_id)
+
+    def data_computations_completed_callback(self, completions: Iterable[Tuple[str, dict]]) -> List[Optional[Exception]]:
+        if not isinstance(self.__backend, TaskSchedulingResultReportReceiver):
+            raise NotImplementedError('backend does not receive task completion reports')
+        completions = list(completions)
+        try:
+            return self.__backend.data_computations_completed_callback(completions)
+        finally:
+            with self.__lock:
+                for path_id, _ in completions:
+                    self.__invalidate(ChangeType.VERSION_DATA_STATE_CHANGED, path_id)
+
+    # dependencies
+
+    def get_version_dependencies(self, version_path_id: str) -> Iterable[str]:
+        return self.__get_neighbours(version_path_id, self.__dependencies, self.__backend.get_version_dependencies)
+
+    def get_dependent_versions(self, version_path_id: str) -> Iterable[str]:
+        return self.__get_neighbours(version_path_id, self.__dependants, self.__backend.get_dependent_versions)
+
+    def __get_neighbours(self, version_path_id: str, cache: Dict[str, Tuple[str, ...]], getter) -> List[str]:
+        self.__maybe_sync()
+        with self.__lock:
+            neighbours = cache.get(version_path_id)
+            generation = self.__generation
+        if neighbours is None:
+            neighbours = tuple(getter(version_path_id))
+            with self.__lock:
+                if generation == self.__generation:
+                    cache[version_path_id] = neighbours
+        return list(neighbours)
+
+    def get_transitive_dependencies(self, version_path_ids: Iterable[str], max_depth: Optional[int] = None) -> List[DependencyEdge]:
+        return self.__backend.get_transitive_dependencies(version_path_ids, max_depth)
+
+    def get_transitive_dependants(self, version_path_ids: Iterable[str], max_depth: Optional[int] = None) -> List[DependencyEdge]:
+        return self.__backend.get_transitive_dependants(version_path_ids, max_depth)
+
+    def version_depends_on(self, version_path_id: str, dependency_path_id: str) -> bool:
+        return self.__backend.version_depends_on(version_path_id, dependency_path_id)
+
+    def get_impacted_versions(self, version_path_ids: Iterable[str]) -> List[str]:
+        return self.__backend.get_impacted_versions(version_path_ids)
+
+    def add_dependencies(self, version_path_id: str, dependency_path_ids: Iterable[str]):
+        dependency_path_ids = list(dependency_path_ids)
+        try:
+            return self.__backend.add_dependencies(version_path_id, dependency_path_ids)
+        finally:
+            with self.__lock:
+                for dep in dependency_path_ids:
+                    self.__invalidate(ChangeType.DEPENDENCY_ADDED, version_path_id, dep)
+
+    def remove_dependencies(self, version_path_id: str, dependency_path_ids: Iterable[str]):
+        dependency_path_ids = list(dependency_path_ids)
+        try:
+            return self.__backend.remove_dependencies(version_path_id, dependency_path_ids)
+        finally:
+            with self.__lock:
+                for dep in dependency_path_ids:
+                    self.__invalidate(ChangeType.DEPENDENCY_REMOVED, version_path_id, dep)
+
+    # files location
+
+    def get_pipeline_render_root(self) -> Path:
+        return self.__backend.get_pipeline_render_root()
+
+    def get_pipeline_cache_root(self) -> Path:
+        return self.__backend.get_pipeline_cache_root()
+
+    def get_pipeline_source_root(self) -> Path:
+        return self.__backend.get_pipeline_source_root()
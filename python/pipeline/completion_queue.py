@@ -0,0 +1,161 @@
+import threading
+import time
+from collections import deque
+from .future import FutureResult
+from .task_scheduling_interface import TaskSchedulingResultReportReceiver
+
+from typing import Deque, Iterable, List, Optional, Tuple
+
+
+class CompletionQueueClosedError(RuntimeError):
+    pass
+
+
+class _CompletionFuture(FutureResult):
+    def __init__(self):
+        self.__event = threading.Event()
+        self.__error: Optional[Exception] = None
+
+    def _set_result(self, error: Optional[Exception]):
+        self.__error = error
+        self.__event.set()
+
+    def is_result_ready(self) -> bool:
+        return self.__event.is_set()
+
+    def wait_for_result(self):
+        """
+        waits for the completion to be applied, raises the error it failed with, if any
+        """
+        self.__event.wait()
+        if self.__error is not None:
+            raise self.__error
+
+
+class GroupCommitCompletionQueue(TaskSchedulingResultReportReceiver):
+    """
+    coalesces task completion reports arriving close to each other
+    and hands them to the receiver in batches, so a burst of completions is applied in one transaction
+    instead of one transaction per completion.
+
+    register this object instead of the receiver as scheduler's task completion receiver.
+    data_computation_completed_callback blocks until its batch is applied and raises that completion's own error,
+    so callers see the same behaviour as with the receiver itself, just delayed by up to window seconds.
+    """
+    def __init__(self, receiver: TaskSchedulingResultReportReceiver, window: float = 0.05, max_batch: int = 256):
+        """
+        :param window: how long to wait for more completions after the first one arrives
+        :param max_batch: batch is applied immediately once that many completions are queued
+        """
+        if window < 0:
+            raise ValueError('window must not be negative')
+        if max_batch < 1:
+            raise ValueError('max_batch must be positive')
+        self.__receiver = receiver
+        self.__window = window
+        self.__max_batch = max_batch
+        self.__queue: Deque[Tuple[str, dict, _CompletionFuture]] = deque()
+        self.__cond = threading.Condition()
+        self.__flush_requested = False
+        self.__closed = False
+        self.__worker = threading.Thread(target=self.__worker_loop, name='completion group commit', daemon=True)
+        self.__worker.start()
+
+    def get_receiver(self) -> TaskSchedulingResultReportReceiver:
+        return self.__receiver
+
+    def submit(self, path_id: str, data: dict) -> FutureResult:
+        """
+        queue a completion without waiting for it to be applied
+        """
+        future = _CompletionFuture()
+        with self.__cond:
+            if self.__closed:
+                raise CompletionQueueClosedError('completion queue is closed')
+            self.__queue.append((path_id, data, future))
+            self.__cond.notify_all()
+        return future
+
+    def data_computation_completed_callback(self, path_id: str, data: dict):
+        self.submit(path_id, data).wait_for_result()
+
+    def data_computations_completed_callback(self, completions: Iterable[Tuple[str, dict]]) -> List[Optional[Exception]]:
+        futures = [self.submit(path_id, data) for path_id, data in completions]
+        errors = []
+        for future in futures:
+            try:
+                future.wait_for_result()
+            except Exception as e:
+                errors.append(e)
+            else:
+                errors.append(None)
+        return errors
+
+    def flush(self):
+        """
+        apply everything queued so far without waiting for the window to pass,
+        returns once all of it is applied
+        """
+        with self.__cond:
+            if not self.__queue:
+                return
+            last_future = self.__queue[-1][2]
+            self.__flush_requested = True
+            self.__cond.notify_all()
+        # batches are applied in queue order, so the last one queued is the last one applied
+        self.__wait_future(last_future)
+
+    def close(self):
+        """
+        apply everything still queued and stop the worker.
+        completions submitted after close are refused
+        """
+        with self.__cond:
+            if self.__closed:
+                return
+            self.__closed = True
+            self.__cond.notify_all()
+        self.__worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def __wait_future(future: _CompletionFuture):
+        try:
+            future.wait_for_result()
+        except Exception:
+            pass
+
+    def __take_batch(self) -> Optional[List[Tuple[str, dict, _CompletionFuture]]]:
+        with self.__cond:
+            while not self.__queue:
+                if self.__closed:
+                    return None
+                self.__cond.wait()
+            deadline = time.monotonic() + self.__window
+            while len(self.__queue) < self.__max_batch and not self.__flush_requested and not self.__closed:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                self.__cond.wait(timeout)
+            batch = [self.__queue.popleft() for _ in range(min(len(self.__queue), self.__max_batch))]
+            if not self.__queue:
+                self.__flush_requested = False
+            return batch
+
+    def __worker_loop(self):
+        while True:
+            batch = self.__take_batch()
+            if batch is None:
+                return
+            try:
+                errors = self.__receiver.data_computations_completed_callback([(path_id, data) for path_id, data, _ in batch])
+            except Exception as e:
+                # whole batch failed, like a transaction that could not commit
+                errors = [e] * len(batch)
+            for (_, _, future), error in zip(batch, errors):
+                future._set_result(error)
@@ -1,6 +1,8 @@
+from collections import deque
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Iterable, Tuple, List, Optional
-from .asset_data import AssetData, AssetVersionData, AssetTemplateData
+from typing import Any, Callable, Dict, Iterable, Iterator, Tuple, List, Optional
+from .asset_data import AssetData, AssetVersionData, AssetTemplateData, DataState, DependencyEdge, ChangeRecord
 from .task_scheduling_interface import TaskSchedulingInterface
 from .future import FutureResult
 
@@ -9,6 +11,28 @@ class NotFoundError(RuntimeError):
     pass
 
 
+class DependencyCycleError(RuntimeError):
+    pass
+
+
+class ReadOnlyError(RuntimeError):
+    pass
+
+
+class WriteLockBusyError(RuntimeError):
+    """
+    someone else is writing, and caller chose not to wait for them, see DataAccessInterface.transaction()
+    """
+    pass
+
+
+class ChangeLogTrimmedError(RuntimeError):
+    """
+    requested changes are not in the change log anymore, client has to re-read everything
+    """
+    pass
+
+
 class TaskSchedulerNotAvailable(RuntimeError):
     """
     base exception for everything related to not being able to connect to data computation mechanism
@@ -57,18 +81,142 @@ class DataAccessInterface:
     def get_asset_version_datas_from_path_id(self, asset_version_path_id: Iterable[str]) -> List[AssetVersionData]:
         raise NotImplementedError()
 
-    def get_leaf_asset_version_pathids(self) -> List[str]:
+    def get_data_availability(self, asset_version_path_id: str) -> DataState:
+        availabilities = self.get_data_availabilities((asset_version_path_id,))
+        if asset_version_path_id not in availabilities:
+            raise NotFoundError()
+        return availabilities[asset_version_path_id]
+
+    def get_data_availabilities(self, asset_version_path_ids: Iterable[str]) -> Dict[str, DataState]:
+        """
+        get data availability of given versions, without fetching anything else.
+        versions that do not exist are omitted from the result
         """
-        get ALL asset versions that NOTHING DEPENDS ON
+        return {x.path_id: x.data_availability for x in self.get_asset_version_datas_from_path_id(asset_version_path_ids)}
 
+    def get_asset_version_data_fields(self, asset_version_path_id: str, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        get only given top level fields of version's data.
+        fields missing in data are omitted from the result
+        """
+        fields = self.get_asset_versions_data_fields((asset_version_path_id,), keys)
+        if asset_version_path_id not in fields:
+            raise NotFoundError()
+        return fields[asset_version_path_id]
+
+    def get_asset_versions_data_fields(self, asset_version_path_ids: Iterable[str], keys: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        get only given top level fields of data of each of given versions.
+        versions that do not exist are omitted from the result,
+        versions without data yet and fields missing in data have nothing in their field dicts
+        """
+        keys = list(keys)
+        return {x.path_id: {key: x.data[key] for key in keys if key in x.data} if x.data is not None else {}
+                for x in self.get_asset_version_datas_from_path_id(asset_version_path_ids)}
+
+    def get_leaf_asset_version_pathids(self, *,
+                                       asset_type_name: Optional[str] = None,
+                                       asset_path_id_prefix: Optional[str] = None,
+                                       after_path_id: Optional[str] = None,
+                                       limit: Optional[int] = None) -> List[str]:
+        """
+        get ALL asset versions that NOTHING DEPENDS ON, ordered by path_id
+
+        :param asset_type_name: only versions of assets of this type
+        :param asset_path_id_prefix: only versions of assets whose path_id starts with this
+        :param after_path_id: only versions with path_id greater than this, to continue from the last page
+        :param limit: return at most this many
         :return:
         """
         raise NotImplementedError()
 
+    # catalogue listing
+    # pages are ordered by path_id and continue from the last path_id of the previous page (keyset pagination),
+    # so every page costs the same no matter how deep into the listing it is
+
+    def get_asset_datas_page(self, *,
+                             type_name: Optional[str] = None,
+                             prefix: Optional[str] = None,
+                             after_path_id: Optional[str] = None,
+                             limit: Optional[int] = None) -> List[AssetData]:
+        """
+        get assets ordered by path_id
+
+        :param type_name: only assets of this type
+        :param prefix: only assets whose path_id starts with this
+        :param after_path_id: only assets with path_id greater than this, to continue from the last page
+        :param limit: return at most this many
+        """
+        raise NotImplementedError()
+
+    def get_asset_version_datas_page(self, *,
+                                     asset_path_id: Optional[str] = None,
+                                     state: Optional[DataState] = None,
+                                     after_path_id: Optional[str] = None,
+                                     limit: Optional[int] = None) -> List[AssetVersionData]:
+        """
+        get asset versions ordered by path_id
+
+        :param asset_path_id: only versions of this asset
+        :param state: only versions with this data availability
+        :param after_path_id: only versions with path_id greater than this, to continue from the last page
+        :param limit: return at most this many
+        """
+        raise NotImplementedError()
+
+    def iter_assets(self, type_name: Optional[str] = None, prefix: Optional[str] = None, *, page_size: int = 1000) -> Iterator[AssetData]:
+        """
+        iterate over all assets in path_id order, fetching them page_size at a time.
+        assets created during iteration are seen if their path_id is past the current page
+        """
+        if page_size < 1:
+            raise ValueError('page_size must be positive')
+        after_path_id = None
+        while True:
+            page = self.get_asset_datas_page(type_name=type_name, prefix=prefix, after_path_id=after_path_id, limit=page_size)
+            yield from page
+            if len(page) < page_size:
+                return
+            after_path_id = page[-1].path_id
+
+    def iter_asset_versions(self, asset_path_id: Optional[str] = None, state: Optional[DataState] = None, *, page_size: int = 1000) -> Iterator[AssetVersionData]:
+        """
+        iterate over all asset versions in path_id order, fetching them page_size at a time.
+        versions published during iteration are seen if their path_id is past the current page
+        """
+        if page_size < 1:
+            raise ValueError('page_size must be positive')
+        after_path_id = None
+        while True:
+            page = self.get_asset_version_datas_page(asset_path_id=asset_path_id, state=state, after_path_id=after_path_id, limit=page_size)
+            yield from page
+            if len(page) < page_size:
+                return
+            after_path_id = page[-1].path_id
+
     # setters
+    @contextmanager
+    def transaction(self, wait: bool = True) -> Iterator[None]:
+        """
+        writes done inside this block are applied all together, or none of them are.
+        nested blocks join the outer one, reads inside the block see its writes.
+        if wait is False and someone else is writing - WriteLockBusyError is raised right away instead of waiting for them
+
+        default implementation gives no atomicity at all, for backends that cannot provide it
+        """
+        yield
+
     def publish_new_asset_version(self, asset_path_id: str, version_data: AssetVersionData, dependencies: Iterable[str]) -> AssetVersionData:
         raise NotImplementedError()
 
+    def publish_new_asset_versions(self, batch: Iterable[Tuple[str, AssetVersionData, Iterable[str]]]) -> List[AssetVersionData]:
+        """
+        publish many versions at once, batch consists of publish_new_asset_version arguments.
+        versions are published in batch order, so later ones may depend on earlier ones.
+        implementations should do it atomically
+        """
+        return [self.publish_new_asset_version(asset_path_id, version_data, dependencies) for asset_path_id, version_data, dependencies in batch]
+
     def create_new_asset(self, asset_type: str, asset_data: AssetData) -> AssetData:
         raise NotImplementedError()
 
@@ -96,12 +244,63 @@ class DataAccessInterface:
     def update_asset_template_data(self, asset_template_data: AssetTemplateData):
         raise NotImplementedError()
 
+    def update_asset_template_datas(self, asset_template_datas: Iterable[AssetTemplateData]):
+        """
+        update many templates at once, implementations should do it atomically
+        """
+        with self.transaction():
+            for asset_template_data in asset_template_datas:
+                self.update_asset_template_data(asset_template_data)
+
     def get_asset_templates_triggered_by(self, asset_path_id: str) -> List[AssetTemplateData]:
         """
         get all asset templates that will be triggered by a change in "asset_path_id" asset
         """
         raise NotImplementedError()
 
+    def get_asset_templates_downstream_of(self, asset_path_ids: Iterable[str]) -> List[Tuple[str, AssetTemplateData]]:
+        """
+        get the whole template graph downstream of given assets:
+        every (triggering asset path_id, triggered template) pair reachable from them through template triggers.
+        a template triggered by several reachable assets appears once per such asset.
+
+        default implementation walks the graph asking get_asset_templates_triggered_by once per reachable asset,
+        implementations should do it in one go
+        """
+        edges = []
+        seen = set()
+        queue = deque()
+        for asset_path_id in asset_path_ids:
+            if asset_path_id not in seen:
+                seen.add(asset_path_id)
+                queue.append(asset_path_id)
+        while queue:
+            asset_path_id = queue.popleft()
+            for template_data in self.get_asset_templates_triggered_by(asset_path_id):
+                edges.append((asset_path_id, template_data))
+                if template_data.asset_path_id not in seen:
+                    seen.add(template_data.asset_path_id)
+                    queue.append(template_data.asset_path_id)
+        return edges
+
+    # change feed
+    def get_changes_since(self, seq: int, limit: Optional[int] = None) -> List[ChangeRecord]:
+        """
+        get changes made after the change with given seq number, in order they were made.
+        seq=0 means from the very beginning.
+        to follow changes - pass seq of the last received record to the next call
+
+        :raises ChangeLogTrimmedError: if some of the requested changes were already removed from the log
+        """
+        raise NotImplementedError()
+
+    def get_last_change_seq(self) -> int:
+        """
+        seq number of the latest change, 0 if there were none.
+        client that reads everything should get this BEFORE reading, and follow changes since it
+        """
+        raise NotImplementedError()
+
     # scheduling execution
     def get_task_scheduler(self):
         return self.__task_scheduler
@@ -127,6 +326,54 @@ class DataAccessInterface:
         """
         raise NotImplementedError()
 
+    def get_transitive_dependencies(self, version_path_ids: Iterable[str], max_depth: Optional[int] = None) -> List[DependencyEdge]:
+        """
+        get all dependency edges upstream of given versions.
+        edge depth is the shortest number of hops from given versions, direct dependencies have depth 1
+        """
+        return self._walk_dependency_edges(version_path_ids, max_depth, self.get_version_dependencies, False)
+
+    def get_transitive_dependants(self, version_path_ids: Iterable[str], max_depth: Optional[int] = None) -> List[DependencyEdge]:
+        """
+        get all dependency edges downstream of given versions.
+        edge depth is the shortest number of hops from given versions, direct dependants have depth 1
+        """
+        return self._walk_dependency_edges(version_path_ids, max_depth, self.get_dependent_versions, True)
+
+    @staticmethod
+    def _walk_dependency_edges(version_path_ids: Iterable[str], max_depth: Optional[int],
+                               get_neighbours: Callable[[str], Iterable[str]], downstream: bool) -> List[DependencyEdge]:
+        """
+        generic breadth-first walk, implementations are expected to override the public methods with something smarter
+        """
+        edges = []
+        visited = set(version_path_ids)
+        layer = list(visited)
+        depth = 1
+        while layer and (max_depth is None or depth <= max_depth):
+            next_layer = []
+            for path_id in layer:
+                for neighbour in get_neighbours(path_id):
+                    edges.append(DependencyEdge(neighbour, path_id, depth) if downstream else DependencyEdge(path_id, neighbour, depth))
+                    if neighbour not in visited:
+                        visited.add(neighbour)
+                        next_layer.append(neighbour)
+            layer = next_layer
+            depth += 1
+        return edges
+
+    def version_depends_on(self, version_path_id: str, dependency_path_id: str) -> bool:
+        """
+        check if version_path_id depends on dependency_path_id, directly or transitively
+        """
+        return any(edge.depends_on == dependency_path_id for edge in self.get_transitive_dependencies((version_path_id,)))
+
+    def get_impacted_versions(self, version_path_ids: Iterable[str]) -> List[str]:
+        """
+        get path_ids of all versions that depend on any of given, directly or transitively
+        """
+        return list(dict.fromkeys(edge.dependant for edge in self.get_transitive_dependants(version_path_ids)))
+
     def add_dependencies(self, version_path_id: str, dependency_path_ids: Iterable[str]):
         """
         add dependencies to given version_path_id
@@ -146,6 +393,12 @@ class DataAccessInterface:
         """
         raise NotImplementedError()
 
+    def get_templates_fixed_dependencies(self, asset_path_ids: Iterable[str]) -> Dict[str, List[str]]:
+        """
+        batched get_template_fixed_dependencies, assets without fixed dependencies may be omitted
+        """
+        return {asset_path_id: list(self.get_template_fixed_dependencies(asset_path_id)) for asset_path_id in asset_path_ids}
+
     # files location
     def get_pipeline_render_root(self) -> Path:
         raise NotImplementedError()
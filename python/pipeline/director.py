@@ -1,20 +1,40 @@
-from .asset_data import AssetData, AssetVersionData
-from .data_access_interface import DataAccessInterface, NotFoundError
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from .asset_data import AssetData, AssetVersionData, ChangeType
+from .data_access_interface import DataAccessInterface, NotFoundError, ChangeLogTrimmedError
 from .asset import Asset, AssetVersion
+from .identity_map import IdentityMap
+from .version_locks import get_version_lock_context
 from .uri_handler import UriHandlerBase, UriNotSupportedError
 from .uri import Uri
+from .utils import VersionType
+from .generation_task_parameters import GenerationTaskParameters
 
-from typing import Iterable, Optional, Type, Union, List, Tuple, Dict, Callable
+from typing import Iterable, Iterator, Optional, Type, Union, List, Tuple, Dict, Callable
 
 
 class AssetFactory:
-    def __call__(self, asset_path_id: str) -> Asset:
+    def __call__(self, asset_path_id: str, asset_data: Optional[AssetData] = None) -> Asset:
         raise NotImplementedError()
 
     def asset_type(self) -> Type[Asset]:
         raise NotImplementedError()
 
 
+class _Session:
+    """
+    identity maps of one open session, and position in data accessor's change feed they are up to date with
+    """
+    __slots__ = ('assets', 'asset_versions', 'change_seq', 'lock')
+
+    def __init__(self, keep_alive: int, change_seq: Optional[int]):
+        self.assets: IdentityMap[Asset] = IdentityMap(keep_alive)
+        self.asset_versions: IdentityMap[AssetVersion] = IdentityMap(keep_alive)
+        self.change_seq = change_seq
+        self.lock = threading.Lock()
+
+
 class Director:
     """
     main configurator class
@@ -23,6 +43,8 @@ class Director:
         self.__data_accessor: DataAccessInterface = data_accessor
         self.__uri_handler: List[UriHandlerBase] = list(uri_handler) if uri_handler else []
         self.__asset_factories: Dict[str, AssetFactory] = {}
+        # identity maps exist only while a session is open, and only for the context that opened it, see session()
+        self.__session: ContextVar[Optional[_Session]] = ContextVar(f'pipeline_director_session_{id(self)}', default=None)
 
     def register_asset_type(self, asset_factory: AssetFactory, asset_type_name: Optional[str] = None):
         self.__asset_factories[asset_type_name or asset_factory.asset_type().type_name()] = asset_factory
@@ -32,16 +54,194 @@ class Director:
             return
         self.__uri_handler.append(uri_handler)
 
+    # session
+
+    @contextmanager
+    def session(self, keep_alive: int = 1024) -> Iterator["Director"]:
+        """
+        within a session get_asset and get_asset_version return the same object for the same path_id,
+        instead of building it from the data accessor every time.
+        session belongs to the context (thread) that opened it, and to contexts copied from it, like calls made through AsyncDirector.
+        other threads keep getting fresh objects.
+        nested sessions just join the outer one.
+
+        objects are kept while they are referenced, plus keep_alive most recently used ones.
+        every version lookup first applies changes from data accessor's change feed, see sync(),
+        so versions completed or changed by anyone are rebuilt.
+        if data accessor has no change feed - objects are only dropped by explicit sync() and invalidate_*()
+        """
+        if self.__session.get() is not None:
+            yield self
+            return
+        token = self.__session.set(_Session(keep_alive, self.__last_change_seq()))
+        try:
+            yield self
+        finally:
+            self.__session.reset(token)
+
+    def in_session(self) -> bool:
+        return self.__session.get() is not None
+
+    def __last_change_seq(self) -> Optional[int]:
+        try:
+            return self.__data_accessor.get_last_change_seq()
+        except NotImplementedError:
+            return None
+
+    def invalidate_asset_version(self, path_id: str):
+        """
+        forget session's object for given version, next get_asset_version will build a new one
+        """
+        session = self.__session.get()
+        if session is not None:
+            session.asset_versions.discard(path_id)
+
+    def invalidate_asset(self, path_id: str):
+        session = self.__session.get()
+        if session is not None:
+            session.assets.discard(path_id)
+
+    def invalidate_all(self):
+        session = self.__session.get()
+        if session is not None:
+            session.assets.clear()
+            session.asset_versions.clear()
+
+    def sync(self):
+        """
+        forget session's objects changed by anyone since session start or last sync, according to data accessor's change feed.
+        if data accessor has no change feed, or it was trimmed - all objects are forgotten
+        """
+        session = self.__session.get()
+        if session is not None:
+            self.__sync_session(session, forced=True)
+
+    def __sync_session(self, session: _Session, forced: bool):
+        with session.lock:
+            seq = session.change_seq
+            if seq is None and not forced:  # nothing to follow, only explicit sync() helps
+                return
+            try:
+                changes = self.__data_accessor.get_changes_since(seq) if seq is not None else None
+            except (NotImplementedError, ChangeLogTrimmedError):
+                changes = None
+            if changes is None:
+                session.assets.clear()
+                session.asset_versions.clear()
+                session.change_seq = self.__last_change_seq()
+                return
+            for change in changes:
+                if change.change_type == ChangeType.VERSION_DATA_STATE_CHANGED:
+                    session.asset_versions.discard(change.path_id)
+                seq = change.seq
+            session.change_seq = seq
+
+    def __synced_session(self) -> Optional[_Session]:
+        session = self.__session.get()
+        if session is not None:
+            self.__sync_session(session, forced=False)
+        return session
+
+    # assets and versions
+
     def get_asset_version(self, path_id: str) -> AssetVersion:
+        session = self.__synced_session()
+        if session is not None:
+            asset_version = session.asset_versions.get(path_id)
+            if asset_version is not None:
+                return asset_version
         asset_ver_data = self.__data_accessor.get_asset_version_data_from_path_id(path_id)
         asset = self.get_asset(asset_ver_data.asset_path_id)
-        return asset.get_version(asset_ver_data.version_id)
+        return self.__remember_version(asset._version_from_data(asset_ver_data))
 
     def get_asset(self, path_id: str) -> Asset:
-        type_name = self.__data_accessor.get_asset_type_name(path_id)
+        session = self.__session.get()
+        if session is not None:
+            asset = session.assets.get(path_id)
+            if asset is not None:
+                return asset
+        # asset data comes with type name, so asset is built from a single lookup
+        asset_data = self.__data_accessor.get_asset_data(path_id)
+        type_name = asset_data.type_name
+        if type_name is None:
+            type_name = self.__data_accessor.get_asset_type_name(path_id)
         if type_name not in self.__asset_factories:
             raise NotFoundError(type_name)  # should probably change this exception type
-        return self.__asset_factories[type_name](path_id)
+        return self.__remember_asset(self.__asset_factories[type_name](path_id, asset_data))
+
+    def get_asset_versions(self, path_ids: Iterable[str]) -> List[AssetVersion]:
+        """
+        same as get_asset_version for each of given path_ids, in the same order,
+        but everything is fetched with a couple of batched lookups, no matter how many versions are requested
+
+        :raises NotFoundError: if any of the versions does not exist
+        """
+        path_ids = list(path_ids)
+        found: Dict[str, AssetVersion] = {}
+        session = self.__synced_session()
+        if session is not None:
+            for path_id in path_ids:
+                asset_version = session.asset_versions.get(path_id)
+                if asset_version is not None:
+                    found[path_id] = asset_version
+        missing = list(dict.fromkeys(x for x in path_ids if x not in found))
+        if missing:
+            asset_ver_datas = self.__data_accessor.get_asset_version_datas_from_path_id(missing)
+            if len(asset_ver_datas) != len(missing):
+                raise NotFoundError(next(iter(set(missing).difference(x.path_id for x in asset_ver_datas))))
+            asset_path_ids = list(dict.fromkeys(x.asset_path_id for x in asset_ver_datas))
+            assets = dict(zip(asset_path_ids, self.get_assets(asset_path_ids)))
+            for asset_ver_data in asset_ver_datas:
+                found[asset_ver_data.path_id] = self.__remember_version(assets[asset_ver_data.asset_path_id]._version_from_data(asset_ver_data))
+        return [found[path_id] for path_id in path_ids]
+
+    def get_assets(self, path_ids: Iterable[str]) -> List[Asset]:
+        """
+        same as get_asset for each of given path_ids, in the same order, with a single batched lookup
+
+        :raises NotFoundError: if any of the assets does not exist
+        """
+        path_ids = list(path_ids)
+        found: Dict[str, Asset] = {}
+        session = self.__session.get()
+        if session is not None:
+            for path_id in path_ids:
+                asset = session.assets.get(path_id)
+                if asset is not None:
+                    found[path_id] = asset
+        missing = list(dict.fromkeys(x for x in path_ids if x not in found))
+        if missing:
+            asset_datas = self.__data_accessor.get_asset_datas(missing)
+            if len(asset_datas) != len(missing):
+                raise NotFoundError(next(iter(set(missing).difference(x.path_id for x in asset_datas))))
+            for asset_data in asset_datas:
+                type_name = asset_data.type_name
+                if type_name is None:
+                    type_name = self.__data_accessor.get_asset_type_name(asset_data.path_id)
+                if type_name not in self.__asset_factories:
+                    raise NotFoundError(type_name)  # should probably change this exception type
+                found[asset_data.path_id] = self.__remember_asset(self.__asset_factories[type_name](asset_data.path_id, asset_data))
+        return [found[path_id] for path_id in path_ids]
+
+    def get_default_versions(self, asset_path_ids: Iterable[str]) -> Dict[str, AssetVersion]:
+        """
+        default version of each of given assets: locked in current version lock context, or the latest.
+        assets without versions are omitted
+        """
+        version_path_ids = get_version_lock_context().resolve_default_version_path_ids(self.__data_accessor, asset_path_ids)
+        return dict(zip(version_path_ids.keys(), self.get_asset_versions(version_path_ids.values())))
+
+    def __remember_asset(self, asset: Asset) -> Asset:
+        session = self.__session.get()
+        if session is None:
+            return asset
+        return session.assets.add(asset.path_id, asset)
+
+    def __remember_version(self, asset_version: AssetVersion) -> AssetVersion:
+        session = self.__session.get()
+        if session is None:
+            return asset_version
+        return session.asset_versions.add(asset_version.path_id, asset_version)
 
     def new_asset(self, name: str, description: str, type_name: str, path_id: str) -> Asset:
         asset_data = AssetData(path_id,
@@ -49,7 +249,18 @@ class Director:
                                description)
         if type_name not in self.__asset_factories:
             raise NotFoundError(type_name)  # should probably change this exception type
-        return self.__asset_factories[type_name](self.__data_accessor.create_new_asset(type_name, asset_data).path_id)
+        asset_data = self.__data_accessor.create_new_asset(type_name, asset_data)
+        return self.__remember_asset(self.__asset_factories[type_name](asset_data.path_id, asset_data))
+
+    def create_new_generic_versions(self, version_specs: Iterable[Tuple[Asset, Optional[VersionType], Optional[GenerationTaskParameters], Iterable[AssetVersion]]]) -> Tuple[List[AssetVersion], List[AssetVersion]]:
+        """
+        create new versions of any assets in a single transaction, see Asset.create_new_generic_version for how atomic it is.
+        version_specs elements are (asset, version_id, creation_task_parameters, dependencies)
+
+        :returns: newly created asset versions, and ALL other asset versions whos creation was triggered by them
+        """
+        new_versions, triggered_versions = Asset._create_new_generic_versions(self.__data_accessor, version_specs)
+        return [self.__remember_version(x) for x in new_versions], [self.__remember_version(x) for x in triggered_versions]
 
     def get_data_accessor(self) -> DataAccessInterface:
         return self.__data_accessor
@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 import json
+from .instrumentation import timed_json_loads
 
 from typing import Dict, Any
 
@@ -24,7 +25,7 @@ class GenerationTaskParameters:
 
     @classmethod
     def deserialize(cls, data: str) -> "GenerationTaskParameters":
-        raw = json.loads(data)
+        raw = timed_json_loads(data)
         env = raw.get('env', {})
         return GenerationTaskParameters(raw.get('lock', {}),
                                         raw.get('attrib', {}),
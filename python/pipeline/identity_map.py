@@ -0,0 +1,67 @@
+import threading
+import weakref
+from collections import OrderedDict
+
+from typing import Dict, Generic, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+class IdentityMap(Generic[T]):
+    """
+    maps path_id to the one live object for it.
+
+    objects are held weakly, so anything still referenced by someone stays mapped,
+    and additionally the last keep_alive objects used are held strongly,
+    so that a walk that drops and re-requests objects does not rebuild them
+    """
+    def __init__(self, keep_alive: int = 1024):
+        if keep_alive < 0:
+            raise ValueError('keep_alive must not be negative')
+        self.__keep_alive = keep_alive
+        self.__objects: Dict[str, T] = weakref.WeakValueDictionary()
+        self.__recent: "OrderedDict[str, T]" = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, path_id: str) -> Optional[T]:
+        with self.__lock:
+            obj = self.__objects.get(path_id)
+            if obj is not None:
+                self.__touch(path_id, obj)
+            return obj
+
+    def add(self, path_id: str, obj: T) -> T:
+        """
+        map obj to path_id, unless something is already mapped to it.
+        returns the mapped object, so racing builders of the same object all end up with the same one
+        """
+        with self.__lock:
+            existing = self.__objects.get(path_id)
+            if existing is not None:
+                obj = existing
+            else:
+                self.__objects[path_id] = obj
+            self.__touch(path_id, obj)
+            return obj
+
+    def discard(self, path_id: str):
+        with self.__lock:
+            self.__objects.pop(path_id, None)
+            self.__recent.pop(path_id, None)
+
+    def clear(self):
+        with self.__lock:
+            self.__objects.clear()
+            self.__recent.clear()
+
+    def __len__(self):
+        return len(self.__objects)
+
+    def __touch(self, path_id: str, obj: T):
+        # must be called under lock
+        if self.__keep_alive == 0:
+            return
+        self.__recent[path_id] = obj
+        self.__recent.move_to_end(path_id)
+        while len(self.__recent) > self.__keep_alive:
+            self.__recent.popitem(last=False)
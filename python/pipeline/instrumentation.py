@@ -0,0 +1,178 @@
+import json
+import time
+import functools
+import inspect
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, asdict, field
+
+from typing import Callable, Dict, Iterator, List, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+# opt-in cost accounting for the data layer.
+# nothing is recorded unless code runs inside an instrument() block, and outside of it every hook is a single context variable lookup.
+# recording is bound to the current context, so work handed to other threads is not accounted to the block
+
+
+@dataclass(eq=False)
+class OperationStats:
+    calls: int = 0
+    statements: int = 0
+    rows: int = 0
+    wall_seconds: float = 0.0
+    sqlite_seconds: float = 0.0
+    json_decode_seconds: float = 0.0
+    lock_wait_seconds: float = 0.0
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+@dataclass
+class QueryProfile:
+    """
+    costs recorded inside one instrument() block.
+    cost of a nested operation is also accounted to every operation it was called from,
+    so operations are inclusive, like cumulative time in a profiler, and only total is exact
+    """
+    total: OperationStats = field(default_factory=OperationStats)
+    operations: Dict[str, OperationStats] = field(default_factory=dict)
+
+    def as_dict(self) -> dict:
+        return {'total': self.total.as_dict(),
+                'operations': {name: stats.as_dict() for name, stats in self.operations.items()}}
+
+    def to_json(self) -> str:
+        return json.dumps(self.as_dict())
+
+
+class _ActiveProfile:
+    __slots__ = ('profile', 'stack')
+
+    def __init__(self, profile: QueryProfile):
+        self.profile = profile
+        self.stack: List[OperationStats] = []
+
+    def targets(self) -> Iterator[OperationStats]:
+        yield self.profile.total
+        yield from self.stack
+
+
+_active_profile: ContextVar[Optional[_ActiveProfile]] = ContextVar('pipeline_active_profile', default=None)
+
+
+def is_active() -> bool:
+    return _active_profile.get() is not None
+
+
+@contextmanager
+def instrument() -> Iterator[QueryProfile]:
+    """
+    record data layer costs of everything done in this block, in this context.
+    nested instrument() block records into its own profile only
+    """
+    profile = QueryProfile()
+    token = _active_profile.set(_ActiveProfile(profile))
+    start = time.perf_counter()
+    try:
+        yield profile
+    finally:
+        profile.total.wall_seconds += time.perf_counter() - start
+        profile.total.calls += 1
+        _active_profile.reset(token)
+
+
+@contextmanager
+def operation(name: str) -> Iterator[None]:
+    """
+    account costs of this block to operation with given name, in addition to the total.
+    does nothing outside of instrument()
+    """
+    active = _active_profile.get()
+    if active is None:
+        yield
+        return
+    stats = active.profile.operations.get(name)
+    if stats is None:
+        stats = active.profile.operations[name] = OperationStats()
+    if stats in active.stack:  # recursive call, already accounted by the outer one
+        yield
+        return
+    active.stack.append(stats)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        active.stack.pop()
+        stats.wall_seconds += time.perf_counter() - start
+        stats.calls += 1
+
+
+def instrumented_operations(cls: T) -> T:
+    """
+    class decorator making every public method defined in the class an operation named ClassName.method_name
+    """
+    for name, func in list(vars(cls).items()):
+        if name.startswith('_') or not inspect.isfunction(func):
+            continue
+        setattr(cls, name, _as_operation(func, f'{cls.__name__}.{name}'))
+    return cls
+
+
+def _as_operation(func: Callable, name: str) -> Callable:
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _active_profile.get() is None:
+            return func(*args, **kwargs)
+        with operation(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def record_statement(seconds: float):
+    active = _active_profile.get()
+    if active is None:
+        return
+    for stats in active.targets():
+        stats.statements += 1
+        stats.sqlite_seconds += seconds
+
+
+def record_rows(row_count: int, seconds: float):
+    active = _active_profile.get()
+    if active is None:
+        return
+    for stats in active.targets():
+        stats.rows += row_count
+        stats.sqlite_seconds += seconds
+
+
+def record_json_decode(seconds: float):
+    active = _active_profile.get()
+    if active is None:
+        return
+    for stats in active.targets():
+        stats.json_decode_seconds += seconds
+
+
+def record_lock_wait(seconds: float):
+    active = _active_profile.get()
+    if active is None:
+        return
+    for stats in active.targets():
+        stats.lock_wait_seconds += seconds
+
+
+def timed_json_loads(serialized: str):
+    """
+    json.loads accounted as json decode time
+    """
+    if _active_profile.get() is None:
+        return json.loads(serialized)
+    start = time.perf_counter()
+    try:
+        return json.loads(serialized)
+    finally:
+        record_json_decode(time.perf_counter() - start)
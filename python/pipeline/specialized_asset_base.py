@@ -1,14 +1,17 @@
 from .asset import Asset, AssetVersion
+from .asset_data import AssetData
 from .director import Director, AssetFactory
 
-from typing import List, Iterable
+from typing import List, Iterable, Optional
 
 
 # TODO: instead of this maybe it's better to split a registry interface from director interface.
 #  then we'd have tightly coupled Asset+AssetVersion+AssetRegistry, and director will only inherit them
 class SpecializedAssetBase(Asset):
-    def __init__(self, asset_path_id: str, director: Director):
-        super(SpecializedAssetBase, self).__init__(asset_path_id, director.get_data_accessor())
+    __slots__ = ('__director',)
+
+    def __init__(self, asset_path_id: str, director: Director, asset_data: Optional[AssetData] = None):
+        super(SpecializedAssetBase, self).__init__(asset_path_id, director.get_data_accessor(), asset_data)
         self.__director = director
 
     def _get_director(self) -> Director:
@@ -20,6 +23,8 @@ class SpecializedAssetBase(Asset):
 
 
 class SpecializedAssetVersionBase(AssetVersion):
+    __slots__ = ()
+
     @property
     def asset(self) -> SpecializedAssetBase:
         asset = super(SpecializedAssetVersionBase, self).asset
@@ -27,11 +32,7 @@ class SpecializedAssetVersionBase(AssetVersion):
         return asset
 
     def get_dependencies(self) -> List["AssetVersion"]:
-        data = self._fresh_asset_version_data()
-        director = self.asset._get_director()
-        return [director.get_asset_version(x) for x in self.data_provider.get_version_dependencies(data.path_id)]
+        return self.asset._get_director().get_asset_versions(self.data_provider.get_version_dependencies(self.path_id))
 
     def get_dependants(self) -> List["AssetVersion"]:
-        data = self._fresh_asset_version_data()
-        director = self.asset._get_director()
-        return [director.get_asset_version(x) for x in self.data_provider.get_dependent_versions(data.path_id)]
+        return self.asset._get_director().get_asset_versions(self.data_provider.get_dependent_versions(self.path_id))
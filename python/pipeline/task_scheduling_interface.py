@@ -2,13 +2,31 @@ from .asset_data import AssetVersionData
 from .generation_task_parameters import GenerationTaskParameters
 from .future import FutureResult
 
-from typing import Tuple
+from typing import Iterable, List, Optional, Tuple
 
 
 class TaskSchedulingResultReportReceiver:
     def data_computation_completed_callback(self, path_id: str, data: dict):
         raise NotImplementedError()
 
+    def data_computations_completed_callback(self, completions: Iterable[Tuple[str, dict]]) -> List[Optional[Exception]]:
+        """
+        report many completed computations at once, completions are (path_id, data) pairs.
+        one failed completion does not prevent others from being applied.
+        implementations should apply them in as few transactions as possible
+
+        :returns: for each completion - exception it failed with, or None if it was applied
+        """
+        errors = []
+        for path_id, data in completions:
+            try:
+                self.data_computation_completed_callback(path_id, data)
+            except Exception as e:
+                errors.append(e)
+            else:
+                errors.append(None)
+        return errors
+
 
 class TaskSchedulingInterface:
     def __init__(self):
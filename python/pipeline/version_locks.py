@@ -0,0 +1,96 @@
+import os
+import json
+import threading
+from contextvars import ContextVar, Token
+from .data_access_interface import DataAccessInterface
+
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+
+_locks_env_name = 'LBATTR_locked_asset_versions'
+
+
+class VersionLockContext:
+    """
+    which version of an asset is the default one: locked asset path_ids map to version path_ids,
+    everything else defaults to the latest version.
+
+    by default locks come from LBATTR_locked_asset_versions environment variable, parsed once.
+    a VersionLockContext used as a context manager replaces current locks for the block (and only for current context),
+    use overridden() to build one that changes just a few locks
+    """
+    def __init__(self, locks: Optional[Mapping[str, str]] = None):
+        self.__locks: Dict[str, str] = dict(locks or {})
+        self.__tokens: List[Token] = []
+
+    @classmethod
+    def from_environment(cls, environ: Optional[Mapping[str, str]] = None) -> "VersionLockContext":
+        return cls(json.loads((os.environ if environ is None else environ).get(_locks_env_name, '{}')))
+
+    def locks(self) -> Dict[str, str]:
+        return dict(self.__locks)
+
+    def get_locked_version_path_id(self, asset_path_id: str) -> Optional[str]:
+        return self.__locks.get(asset_path_id) or None
+
+    def overridden(self, locks: Mapping[str, str]) -> "VersionLockContext":
+        """
+        new context with the same locks, except given ones.
+        empty or None version path_id removes the lock
+        """
+        return VersionLockContext({k: v for k, v in {**self.__locks, **locks}.items() if v})
+
+    def resolve_default_version_path_ids(self, data_provider: DataAccessInterface, asset_path_ids: Iterable[str]) -> Dict[str, str]:
+        """
+        default version path_id for each of given assets.
+        locked ones need no lookup, latest versions of all the others are fetched in a single batched lookup.
+        assets without versions are omitted
+        """
+        asset_path_ids = list(dict.fromkeys(asset_path_ids))
+        result = {}
+        unlocked = []
+        for asset_path_id in asset_path_ids:
+            locked = self.get_locked_version_path_id(asset_path_id)
+            if locked:
+                result[asset_path_id] = locked
+            else:
+                unlocked.append(asset_path_id)
+        if unlocked:
+            result.update((x.asset_path_id, x.path_id) for x in data_provider.get_asset_version_datas([(asset_path_id, None) for asset_path_id in unlocked]))
+        return {x: result[x] for x in asset_path_ids if x in result}
+
+    def __enter__(self) -> "VersionLockContext":
+        self.__tokens.append(_current_context.set(self))
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _current_context.reset(self.__tokens.pop())
+
+
+_current_context: ContextVar[Optional[VersionLockContext]] = ContextVar('pipeline_version_lock_context', default=None)
+_environment_context: Tuple[Optional[str], Optional[VersionLockContext]] = (None, None)
+_environment_context_lock = threading.Lock()
+
+
+def get_version_lock_context() -> VersionLockContext:
+    """
+    innermost active VersionLockContext, or the one from environment
+    """
+    context = _current_context.get()
+    if context is not None:
+        return context
+    return _get_environment_context()
+
+
+def _get_environment_context() -> VersionLockContext:
+    global _environment_context
+    # only the raw string is compared on every call, it is parsed again only if environment was changed
+    raw = os.environ.get(_locks_env_name, '{}')
+    parsed_raw, context = _environment_context
+    if context is None or parsed_raw != raw:
+        with _environment_context_lock:
+            parsed_raw, context = _environment_context
+            if context is None or parsed_raw != raw:
+                context = VersionLockContext(json.loads(raw))
+                _environment_context = (raw, context)
+    return context
@@ -1,9 +1,8 @@
-import os
-import json
 from pipeline.uri_handler import UriHandlerBase
 from pipeline.uri import Uri
 from pipeline.asset import Asset, AssetVersion
 from pipeline.director import Director, NotFoundError
+from pipeline.version_locks import get_version_lock_context
 
 from typing import Union
 
@@ -22,7 +21,11 @@ class AssetVersionUriHandler(UriHandlerBase):
         except NotFoundError:
             # maybe uri path is an asset path, then we bring the default version (may be latest, may be locked)
             ass = self.__director.get_asset(uri.path)
-            assver = ass.get_default_version()
+            locked_path_id = get_version_lock_context().get_locked_version_path_id(ass.path_id)
+            if locked_path_id:
+                assver = self.__director.get_asset_version(locked_path_id)
+            else:
+                assver = ass.get_latest_version()
         if uri.query:
             if not hasattr(assver, uri.query):
                 return ''
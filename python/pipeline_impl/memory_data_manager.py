@@ -0,0 +1,491 @@
+import os
+import re
+import json
+import heapq
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from pathlib import Path
+
+from pipeline.asset_data import AssetVersionData, LazyAssetVersionData, AssetData, DataState, AssetTemplateData, ChangeType, ChangeRecord
+from pipeline.data_access_interface import DataAccessInterface, NotFoundError, DependencyCycleError, ChangeLogTrimmedError, WriteLockBusyError
+from pipeline.future import FutureResult
+from pipeline.generation_task_parameters import GenerationTaskParameters
+from pipeline.task_scheduling_interface import TaskSchedulingInterface, TaskSchedulingResultReportReceiver
+
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+
+@dataclass(frozen=True)
+class _AssetRecord:
+    name: str
+    description: str
+    type_name: str
+
+
+@dataclass(frozen=True)
+class _VersionRecord:
+    path_id: str
+    asset_path_id: str
+    version_id: Tuple[int, int, int]
+    serialized_task_attrs: str
+    data_availability: DataState
+    data_calculator_id: Optional[str]
+    serialized_data: Optional[str]
+
+
+_missing = object()
+
+
+class InMemoryDataManager(DataAccessInterface, TaskSchedulingResultReportReceiver):
+    """
+    DataAccessInterface that keeps everything in process memory, indexed with plain dicts.
+    nothing is persisted, this is meant for tests and benchmarks.
+
+    semantics follow SqliteDataManagerWithLifeblood with maintained dependency closure:
+    everything is stored serialized and every read returns fresh objects,
+    dependency cycles are refused, failed writes leave no trace.
+    """
+    def __init__(self, task_scheduler: TaskSchedulingInterface, storage_root: Optional[Union[Path, str]] = None):
+        """
+        :param storage_root: root for pipeline_*_root paths, PIPELINE_STORAGE_ROOT env variable is used if not given
+        """
+        super().__init__(task_scheduler)
+        self.__storage_root = Path(storage_root) if storage_root is not None else None
+        self.__lock = threading.RLock()
+        self.__undo: Optional[List[Callable[[], None]]] = None
+
+        self.__assets: Dict[str, _AssetRecord] = {}
+        self.__versions: Dict[str, _VersionRecord] = {}
+        self.__asset_versions: Dict[str, Dict[Tuple[int, int, int], str]] = {}
+        self.__latest_versions: Dict[str, str] = {}
+        # dicts here are used as insertion ordered sets
+        self.__dependencies: Dict[str, Dict[str, None]] = {}
+        self.__dependants: Dict[str, Dict[str, None]] = {}
+        self.__leaves: Dict[str, None] = {}
+        self.__templates: Dict[str, str] = {}
+        self.__template_version_inputs: Dict[str, Tuple[str, ...]] = {}
+        self.__template_triggers: Dict[str, Tuple[str, ...]] = {}
+        self.__triggered_templates: Dict[str, Dict[str, None]] = {}
+        self.__changes: List[ChangeRecord] = []
+        self.__last_change_seq = 0
+        self.__changes_trimmed_up_to = 0
+
+    # transactions
+    # every change to the indexes goes through __set/__pop that remember how to undo it,
+    # so a failed write is rolled back completely, same as with a db
+
+    @contextmanager
+    def __transaction(self, wait: bool = True):
+        if not self.__lock.acquire(blocking=wait):
+            raise WriteLockBusyError('data is being written by another thread')
+        try:
+            if self.__undo is not None:  # nested - just join the outer one
+                yield
+                return
+            self.__undo = []
+            try:
+                yield
+            except BaseException:
+                for undo in reversed(self.__undo):
+                    undo()
+                raise
+            finally:
+                self.__undo = None
+        finally:
+            self.__lock.release()
+
+    def __set(self, container: dict, key, value):
+        old = container.get(key, _missing)
+        container[key] = value
+        self.__undo.append(lambda: container.__setitem__(key, old) if old is not _missing else container.pop(key))
+
+    def __pop(self, container: dict, key):
+        old = container.pop(key, _missing)
+        if old is not _missing:
+            self.__undo.append(lambda: container.__setitem__(key, old))
+
+    def __log_change(self, change_type: ChangeType, path_id: str, other_path_id: Optional[str] = None):
+        last_change_seq = self.__last_change_seq
+        self.__last_change_seq += 1
+        self.__changes.append(ChangeRecord(self.__last_change_seq, change_type, path_id, other_path_id))
+
+        def _undo():
+            self.__changes.pop()
+            self.__last_change_seq = last_change_seq
+        self.__undo.append(_undo)
+
+    # getters
+
+    def get_asset_type_name(self, asset_path_id: str):
+        with self.__lock:
+            asset = self.__assets.get(asset_path_id)
+        if asset is None:
+            raise NotFoundError(asset_path_id)
+        return asset.type_name
+
+    def get_asset_datas(self, asset_path_ids: Iterable[str]) -> List[AssetData]:
+        with self.__lock:
+            assets = [(path_id, self.__assets.get(path_id)) for path_id in asset_path_ids]
+        return [AssetData(path_id, asset.name, asset.description, asset.type_name) for path_id, asset in assets if asset is not None]
+
+    def get_asset_version_datas(self, asset_path_id_version_pairs: Iterable[Tuple[str, Optional[Tuple[int, int, int]]]]) -> List[AssetVersionData]:
+        records = []
+        with self.__lock:
+            for asset_path_id, version_id in asset_path_id_version_pairs:
+                if version_id is None:
+                    path_id = self.__latest_versions.get(asset_path_id)
+                else:
+                    path_id = self.__asset_versions.get(asset_path_id, {}).get(tuple(version_id))
+                if path_id is not None:
+                    records.append(self.__versions[path_id])
+        return [self.__version_data_from_record(x) for x in records]
+
+    def get_asset_version_datas_from_path_id(self, asset_version_path_ids: Iterable[str]) -> List[AssetVersionData]:
+        with self.__lock:
+            records = [self.__versions.get(path_id) for path_id in asset_version_path_ids]
+        return [self.__version_data_from_record(x) for x in records if x is not None]
+
+    @staticmethod
+    def __version_data_from_record(record: _VersionRecord) -> AssetVersionData:
+        return LazyAssetVersionData(path_id=record.path_id,
+                                    asset_path_id=record.asset_path_id,
+                                    version_id=record.version_id,
+                                    serialized_data_producer_task_attrs=record.serialized_task_attrs,
+                                    data_availability=record.data_availability,
+                                    data_calculator_id=record.data_calculator_id,
+                                    serialized_data=record.serialized_data)
+
+    def get_data_availabilities(self, asset_version_path_ids: Iterable[str]) -> Dict[str, DataState]:
+        with self.__lock:
+            records = [self.__versions.get(path_id) for path_id in asset_version_path_ids]
+        return {x.path_id: x.data_availability for x in records if x is not None}
+
+    def get_leaf_asset_version_pathids(self, *,
+                                       asset_type_name: Optional[str] = None,
+                                       asset_path_id_prefix: Optional[str] = None,
+                                       after_path_id: Optional[str] = None,
+                                       limit: Optional[int] = None) -> List[str]:
+        with self.__lock:
+            leaves = [(path_id, self.__versions[path_id].asset_path_id) for path_id in self.__leaves]
+            if asset_type_name is not None:
+                leaves = [x for x in leaves if self.__assets[x[1]].type_name == asset_type_name]
+        if asset_path_id_prefix:
+            leaves = [x for x in leaves if x[1].startswith(asset_path_id_prefix)]
+        if after_path_id is not None:
+            leaves = [x for x in leaves if x[0] > after_path_id]
+        return sorted(x[0] for x in leaves)[:limit]
+
+    # catalogue listing
+
+    def get_asset_datas_page(self, *,
+                             type_name: Optional[str] = None,
+                             prefix: Optional[str] = None,
+                             after_path_id: Optional[str] = None,
+                             limit: Optional[int] = None) -> List[AssetData]:
+        with self.__lock:
+            assets = [(path_id, x) for path_id, x in self.__assets.items()
+                      if (type_name is None or x.type_name == type_name)
+                      and (not prefix or path_id.startswith(prefix))
+                      and (after_path_id is None or path_id > after_path_id)]
+        assets = sorted(assets, key=lambda x: x[0]) if limit is None else heapq.nsmallest(limit, assets, key=lambda x: x[0])
+        return [AssetData(path_id, x.name, x.description, x.type_name) for path_id, x in assets]
+
+    def get_asset_version_datas_page(self, *,
+                                     asset_path_id: Optional[str] = None,
+                                     state: Optional[DataState] = None,
+                                     after_path_id: Optional[str] = None,
+                                     limit: Optional[int] = None) -> List[AssetVersionData]:
+        with self.__lock:
+            if asset_path_id is not None:
+                records = [self.__versions[x] for x in self.__asset_versions.get(asset_path_id, {}).values()]
+            else:
+                records = self.__versions.values()
+            records = [x for x in records
+                       if (state is None or x.data_availability == state)
+                       and (after_path_id is None or x.path_id > after_path_id)]
+        records = sorted(records, key=lambda x: x.path_id) if limit is None else heapq.nsmallest(limit, records, key=lambda x: x.path_id)
+        return [self.__version_data_from_record(x) for x in records]
+
+    # setters
+
+    @contextmanager
+    def transaction(self, wait: bool = True) -> Iterator[None]:
+        # other threads wait for the whole block, as they do for any single write
+        with self.__transaction(wait):
+            yield
+
+    def publish_new_asset_version(self, asset_path_id: str, version_data: AssetVersionData, dependencies: Iterable[str]) -> AssetVersionData:
+        """
+        if version_data.pathid is None - it will be assigned automatically based on asset_path_id and version_id
+        if version_id is None - next available version_id will be assigned automatically
+        """
+        with self.__transaction():
+            return self.__publish_new_asset_version(asset_path_id, version_data, dependencies)
+
+    def publish_new_asset_versions(self, batch: Iterable[Tuple[str, AssetVersionData, Iterable[str]]]) -> List[AssetVersionData]:
+        with self.__transaction():
+            return [self.__publish_new_asset_version(asset_path_id, version_data, dependencies) for asset_path_id, version_data, dependencies in batch]
+
+    def __publish_new_asset_version(self, asset_path_id: str, version_data: AssetVersionData, dependencies: Iterable[str]) -> AssetVersionData:
+        if asset_path_id not in self.__assets:
+            raise RuntimeError('bad asset_path_id')
+        asset_versions = self.__asset_versions.get(asset_path_id, {})
+
+        if version_data.version_id is None:
+            latest = self.__latest_versions.get(asset_path_id)
+            ver = list(self.__versions[latest].version_id if latest is not None else [0, -1, -1])
+            bump_idx = max(0, ver.index(-1)-1) if -1 in ver else 2
+            ver[bump_idx] += 1
+            version_id = tuple(ver)
+        else:
+            version_id = tuple(version_data.version_id)
+            if version_id in asset_versions:
+                raise RuntimeError(f'version_id "{version_data.version_id}" is already published')
+
+        version_string = '.'.join(str(x) for x in version_id if x != -1)
+        pathid = version_data.path_id or f'{asset_path_id}/{version_string}'
+        if pathid in self.__versions:
+            raise RuntimeError(f'version "{pathid}" already exists')
+        self.__set(self.__versions, pathid, _VersionRecord(pathid, asset_path_id, version_id,
+                                                           version_data.data_producer_task_attrs.serialize(),
+                                                           DataState.NOT_COMPUTED, None, None))
+        if asset_path_id not in self.__asset_versions:
+            self.__set(self.__asset_versions, asset_path_id, {})
+        self.__set(self.__asset_versions[asset_path_id], version_id, pathid)
+        latest = self.__latest_versions.get(asset_path_id)
+        if latest is None or self.__versions[latest].version_id < version_id:
+            self.__set(self.__latest_versions, asset_path_id, pathid)
+        self.__set(self.__dependencies, pathid, {})
+        self.__set(self.__dependants, pathid, {})
+        self.__set(self.__leaves, pathid, None)
+        self.__log_change(ChangeType.VERSION_PUBLISHED, pathid, asset_path_id)
+
+        if dependencies:
+            self.__insert_dependency_edges(pathid, dependencies)
+
+        # version_data is updated only once everything above succeeded
+        version_data.version_id = version_id
+        version_data.path_id = pathid
+        version_data.asset_path_id = asset_path_id
+        version_data.data_availability = DataState.NOT_COMPUTED
+        version_data.data_calculator_id = None
+        version_data.data = None
+        return version_data
+
+    def create_new_asset(self, asset_type: str, asset_data: AssetData) -> AssetData:
+        pathid = asset_data.path_id or re.sub(r'\W', '_', asset_data.name)
+        with self.__transaction():
+            if pathid in self.__assets:
+                raise RuntimeError(f'asset "{pathid}" already exists')
+            self.__set(self.__assets, pathid, _AssetRecord(asset_data.name, asset_data.description, asset_type))
+            self.__log_change(ChangeType.ASSET_CREATED, pathid)
+        asset_data.path_id = pathid
+        asset_data.type_name = asset_type
+        return asset_data
+
+    # templates
+
+    def get_asset_template_datas_for_asset_path_id(self, asset_path_ids: Iterable[str]) -> List[AssetTemplateData]:
+        with self.__lock:
+            templates = [(path_id, self.__templates.get(path_id)) for path_id in asset_path_ids]
+        return [AssetTemplateData(path_id, GenerationTaskParameters.deserialize(attrs)) for path_id, attrs in templates if attrs is not None]
+
+    def create_asset_template(self, asset_template_data: AssetTemplateData,
+                                    trigger_asset_path_ids: Iterable[str],
+                                    asset_version_dependencies: Iterable[str]) -> AssetTemplateData:
+        asset_path_id = asset_template_data.asset_path_id
+        trigger_asset_path_ids = tuple(dict.fromkeys(trigger_asset_path_ids))
+        asset_version_dependencies = tuple(dict.fromkeys(asset_version_dependencies))
+        with self.__transaction():
+            if asset_path_id not in self.__assets:
+                raise NotFoundError(asset_path_id)
+            for trigger_path_id in trigger_asset_path_ids:
+                if trigger_path_id not in self.__assets:
+                    raise NotFoundError(trigger_path_id)
+            for dep in asset_version_dependencies:
+                if dep not in self.__versions:
+                    raise NotFoundError(dep)
+            # replacing a template replaces all of its inputs
+            for trigger_path_id in self.__template_triggers.get(asset_path_id, ()):
+                self.__pop(self.__triggered_templates[trigger_path_id], asset_path_id)
+            self.__set(self.__templates, asset_path_id, asset_template_data.data_producer_task_attrs.serialize())
+            self.__log_change(ChangeType.TEMPLATE_CHANGED, asset_path_id)
+            self.__set(self.__template_version_inputs, asset_path_id, asset_version_dependencies)
+            self.__set(self.__template_triggers, asset_path_id, trigger_asset_path_ids)
+            for trigger_path_id in trigger_asset_path_ids:
+                if trigger_path_id not in self.__triggered_templates:
+                    self.__set(self.__triggered_templates, trigger_path_id, {})
+                self.__set(self.__triggered_templates[trigger_path_id], asset_path_id, None)
+        return asset_template_data
+
+    def update_asset_template_data(self, asset_template_data: AssetTemplateData):
+        with self.__transaction():
+            if asset_template_data.asset_path_id not in self.__templates:
+                return
+            self.__set(self.__templates, asset_template_data.asset_path_id, asset_template_data.data_producer_task_attrs.serialize())
+            self.__log_change(ChangeType.TEMPLATE_CHANGED, asset_template_data.asset_path_id)
+
+    def update_asset_template_datas(self, asset_template_datas: Iterable[AssetTemplateData]):
+        with self.__transaction():
+            for asset_template_data in asset_template_datas:
+                self.update_asset_template_data(asset_template_data)
+
+    def get_asset_templates_triggered_by(self, asset_path_id: str) -> List[AssetTemplateData]:
+        with self.__lock:
+            template_path_ids = list(self.__triggered_templates.get(asset_path_id, ()))
+        return self.get_asset_template_datas_for_asset_path_id(template_path_ids)
+
+    def get_asset_templates_downstream_of(self, asset_path_ids: Iterable[str]) -> List[Tuple[str, AssetTemplateData]]:
+        edges = []
+        with self.__lock:
+            queue = list(dict.fromkeys(asset_path_ids))
+            seen = set(queue)
+            for asset_path_id in queue:  # queue grows while we walk it
+                for template_path_id in self.__triggered_templates.get(asset_path_id, ()):
+                    edges.append((asset_path_id, template_path_id))
+                    if template_path_id not in seen:
+                        seen.add(template_path_id)
+                        queue.append(template_path_id)
+            templates = {path_id: self.__templates[path_id] for _, path_id in edges}
+        template_datas = {path_id: AssetTemplateData(path_id, GenerationTaskParameters.deserialize(attrs)) for path_id, attrs in templates.items()}
+        return [(asset_path_id, template_datas[path_id]) for asset_path_id, path_id in edges]
+
+    def get_template_fixed_dependencies(self, asset_path_id: str) -> Iterable[str]:
+        with self.__lock:
+            return list(self.__template_version_inputs.get(asset_path_id, ()))
+
+    def get_templates_fixed_dependencies(self, asset_path_ids: Iterable[str]) -> Dict[str, List[str]]:
+        with self.__lock:
+            return {x: list(self.__template_version_inputs[x]) for x in asset_path_ids if x in self.__template_version_inputs}
+
+    # change feed
+
+    def get_changes_since(self, seq: int, limit: Optional[int] = None) -> List[ChangeRecord]:
+        with self.__lock:
+            if seq < self.__changes_trimmed_up_to:
+                raise ChangeLogTrimmedError(f'changes after {seq} up to {self.__changes_trimmed_up_to} were trimmed from change log')
+            # seq numbers are consecutive, so position in the log is known
+            start = max(0, seq - self.__changes[0].seq + 1) if self.__changes else 0
+            changes = self.__changes[start:]
+        return changes[:limit]
+
+    def get_last_change_seq(self) -> int:
+        with self.__lock:
+            return self.__last_change_seq
+
+    def trim_change_log(self, up_to_seq: int):
+        """
+        remove changes with seq up to and including up_to_seq from the log
+        """
+        with self.__lock:
+            if self.__changes:
+                del self.__changes[:max(0, up_to_seq - self.__changes[0].seq + 1)]
+            self.__changes_trimmed_up_to = max(self.__changes_trimmed_up_to, up_to_seq)
+
+    # scheduling execution
+
+    def schedule_data_computation_for_asset_version(self, path_id: str) -> FutureResult:
+        with self.__transaction():
+            record = self.__versions.get(path_id)
+            if record is None:
+                raise ValueError('path id "{}" does not exist'.format(path_id))
+            if record.data_availability == DataState.IS_COMPUTING:
+                return self.get_task_scheduler().get_schedule_event_future(record.data_calculator_id)
+
+            future, task_id = self.get_task_scheduler().schedule_data_generation_task(self.__version_data_from_record(record),
+                                                                                     GenerationTaskParameters.deserialize(record.serialized_task_attrs))
+            self.__set(self.__versions, path_id, replace(record, data_availability=DataState.IS_COMPUTING, data_calculator_id=task_id))
+            self.__log_change(ChangeType.VERSION_DATA_STATE_CHANGED, path_id)
+            return future
+
+    def data_computation_completed_callback(self, path_id: str, data: dict):
+        """
+        Callback to be called by TaskScheduler when job is done
+        """
+        with self.__transaction():
+            record = self.__versions.get(path_id)
+            if record is not None and record.data_availability == DataState.AVAILABLE and record.serialized_data == json.dumps(data):
+                # same completion delivered again
+                return
+            if record is None or record.data_availability != DataState.IS_COMPUTING:
+                raise RuntimeError('data computation was not started, inconsistency!')
+            self.__set(self.__versions, path_id, replace(record, data_availability=DataState.AVAILABLE, data_calculator_id=-1,
+                                                         serialized_data=json.dumps(data)))
+            self.__log_change(ChangeType.VERSION_DATA_STATE_CHANGED, path_id)
+
+    # dependencies
+
+    def get_version_dependencies(self, version_path_id: str) -> Iterable[str]:
+        with self.__lock:
+            return list(self.__dependencies.get(version_path_id, ()))
+
+    def get_dependent_versions(self, version_path_id: str) -> Iterable[str]:
+        with self.__lock:
+            return list(self.__dependants.get(version_path_id, ()))
+
+    def version_depends_on(self, version_path_id: str, dependency_path_id: str) -> bool:
+        with self.__lock:
+            return self.__reaches(version_path_id, dependency_path_id)
+
+    def __reaches(self, version_path_id: str, dependency_path_id: str) -> bool:
+        stack = [version_path_id]
+        visited = {version_path_id}
+        while stack:
+            for dep in self.__dependencies.get(stack.pop(), ()):
+                if dep == dependency_path_id:
+                    return True
+                if dep not in visited:
+                    visited.add(dep)
+                    stack.append(dep)
+        return False
+
+    def add_dependencies(self, version_path_id: str, dependency_path_ids: Iterable[str]):
+        if not dependency_path_ids:
+            return
+        with self.__transaction():
+            self.__insert_dependency_edges(version_path_id, dependency_path_ids)
+
+    def remove_dependencies(self, version_path_id: str, dependency_path_ids: Iterable[str]):
+        if not dependency_path_ids:
+            return
+        with self.__transaction():
+            for dep in dependency_path_ids:
+                if dep not in self.__dependencies.get(version_path_id, ()):
+                    continue
+                self.__pop(self.__dependencies[version_path_id], dep)
+                self.__pop(self.__dependants[dep], version_path_id)
+                self.__log_change(ChangeType.DEPENDENCY_REMOVED, version_path_id, dep)
+                if not self.__dependants[dep]:
+                    self.__set(self.__leaves, dep, None)
+
+    def __insert_dependency_edges(self, version_path_id: str, dependency_path_ids: Iterable[str]):
+        if version_path_id not in self.__versions:
+            raise NotFoundError(version_path_id)
+        for dep in dependency_path_ids:
+            if dep not in self.__versions:
+                raise NotFoundError(dep)
+            if dep in self.__dependencies[version_path_id]:
+                continue
+            if dep == version_path_id or self.__reaches(dep, version_path_id):
+                raise DependencyCycleError(f'"{version_path_id}" cannot depend on "{dep}": "{dep}" already depends on it')
+            self.__set(self.__dependencies[version_path_id], dep, None)
+            self.__set(self.__dependants[dep], version_path_id, None)
+            self.__log_change(ChangeType.DEPENDENCY_ADDED, version_path_id, dep)
+            self.__pop(self.__leaves, dep)
+
+    # files location
+
+    def __get_storage_root(self) -> Path:
+        if self.__storage_root is not None:
+            return self.__storage_root
+        return Path(os.environ['PIPELINE_STORAGE_ROOT'])
+
+    def get_pipeline_render_root(self) -> Path:
+        return self.__get_storage_root()/'render'
+
+    def get_pipeline_cache_root(self) -> Path:
+        return self.__get_storage_root()/'geo'
+
+    def get_pipeline_source_root(self) -> Path:
+        return self.__get_storage_root()/'source'
@@ -0,0 +1,449 @@
+import re
+import heapq
+import zlib
+import threading
+from contextlib import contextmanager, ExitStack
+from pathlib import Path
+
+from pipeline.asset_data import AssetVersionData, AssetData, DataState, AssetTemplateData, DependencyEdge, ChangeRecord
+from pipeline.data_access_interface import DataAccessInterface, NotFoundError, DependencyCycleError
+from pipeline.future import FutureResult
+from pipeline.task_scheduling_interface import TaskSchedulingInterface, TaskSchedulingResultReportReceiver
+from .sqlite_data_manager import SqliteDataManagerWithLifeblood
+
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, TypeVar, Union
+
+T = TypeVar('T')
+
+
+class ShardedDataManager(DataAccessInterface, TaskSchedulingResultReportReceiver):
+    """
+    routes data access across several shards, each holding a part of assets together with all their versions,
+    so that writes to different shards do not wait for each other.
+
+    an asset is placed by the longest matching path_id prefix from the routing map, or by path_id hash otherwise.
+    a version always lives with its asset, and is found by its path_id, which therefore must be "<asset path_id>/<version>".
+
+    dependency edges are stored with the dependant, and edges crossing shards are additionally mirrored
+    into the shard of the version depended on, so both directions are a single shard lookup.
+    templates live with their asset, but may be triggered by and depend on anything.
+    shards must allow references to versions and assets they don't hold
+    (for sqlite - enforce_foreign_keys=False, see from_sqlite_paths())
+
+    writes touching a single shard are as atomic as the shard makes them,
+    but writes spanning shards (cross-shard edges, batches) are only atomic per shard.
+
+    there is no total order of changes across shards, so there is no single change feed:
+    to cache, wrap each shard in a cache individually
+    """
+    def __init__(self, shards: List[DataAccessInterface], task_scheduler: TaskSchedulingInterface, routing: Optional[Mapping[str, int]] = None):
+        """
+        :param shards: data accessors for every shard. shard order must never change for existing data
+        :param routing: asset path_id prefix -> shard index
+        """
+        super().__init__(task_scheduler)
+        if not shards:
+            raise ValueError('at least one shard is required')
+        self.__shards = list(shards)
+        self.__routing = dict(routing or {})
+        for prefix, shard_index in self.__routing.items():
+            if not 0 <= shard_index < len(self.__shards):
+                raise ValueError(f'prefix "{prefix}" is routed to non-existing shard {shard_index}')
+        # longest prefixes first
+        self.__routing_prefixes = sorted(self.__routing, key=len, reverse=True)
+        # shards that joined current thread's transaction(), see __writable_shard()
+        self.__local = threading.local()
+
+    @classmethod
+    def from_sqlite_paths(cls, db_paths: Iterable[Union[Path, str]], task_scheduler: TaskSchedulingInterface,
+                          routing: Optional[Mapping[str, int]] = None) -> "ShardedDataManager":
+        """
+        open sqlite shards at given paths
+        """
+        return cls([SqliteDataManagerWithLifeblood(db_path, task_scheduler, enforce_foreign_keys=False) for db_path in db_paths],
+                   task_scheduler,
+                   routing)
+
+    def get_shards(self) -> List[DataAccessInterface]:
+        return list(self.__shards)
+
+    def close(self):
+        for shard in self.__shards:
+            close = getattr(shard, 'close', None)
+            if close is not None:
+                close()
+
+    # routing
+
+    def shard_index_for_asset(self, asset_path_id: str) -> int:
+        for prefix in self.__routing_prefixes:
+            if asset_path_id.startswith(prefix):
+                return self.__routing[prefix]
+        # crc32, not hash(), as it must be the same in every process
+        return zlib.crc32(asset_path_id.encode('UTF-8')) % len(self.__shards)
+
+    def shard_index_for_version(self, version_path_id: str) -> int:
+        return self.shard_index_for_asset(version_path_id.rsplit('/', 1)[0])
+
+    def __asset_shard(self, asset_path_id: str) -> DataAccessInterface:
+        return self.__shards[self.shard_index_for_asset(asset_path_id)]
+
+    def __version_shard(self, version_path_id: str) -> DataAccessInterface:
+        return self.__shards[self.shard_index_for_version(version_path_id)]
+
+    def __writable_shard(self, shard_index: int) -> DataAccessInterface:
+        """
+        shard to write to. inside transaction() the shard joins it the first time anything is written to it,
+        so only the shards actually written to are locked.
+        only shards after all the joined ones may wait for their lock, see transaction()
+        """
+        shard = self.__shards[shard_index]
+        joined = getattr(self.__local, 'joined', None)
+        if joined is not None and shard_index not in joined:
+            in_order = self.__local.wait and shard_index > max(joined, default=-1)
+            self.__local.stack.enter_context(shard.transaction(wait=in_order))
+            joined.add(shard_index)
+        return shard
+
+    def __writable_asset_shard(self, asset_path_id: str) -> DataAccessInterface:
+        return self.__writable_shard(self.shard_index_for_asset(asset_path_id))
+
+    def __writable_version_shard(self, version_path_id: str) -> DataAccessInterface:
+        return self.__writable_shard(self.shard_index_for_version(version_path_id))
+
+    def __group_by_shard(self, items: Iterable[T], shard_index_getter) -> Dict[int, List[T]]:
+        groups: Dict[int, List[T]] = {}
+        for item in items:
+            groups.setdefault(shard_index_getter(item), []).append(item)
+        return groups
+
+    def __check_versions_exist(self, version_path_ids: Iterable[str]):
+        version_path_ids = list(version_path_ids)
+        existing = self.get_data_availabilities(version_path_ids)
+        for path_id in version_path_ids:
+            if path_id not in existing:
+                raise NotFoundError(f'asset version "{path_id}" does not exist')
+
+    # getters
+
+    def get_asset_type_name(self, asset_path_id: str):
+        return self.__asset_shard(asset_path_id).get_asset_type_name(asset_path_id)
+
+    def get_asset_datas(self, asset_path_ids: Iterable[str]) -> List[AssetData]:
+        asset_path_ids = list(asset_path_ids)
+        found = {}
+        for shard_index, path_ids in self.__group_by_shard(asset_path_ids, self.shard_index_for_asset).items():
+            found.update((x.path_id, x) for x in self.__shards[shard_index].get_asset_datas(path_ids))
+        return [found[x] for x in asset_path_ids if x in found]
+
+    def get_asset_version_datas(self, asset_path_id_version_pairs: Iterable[Tuple[str, Optional[Tuple[int, int, int]]]]) -> List[AssetVersionData]:
+        pairs = list(enumerate(asset_path_id_version_pairs))
+        found: Dict[int, AssetVersionData] = {}
+        for shard_index, shard_pairs in self.__group_by_shard(pairs, lambda x: self.shard_index_for_asset(x[1][0])).items():
+            datas = iter(self.__shards[shard_index].get_asset_version_datas([pair for _, pair in shard_pairs]))
+            # shard skips what was not found, but keeps request order, so results are matched greedily
+            data = next(datas, None)
+            for i, (asset_path_id, version_id) in shard_pairs:
+                if data is not None and data.asset_path_id == asset_path_id and (version_id is None or tuple(data.version_id) == tuple(version_id)):
+                    found[i] = data
+                    data = next(datas, None)
+        return [found[i] for i, _ in pairs if i in found]
+
+    def get_asset_version_datas_from_path_id(self, asset_version_path_ids: Iterable[str]) -> List[AssetVersionData]:
+        asset_version_path_ids = list(asset_version_path_ids)
+        found = {}
+        for shard_index, path_ids in self.__group_by_shard(asset_version_path_ids, self.shard_index_for_version).items():
+            found.update((x.path_id, x) for x in self.__shards[shard_index].get_asset_version_datas_from_path_id(path_ids))
+        return [found[x] for x in asset_version_path_ids if x in found]
+
+    def get_data_availabilities(self, asset_version_path_ids: Iterable[str]) -> Dict[str, DataState]:
+        result = {}
+        for shard_index, path_ids in self.__group_by_shard(asset_version_path_ids, self.shard_index_for_version).items():
+            result.update(self.__shards[shard_index].get_data_availabilities(path_ids))
+        return result
+
+    def get_asset_versions_data_fields(self, asset_version_path_ids: Iterable[str], keys: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        keys = list(keys)
+        result = {}
+        for shard_index, path_ids in self.__group_by_shard(asset_version_path_ids, self.shard_index_for_version).items():
+            result.update(self.__shards[shard_index].get_asset_versions_data_fields(path_ids, keys))
+        return result
+
+    def get_leaf_asset_version_pathids(self, *,
+                                       asset_type_name: Optional[str] = None,
+                                       asset_path_id_prefix: Optional[str] = None,
+                                       after_path_id: Optional[str] = None,
+                                       limit: Optional[int] = None) -> List[str]:
+        # every shard gives its own first page, they are merged and the first page of the merge is returned
+        pages = [shard.get_leaf_asset_version_pathids(asset_type_name=asset_type_name,
+                                                      asset_path_id_prefix=asset_path_id_prefix,
+                                                      after_path_id=after_path_id,
+                                                      limit=limit) for shard in self.__shards]
+        return list(heapq.merge(*pages))[:limit]
+
+    def get_asset_datas_page(self, *,
+                             type_name: Optional[str] = None,
+                             prefix: Optional[str] = None,
+                             after_path_id: Optional[str] = None,
+                             limit: Optional[int] = None) -> List[AssetData]:
+        pages = [shard.get_asset_datas_page(type_name=type_name, prefix=prefix, after_path_id=after_path_id, limit=limit)
+                 for shard in self.__shards]
+        return list(heapq.merge(*pages, key=lambda x: x.path_id))[:limit]
+
+    def get_asset_version_datas_page(self, *,
+                                     asset_path_id: Optional[str] = None,
+                                     state: Optional[DataState] = None,
+                                     after_path_id: Optional[str] = None,
+                                     limit: Optional[int] = None) -> List[AssetVersionData]:
+        if asset_path_id is not None:
+            return self.__asset_shard(asset_path_id).get_asset_version_datas_page(asset_path_id=asset_path_id, state=state,
+                                                                                  after_path_id=after_path_id, limit=limit)
+        pages = [shard.get_asset_version_datas_page(state=state, after_path_id=after_path_id, limit=limit)
+                 for shard in self.__shards]
+        return list(heapq.merge(*pages, key=lambda x: x.path_id))[:limit]
+
+    # setters
+
+    @contextmanager
+    def transaction(self, wait: bool = True) -> Iterator[None]:
+        """
+        shards join the transaction lazily, the first time a write is routed to them,
+        so a transaction writing to one shard does not hold other shards' write locks.
+
+        NOTE: shards are committed one after another, so like any write spanning shards it is only atomic per shard:
+        if a later shard fails to commit - earlier ones stay committed.
+
+        to never deadlock, a transaction only waits for shard locks in shard order:
+        a shard preceding any already joined one is joined only if its lock is free right away,
+        otherwise WriteLockBusyError is raised and the whole transaction is rolled back, and may be retried by the caller
+        """
+        if getattr(self.__local, 'joined', None) is not None:  # nested - just join the outer one
+            yield
+            return
+        with ExitStack() as stack:
+            self.__local.stack = stack
+            self.__local.joined = set()
+            self.__local.wait = wait
+            try:
+                yield
+            finally:
+                self.__local.stack = None
+                self.__local.joined = None
+
+    def create_new_asset(self, asset_type: str, asset_data: AssetData) -> AssetData:
+        if asset_data.path_id is None:
+            # same as shards would do, but path_id is needed for routing
+            asset_data.path_id = re.sub(r'\W', '_', asset_data.name)
+        return self.__writable_asset_shard(asset_data.path_id).create_new_asset(asset_type, asset_data)
+
+    def publish_new_asset_version(self, asset_path_id: str, version_data: AssetVersionData, dependencies: Iterable[str]) -> AssetVersionData:
+        return self.publish_new_asset_versions([(asset_path_id, version_data, dependencies)])[0]
+
+    def publish_new_asset_versions(self, batch: Iterable[Tuple[str, AssetVersionData, Iterable[str]]]) -> List[AssetVersionData]:
+        """
+        consecutive batch elements going to the same shard are published atomically,
+        batch as a whole is not atomic
+        """
+        batch = [(asset_path_id, version_data, list(dependencies)) for asset_path_id, version_data, dependencies in batch]
+        for asset_path_id, version_data, _ in batch:
+            if version_data.path_id is not None and version_data.path_id.rsplit('/', 1)[0] != asset_path_id:
+                raise ValueError(f'sharded storage needs version path_id to be "{asset_path_id}/<version>", not "{version_data.path_id}"')
+
+        runs: List[Tuple[int, list]] = []
+        for item in batch:
+            shard_index = self.shard_index_for_asset(item[0])
+            if not runs or runs[-1][0] != shard_index:
+                runs.append((shard_index, []))
+            runs[-1][1].append(item)
+
+        for shard_index, run in runs:
+            shard = self.__writable_shard(shard_index)
+            with shard.transaction():
+                shard.publish_new_asset_versions(run)
+                # shards would not notice dangling references, so they are checked here, before the run commits.
+                # only versions the run itself just published are known to exist
+                published = {version_data.path_id for _, version_data, _ in run}
+                self.__check_versions_exist({x for _, _, dependencies in run for x in dependencies if x not in published})
+            for _, version_data, dependencies in run:
+                self.__mirror_dependency_edges(version_data.path_id, dependencies, True)
+        return [version_data for _, version_data, _ in batch]
+
+    def __mirror_dependency_edges(self, version_path_id: str, dependency_path_ids: Iterable[str], add: bool):
+        """
+        add or remove reverse copies of edges to versions in other shards
+        """
+        own_shard_index = self.shard_index_for_version(version_path_id)
+        for shard_index, deps in self.__group_by_shard(dependency_path_ids, self.shard_index_for_version).items():
+            if shard_index == own_shard_index:
+                continue
+            if add:
+                self.__writable_shard(shard_index).add_dependencies(version_path_id, deps)
+            else:
+                self.__writable_shard(shard_index).remove_dependencies(version_path_id, deps)
+
+    # templates
+
+    def get_asset_template_datas_for_asset_path_id(self, asset_path_ids: Iterable[str]) -> List[AssetTemplateData]:
+        asset_path_ids = list(asset_path_ids)
+        found = {}
+        for shard_index, path_ids in self.__group_by_shard(asset_path_ids, self.shard_index_for_asset).items():
+            found.update((x.asset_path_id, x) for x in self.__shards[shard_index].get_asset_template_datas_for_asset_path_id(path_ids))
+        return [found[x] for x in asset_path_ids if x in found]
+
+    def create_asset_template(self, asset_template_data: AssetTemplateData,
+                                    trigger_asset_path_ids: Iterable[str],
+                                    asset_version_dependencies: Iterable[str]) -> AssetTemplateData:
+        trigger_asset_path_ids = list(trigger_asset_path_ids)
+        asset_version_dependencies = list(asset_version_dependencies)
+        existing_assets = {x.path_id for x in self.get_asset_datas([asset_template_data.asset_path_id, *trigger_asset_path_ids])}
+        for asset_path_id in [asset_template_data.asset_path_id, *trigger_asset_path_ids]:
+            if asset_path_id not in existing_assets:
+                raise NotFoundError(f'asset "{asset_path_id}" does not exist')
+        self.__check_versions_exist(asset_version_dependencies)
+        return self.__writable_asset_shard(asset_template_data.asset_path_id).create_asset_template(asset_template_data, trigger_asset_path_ids, asset_version_dependencies)
+
+    def update_asset_template_data(self, asset_template_data: AssetTemplateData):
+        return self.__writable_asset_shard(asset_template_data.asset_path_id).update_asset_template_data(asset_template_data)
+
+    def update_asset_template_datas(self, asset_template_datas: Iterable[AssetTemplateData]):
+        for shard_index, datas in self.__group_by_shard(asset_template_datas, lambda x: self.shard_index_for_asset(x.asset_path_id)).items():
+            self.__writable_shard(shard_index).update_asset_template_datas(datas)
+
+    def get_asset_templates_triggered_by(self, asset_path_id: str) -> List[AssetTemplateData]:
+        # templates may be triggered from any shard
+        return [template for shard in self.__shards for template in shard.get_asset_templates_triggered_by(asset_path_id)]
+
+    def get_asset_templates_downstream_of(self, asset_path_ids: Iterable[str]) -> List[Tuple[str, AssetTemplateData]]:
+        # every shard walks its own part of the graph in one go.
+        # templates found in one shard may trigger templates in another, so walk again from those, until nothing new is found
+        edges = []
+        seen_edges = set()
+        frontier = list(dict.fromkeys(asset_path_ids))
+        reached = set(frontier)
+        while frontier:
+            new_frontier = []
+            for shard in self.__shards:
+                for asset_path_id, template_data in shard.get_asset_templates_downstream_of(frontier):
+                    if (asset_path_id, template_data.asset_path_id) in seen_edges:
+                        continue
+                    seen_edges.add((asset_path_id, template_data.asset_path_id))
+                    edges.append((asset_path_id, template_data))
+                    if template_data.asset_path_id not in reached:
+                        reached.add(template_data.asset_path_id)
+                        new_frontier.append(template_data.asset_path_id)
+            frontier = new_frontier
+        return edges
+
+    def get_template_fixed_dependencies(self, asset_path_id: str) -> Iterable[str]:
+        return self.__asset_shard(asset_path_id).get_template_fixed_dependencies(asset_path_id)
+
+    def get_templates_fixed_dependencies(self, asset_path_ids: Iterable[str]) -> Dict[str, List[str]]:
+        result = {}
+        for shard_index, path_ids in self.__group_by_shard(asset_path_ids, self.shard_index_for_asset).items():
+            result.update(self.__shards[shard_index].get_templates_fixed_dependencies(path_ids))
+        return result
+
+    # change feed
+
+    def get_changes_since(self, seq: int, limit: Optional[int] = None) -> List[ChangeRecord]:
+        raise NotImplementedError('shards have separate change feeds, use get_shards()')
+
+    def get_last_change_seq(self) -> int:
+        raise NotImplementedError('shards have separate change feeds, use get_shards()')
+
+    # scheduling execution
+
+    def schedule_data_computation_for_asset_version(self, path_id: str) -> FutureResult:
+        return self.__writable_version_shard(path_id).schedule_data_computation_for_asset_version(path_id)
+
+    def data_computation_completed_callback(self, path_id: str, data: dict):
+        return self.__writable_version_shard(path_id).data_computation_completed_callback(path_id, data)
+
+    def data_computations_completed_callback(self, completions: Iterable[Tuple[str, dict]]) -> List[Optional[Exception]]:
+        completions = list(enumerate(completions))
+        errors: List[Optional[Exception]] = [None] * len(completions)
+        for shard_index, shard_completions in self.__group_by_shard(completions, lambda x: self.shard_index_for_version(x[1][0])).items():
+            shard_errors = self.__writable_shard(shard_index).data_computations_completed_callback([x for _, x in shard_completions])
+            for (i, _), error in zip(shard_completions, shard_errors):
+                errors[i] = error
+        return errors
+
+    # dependencies
+
+    def get_version_dependencies(self, version_path_id: str) -> Iterable[str]:
+        return self.__version_shard(version_path_id).get_version_dependencies(version_path_id)
+
+    def get_dependent_versions(self, version_path_id: str) -> Iterable[str]:
+        # cross-shard dependants are mirrored here too
+        return self.__version_shard(version_path_id).get_dependent_versions(version_path_id)
+
+    def get_transitive_dependencies(self, version_path_ids: Iterable[str], max_depth: Optional[int] = None) -> List[DependencyEdge]:
+        return self.__walk_dependency_edges(version_path_ids, max_depth, False)
+
+    def get_transitive_dependants(self, version_path_ids: Iterable[str], max_depth: Optional[int] = None) -> List[DependencyEdge]:
+        return self.__walk_dependency_edges(version_path_ids, max_depth, True)
+
+    def __walk_dependency_edges(self, version_path_ids: Iterable[str], max_depth: Optional[int], downstream: bool) -> List[DependencyEdge]:
+        """
+        breadth-first walk, one request per shard per layer
+        """
+        edges = []
+        visited = set(version_path_ids)
+        layer = list(visited)
+        depth = 1
+        while layer and (max_depth is None or depth <= max_depth):
+            next_layer = []
+            for shard_index, path_ids in self.__group_by_shard(layer, self.shard_index_for_version).items():
+                shard = self.__shards[shard_index]
+                if downstream:
+                    shard_edges = shard.get_transitive_dependants(path_ids, 1)
+                else:
+                    shard_edges = shard.get_transitive_dependencies(path_ids, 1)
+                for edge in shard_edges:
+                    edges.append(DependencyEdge(edge.dependant, edge.depends_on, depth))
+                    neighbour = edge.dependant if downstream else edge.depends_on
+                    if neighbour not in visited:
+                        visited.add(neighbour)
+                        next_layer.append(neighbour)
+            layer = next_layer
+            depth += 1
+        return edges
+
+    def add_dependencies(self, version_path_id: str, dependency_path_ids: Iterable[str]):
+        dependency_path_ids = list(dependency_path_ids)
+        if not dependency_path_ids:
+            return
+        self.__check_versions_exist([version_path_id, *dependency_path_ids])
+        # shards only see their part of the graph, so cycles are checked here
+        for dep in dependency_path_ids:
+            if dep == version_path_id or self.version_depends_on(dep, version_path_id):
+                raise DependencyCycleError(f'"{version_path_id}" cannot depend on "{dep}": "{dep}" already depends on it')
+        owner_shard = self.__writable_version_shard(version_path_id)
+        existing = set(owner_shard.get_version_dependencies(version_path_id))
+        new_dependency_path_ids = [x for x in dependency_path_ids if x not in existing]
+        owner_shard.add_dependencies(version_path_id, new_dependency_path_ids)
+        try:
+            self.__mirror_dependency_edges(version_path_id, new_dependency_path_ids, True)
+        except BaseException:
+            # keep it so that a mirror may only be missing if owner does not have the edge either
+            owner_shard.remove_dependencies(version_path_id, new_dependency_path_ids)
+            raise
+
+    def remove_dependencies(self, version_path_id: str, dependency_path_ids: Iterable[str]):
+        dependency_path_ids = list(dependency_path_ids)
+        if not dependency_path_ids:
+            return
+        # mirrors go first, for the same reason
+        self.__mirror_dependency_edges(version_path_id, dependency_path_ids, False)
+        self.__writable_version_shard(version_path_id).remove_dependencies(version_path_id, dependency_path_ids)
+
+    # files location
+
+    def get_pipeline_render_root(self) -> Path:
+        return self.__shards[0].get_pipeline_render_root()
+
+    def get_pipeline_cache_root(self) -> Path:
+        return self.__shards[0].get_pipeline_cache_root()
+
+    def get_pipeline_source_root(self) -> Path:
+        return self.__shards[0].get_pipeline_source_root()
@@ -11,6 +11,8 @@ from typing import Optional, Tuple, Iterable, Dict, List
 
 
 class SourcedAssetCommon(SpecializedAssetBase):
+    __slots__ = ()
+
     def store_source(self, path: Path) -> Path:
         # save scene into some immutable location.
         with open(path, 'rb') as f:
@@ -24,6 +26,8 @@ class SourcedAssetCommon(SpecializedAssetBase):
 
 
 class HipSourcedAssetCommon(SourcedAssetCommon):
+    __slots__ = ()
+
     def generate_lifeblood_attributes(self, source_hip, driver_node_path, *,
                                       compute_type_name, task_name, mask_as_hip, frame_range, lock_asset_versions, extra_env_requirements):
         base_env_requirements = {'user': getuser()}  # theoretically all packages should be retrieved here from env, but we have a simplified example
@@ -54,6 +58,8 @@ class CacheAsset(HipSourcedAssetCommon):
     """
     this asset represents something with cache, for ex: model, geometry sequence, vdb sequence
     """
+    __slots__ = ()
+
     def create_new_version(self, source: Tuple[str, str], frame_range: Tuple[int, int], is_sim: bool = False, version_id: Optional[VersionType] = None,
                            *, extra_env_requirements: Optional[Dict[str, str]] = None,
                            lock_asset_versions: Dict[str, str] = None,
@@ -97,19 +103,23 @@ class CacheAsset(HipSourcedAssetCommon):
 
 
 class CacheAssetVersion(SpecializedAssetVersionBase):
+    __slots__ = ()
+
     @property
     def cache_path(self):
-        return self.get_data()['cache_path_template']
+        return self.get_field('cache_path_template')
 
     @property
     def frame_range(self):
-        return self.get_data()['frame_range']
+        return self.get_field('frame_range')
 
 
 class RenderAsset(HipSourcedAssetCommon):
     """
     this asset represents something rendered, image sequence
     """
+    __slots__ = ()
+
     def create_new_version(self, source: Tuple[str, str], frame_range: Tuple[int, int], version_id: Optional[VersionType] = None,
                            *, extra_env_requirements: Optional[Dict[str, str]] = None,
                            lock_asset_versions: Dict[str, str],
@@ -142,14 +152,18 @@ class RenderAsset(HipSourcedAssetCommon):
 
 
 class RenderAssetVersion(SpecializedAssetVersionBase):
+    __slots__ = ()
+
     def render_sequence_path(self):
-        return self.get_data()['render_path_template']
+        return self.get_field('render_path_template')
 
     def frame_range(self):
-        return self.get_data()['frame_range']
+        return self.get_field('frame_range')
 
 
 class ComposeAsset(SourcedAssetCommon):
+    __slots__ = ()
+
     def generate_lifeblood_attributes(self, source_file, *,
                                       compute_type_name, task_name, frame_range, lock_asset_versions, extra_env_requirements):
         base_env_requirements = {'user': getuser()}  # theoretically all packages should be retrieved here from env, but we have a simplified example
@@ -204,8 +218,10 @@ class ComposeAsset(SourcedAssetCommon):
 
 
 class ComposeAssetVersion(SpecializedAssetVersionBase):
+    __slots__ = ()
+
     def render_sequence_path(self):
-        return self.get_data()['render_path_template']
+        return self.get_field('render_path_template')
 
     def frame_range(self):
-        return self.get_data()['frame_range']
+        return self.get_field('frame_range')
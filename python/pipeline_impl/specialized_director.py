@@ -1,8 +1,9 @@
+from pipeline.asset_data import AssetData
 from pipeline.director import Director, AssetFactory, DataAccessInterface, UriHandlerBase
 from pipeline.specialized_asset_base import SpecializedAssetBase, Asset
 from .specialized_assets import CacheAsset, RenderAsset, ComposeAsset
 
-from typing import Iterable, Type
+from typing import Iterable, Optional, Type
 
 
 class SpecializedAssetFactory(AssetFactory):
@@ -10,8 +11,8 @@ class SpecializedAssetFactory(AssetFactory):
         self.__director = director
         self.__class = specialized_class
 
-    def __call__(self, asset_path_id: str) -> Asset:
-        return self.__class(asset_path_id, self.__director)
+    def __call__(self, asset_path_id: str, asset_data: Optional[AssetData] = None) -> Asset:
+        return self.__class(asset_path_id, self.__director, asset_data)
 
     def asset_type(self) -> Type[Asset]:
         return self.__class
@@ -0,0 +1,407 @@
+import os
+import time
+import random
+import bisect
+import threading
+import sqlite3
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+from pipeline import instrumentation
+from pipeline.data_access_interface import ReadOnlyError, WriteLockBusyError
+
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, TypeVar, Union
+
+T = TypeVar('T')
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    how long to wait for a database locked by another writer.
+
+    each attempt lets sqlite itself wait up to busy_timeout seconds,
+    after that we sleep a random time up to an exponentially growing bound and try again,
+    up to max_attempts attempts in total, after which the "database is locked" error is raised.
+    random sleep keeps writers that gave up at the same time from coming back at the same time
+    """
+    busy_timeout: float = 5.0
+    max_attempts: int = 6
+    base_delay: float = 0.02
+    max_delay: float = 1.0
+
+    def __post_init__(self):
+        if self.max_attempts < 1:
+            raise ValueError('max_attempts must be positive')
+        if self.busy_timeout < 0 or self.base_delay < 0 or self.max_delay < 0:
+            raise ValueError('timeouts and delays must not be negative')
+
+    def backoff_delay(self, attempt: int) -> float:
+        """
+        delay before given retry, attempt counts from 0
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class Histogram:
+    """
+    counts of observed values falling into buckets with given upper bounds, last bucket is unbounded
+    """
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.__bounds = tuple(sorted(bounds))
+        self.__counts = [0] * (len(self.__bounds) + 1)
+        self.__total = 0.0
+        self.__max = 0.0
+
+    def observe(self, value: float):
+        self.__counts[bisect.bisect_left(self.__bounds, value)] += 1
+        self.__total += value
+        self.__max = max(self.__max, value)
+
+    def as_dict(self) -> dict:
+        count = sum(self.__counts)
+        return {'count': count,
+                'sum': self.__total,
+                'max': self.__max,
+                'buckets': {**{f'<={bound:g}': c for bound, c in zip(self.__bounds, self.__counts)},
+                            f'>{self.__bounds[-1]:g}': self.__counts[-1]}}
+
+
+class _LockWait:
+    """
+    lock waiting done by one transaction
+    """
+    __slots__ = ('seconds', 'busy_errors', 'retries', 'gave_up')
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.busy_errors = 0
+        self.retries = 0
+        self.gave_up = False
+
+
+class ContentionStats:
+    """
+    lock contention counters and histograms of a connection manager, collected in current process.
+    lock wait is the time spent getting the write lock (BEGIN IMMEDIATE) and committing, including retries
+    """
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.__lock:
+            self.__counters: Dict[str, int] = {'transactions': 0, 'busy_errors': 0, 'retries': 0, 'gave_up': 0}
+            self.__lock_wait = Histogram((0.001, 0.01, 0.1, 1.0, 10.0))
+            self.__retries = Histogram((0, 1, 2, 4, 8))
+
+    def _record(self, wait: _LockWait):
+        instrumentation.record_lock_wait(wait.seconds)
+        with self.__lock:
+            self.__counters['transactions'] += 1
+            self.__counters['busy_errors'] += wait.busy_errors
+            self.__counters['retries'] += wait.retries
+            self.__counters['gave_up'] += int(wait.gave_up)
+            self.__lock_wait.observe(wait.seconds)
+            self.__retries.observe(wait.retries)
+
+    def as_dict(self) -> dict:
+        with self.__lock:
+            return {**self.__counters,
+                    'lock_wait_seconds': self.__lock_wait.as_dict(),
+                    'retries_per_transaction': self.__retries.as_dict()}
+
+
+def is_busy_error(e: sqlite3.OperationalError) -> bool:
+    code = getattr(e, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return str(e).startswith(('database is locked', 'database table is locked'))
+
+
+class _InstrumentedCursor(sqlite3.Cursor):
+    """
+    cursor reporting statements, rows and time spent in sqlite to pipeline.instrumentation, when it is active
+    """
+    def execute(self, sql, parameters=()):
+        if not instrumentation.is_active():
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            instrumentation.record_statement(time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not instrumentation.is_active():
+            return super().executemany(sql, seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            instrumentation.record_statement(time.perf_counter() - start)
+
+    def executescript(self, sql_script):
+        if not instrumentation.is_active():
+            return super().executescript(sql_script)
+        start = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            instrumentation.record_statement(time.perf_counter() - start)
+
+    def fetchone(self):
+        if not instrumentation.is_active():
+            return super().fetchone()
+        start = time.perf_counter()
+        row = super().fetchone()
+        instrumentation.record_rows(int(row is not None), time.perf_counter() - start)
+        return row
+
+    def fetchmany(self, size=None):
+        if not instrumentation.is_active():
+            return super().fetchmany(self.arraysize if size is None else size)
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        instrumentation.record_rows(len(rows), time.perf_counter() - start)
+        return rows
+
+    def fetchall(self):
+        if not instrumentation.is_active():
+            return super().fetchall()
+        start = time.perf_counter()
+        rows = super().fetchall()
+        instrumentation.record_rows(len(rows), time.perf_counter() - start)
+        return rows
+
+    def __next__(self):
+        if not instrumentation.is_active():
+            return super().__next__()
+        start = time.perf_counter()
+        row = super().__next__()
+        instrumentation.record_rows(1, time.perf_counter() - start)
+        return row
+
+
+class _InstrumentedConnection(sqlite3.Connection):
+    # Connection's own execute shortcuts do not go through cursor(), so they are redirected here
+    def cursor(self, factory=_InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+class SqliteConnectionManager:
+    """
+    keeps one long-lived connection per thread (per process) to the given database.
+
+    connection setup (row factory, pragmas, statement cache size) happens once per connection.
+    connections are bound to the process that created them: after a fork the child
+    will transparently open its own connections and will never touch the ones inherited from the parent.
+
+    read_only manager opens database as immutable: sqlite will not take any locks nor look at wal,
+    so this must only be used for files that nothing writes to, like exported snapshots
+
+    getting the write lock and committing are retried according to retry_policy when database is locked.
+    transaction body itself is never re-run, so retries cannot apply a write twice
+    """
+    def __init__(self, db_path: Union[Path, str], *,
+                 cached_statements: int = 256,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 read_only: bool = False,
+                 connection_setup: Optional[Callable[[sqlite3.Connection], None]] = None):
+        self.__db_path = db_path
+        self.__read_only = read_only
+        self.__cached_statements = cached_statements
+        self.__retry_policy = retry_policy or RetryPolicy()
+        self.__stats = ContentionStats()
+        self.__connection_setup = connection_setup
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+        self.__pid = os.getpid()
+        self.__connections: List[sqlite3.Connection] = []
+
+    def __new_connection(self) -> sqlite3.Connection:
+        # isolation_level=None - we manage transactions ourselves, see transaction()
+        if self.__read_only:
+            database, uri = f'{Path(self.__db_path).absolute().as_uri()}?mode=ro&immutable=1', True
+        else:
+            database, uri = self.__db_path, False
+        con = sqlite3.connect(database,
+                              uri=uri,
+                              timeout=self.__retry_policy.busy_timeout,
+                              isolation_level=None,
+                              check_same_thread=False,  # so that close() can be called from any thread
+                              factory=_InstrumentedConnection,
+                              cached_statements=self.__cached_statements)
+        con.row_factory = sqlite3.Row
+        if not self.__read_only:
+            con.execute('PRAGMA synchronous=NORMAL')
+        if self.__connection_setup is not None:
+            self.__connection_setup(con)
+        return con
+
+    def __check_fork(self):
+        pid = os.getpid()
+        if pid == self.__pid:
+            return
+        # we are in a forked child. connections inherited from parent must not be used NOR closed here,
+        # so we just forget about them
+        with self.__lock:
+            if pid != self.__pid:
+                self.__pid = pid
+                self.__connections = []
+                self.__local = threading.local()
+
+    def is_read_only(self) -> bool:
+        return self.__read_only
+
+    def get_retry_policy(self) -> RetryPolicy:
+        return self.__retry_policy
+
+    def get_contention_stats(self) -> ContentionStats:
+        return self.__stats
+
+    def __with_retries(self, func: Callable[[], T], wait: _LockWait) -> T:
+        """
+        call func, retrying it while it fails with database locked error.
+        func must be safe to call again after such failure
+        """
+        start = time.perf_counter()
+        attempt = 0
+        try:
+            while True:
+                try:
+                    return func()
+                except sqlite3.OperationalError as e:
+                    if not is_busy_error(e):
+                        raise
+                    wait.busy_errors += 1
+                    if attempt + 1 >= self.__retry_policy.max_attempts:
+                        wait.gave_up = True
+                        raise
+                time.sleep(self.__retry_policy.backoff_delay(attempt))
+                attempt += 1
+                wait.retries += 1
+        finally:
+            wait.seconds += time.perf_counter() - start
+
+    def call_with_retries(self, func: Callable[[sqlite3.Connection], T]) -> T:
+        """
+        call func with current thread's connection outside of any transaction(),
+        retrying it while database is locked. func must be idempotent, like schema creation
+        """
+        con = self.get_connection()
+        wait = _LockWait()
+        try:
+            return self.__with_retries(lambda: func(con), wait)
+        finally:
+            self.__stats._record(wait)
+
+    def get_connection(self) -> sqlite3.Connection:
+        """
+        get connection for current thread, create one if needed
+        """
+        self.__check_fork()
+        con = getattr(self.__local, 'connection', None)
+        if con is None:
+            con = self.__new_connection()
+            self.__local.connection = con
+            self.__local.depth = 0
+            with self.__lock:
+                self.__connections.append(con)
+        return con
+
+    def is_in_transaction(self) -> bool:
+        """
+        whether current thread is inside a transaction() block
+        """
+        self.__check_fork()
+        return getattr(self.__local, 'depth', 0) > 0
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        context for read operations.
+        if used inside a transaction() block - works with that same transaction
+        """
+        yield self.get_connection()
+
+    def __begin_without_waiting(self, con: sqlite3.Connection, begin_statement: str, wait: _LockWait):
+        con.execute('PRAGMA busy_timeout = 0')
+        try:
+            con.execute(begin_statement)
+        except sqlite3.OperationalError as e:
+            if not is_busy_error(e):
+                raise
+            wait.busy_errors += 1
+            wait.gave_up = True
+            raise WriteLockBusyError(f'database "{self.__db_path}" is locked by another writer') from e
+        finally:
+            con.execute(f'PRAGMA busy_timeout = {int(self.__retry_policy.busy_timeout * 1000)}')
+
+    @contextmanager
+    def transaction(self, immediate: bool = True, wait: bool = True) -> Iterator[sqlite3.Connection]:
+        """
+        context for write operations.
+        outermost transaction() begins the transaction and commits it on exit, or rolls it back on exception.
+        nested transaction() blocks just join the outer transaction.
+        if wait is False and database is locked by another writer - WriteLockBusyError is raised right away, without retries
+        """
+        if self.__read_only:
+            raise ReadOnlyError(f'database "{self.__db_path}" is opened read-only')
+        con = self.get_connection()
+        local = self.__local
+        if local.depth > 0:
+            local.depth += 1
+            try:
+                yield con
+            finally:
+                local.depth -= 1
+            return
+
+        # BEGIN and COMMIT that failed with busy error leave nothing done and can be repeated
+        lock_wait = _LockWait()
+        try:
+            if wait:
+                self.__with_retries(lambda: con.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN'), lock_wait)
+            else:
+                self.__begin_without_waiting(con, 'BEGIN IMMEDIATE' if immediate else 'BEGIN', lock_wait)
+            local.depth = 1
+            try:
+                yield con
+            except BaseException:
+                local.depth = 0
+                if con.in_transaction:
+                    con.rollback()
+                raise
+            local.depth = 0
+            try:
+                self.__with_retries(con.commit, lock_wait)
+            except BaseException:
+                if con.in_transaction:
+                    con.rollback()
+                raise
+        finally:
+            self.__stats._record(lock_wait)
+
+    def close(self):
+        """
+        close all connections opened by this manager in current process.
+        manager stays usable, new connections will be opened on demand
+        """
+        self.__check_fork()
+        with self.__lock:
+            connections = self.__connections
+            self.__connections = []
+            self.__local = threading.local()
+        for con in connections:
+            con.close()
@@ -3,28 +3,176 @@ import re
 from pathlib import Path
 import sqlite3
 import json
+from contextlib import contextmanager
 
-from pipeline.asset_data import AssetVersionData, AssetData, DataState, AssetTemplateData
-from pipeline.data_access_interface import DataAccessInterface, NotFoundError
+from pipeline.asset_data import AssetVersionData, LazyAssetVersionData, AssetData, DataState, AssetTemplateData, DependencyEdge, ChangeType, ChangeRecord
+from pipeline.data_access_interface import DataAccessInterface, NotFoundError, DependencyCycleError, ChangeLogTrimmedError
 from pipeline.future import FutureResult
 from pipeline.generation_task_parameters import GenerationTaskParameters
+from pipeline.instrumentation import instrumented_operations, timed_json_loads
 from pipeline.task_scheduling_interface import TaskSchedulingInterface, TaskSchedulingResultReportReceiver
+from .sqlite_connection_manager import SqliteConnectionManager, RetryPolicy
 
-from typing import Iterable, Tuple, List, Union, Optional
+from typing import Any, Dict, Iterable, Iterator, Tuple, List, Union, Optional
 
 
+@instrumented_operations
 class SqliteDataManagerWithLifeblood(DataAccessInterface, TaskSchedulingResultReportReceiver):
-    def __init__(self, db_path: Union[Path, str], task_scheduler: TaskSchedulingInterface):
+    def __init__(self, db_path: Union[Path, str], task_scheduler: TaskSchedulingInterface, *,
+                 maintain_dependency_closure: bool = False,
+                 read_only: bool = False,
+                 enforce_foreign_keys: bool = True,
+                 retry_policy: Optional[RetryPolicy] = None):
+        """
+        :param maintain_dependency_closure: keep dependency closure table up to date on every dependency change
+                                            to make reachability queries a single lookup.
+                                            this only makes sense if ALL writers to this db have it enabled,
+                                            any writer without it marks closure as stale,
+                                            and stale closure is not used until rebuilt with rebuild_dependency_closure()
+        :param read_only: open db as immutable, for snapshots made with export_snapshot().
+                          no locks are taken, and any write raises ReadOnlyError
+        :param enforce_foreign_keys: turn off to allow dependencies and template inputs
+                                     referring to versions and assets stored in other databases, see ShardedDataManager
+        :param retry_policy: how writes wait for db locked by other writers, see RetryPolicy
+        """
         super().__init__(task_scheduler)
         if isinstance(db_path, str):
             db_path = Path(db_path)
         self.__db_path = db_path
-        with sqlite3.connect(db_path) as con:
-            con.executescript(_init_script)
+        self.__maintain_closure = maintain_dependency_closure
+        self.__enforce_foreign_keys = enforce_foreign_keys
+        self.__connections = SqliteConnectionManager(db_path, read_only=read_only, retry_policy=retry_policy,
+                                                     connection_setup=self._setup_connection)
+        if read_only:
+            return
+        # init script only creates what does not exist yet, so it is safe to retry
+        self.__connections.call_with_retries(lambda con: con.executescript(_init_script))
+        with self.__connections.connection() as con:
+            if con.execute('PRAGMA user_version').fetchone()[0] < _schema_version:
+                with self.__connections.transaction():
+                    self.__migrate(con.cursor())
+        if maintain_dependency_closure:
+            with self.__connections.transaction() as con:
+                if not self.__is_closure_valid(con.cursor()):
+                    self.__rebuild_closure(con.cursor())
+
+    def __migrate(self, cur: sqlite3.Cursor):
+        """
+        bring data of a db created by older pipeline up to date.
+        tables themselves are created by init script, here we only fill them
+        """
+        cur.execute('PRAGMA user_version')
+        schema_version = cur.fetchone()[0]
+        if schema_version < 1:
+            self.__rebuild_latest_versions(cur)
+        if schema_version < 2:
+            self.__rebuild_leaf_versions(cur)
+        cur.execute(f'PRAGMA user_version = {_schema_version}')
+
+    @staticmethod
+    def __rebuild_latest_versions(cur: sqlite3.Cursor, schema: str = 'main'):
+        cur.execute(f'DELETE FROM {schema}.asset_latest_versions')
+        cur.execute(f'INSERT INTO {schema}.asset_latest_versions (asset_pathid, pathid, version_0, version_1, version_2) '
+                    f'SELECT asset_pathid, pathid, version_0, version_1, version_2 FROM ('
+                    f'  SELECT asset_pathid, pathid, version_0, version_1, version_2, '
+                    f'  row_number() OVER (PARTITION BY asset_pathid ORDER BY version_0 DESC, version_1 DESC, version_2 DESC) AS rank '
+                    f'  FROM {schema}.asset_versions'
+                    f') WHERE rank == 1')
+
+    @staticmethod
+    def __rebuild_leaf_versions(cur: sqlite3.Cursor, schema: str = 'main'):
+        cur.execute(f'DELETE FROM {schema}.asset_version_leaves')
+        cur.execute(f'INSERT INTO {schema}.asset_version_leaves (pathid, asset_pathid, type_name) '
+                    f'SELECT asset_versions.pathid, asset_versions.asset_pathid, assets.type_name '
+                    f'FROM {schema}.asset_versions INNER JOIN {schema}.assets ON assets.pathid == asset_versions.asset_pathid '
+                    f'WHERE NOT EXISTS(SELECT dependant FROM {schema}.asset_version_dependencies '
+                    f'                 WHERE asset_version_dependencies.depends_on == asset_versions.pathid)')
+
+    def _setup_connection(self, con: sqlite3.Connection):
+        if self.__enforce_foreign_keys:
+            con.execute('PRAGMA foreign_keys = ON')  # that fucker is OFF by default, remember that!
+
+    def close(self):
+        """
+        close all db connections opened by this manager in current process
+        """
+        self.__connections.close()
+
+    def get_contention_stats(self) -> dict:
+        """
+        write lock contention seen by this manager in current process:
+        counts of transactions, busy errors, retries and transactions that gave up,
+        and histograms of lock wait seconds and retries per transaction
+        """
+        return self.__connections.get_contention_stats().as_dict()
+
+    def reset_contention_stats(self):
+        self.__connections.get_contention_stats().reset()
+
+    def export_snapshot(self, snapshot_path: Union[Path, str], version_path_ids: Optional[Iterable[str]] = None):
+        """
+        export a consistent snapshot of the database into a new compact file, meant to be opened with read_only=True.
+        sqlite can neither VACUUM INTO nor ATTACH inside a transaction, so this cannot be called inside transaction()
+
+        :param snapshot_path: file to create
+        :param version_path_ids: if given - only these versions, everything they transitively depend on,
+                                 and their assets are exported. otherwise the whole db is exported
+        """
+        snapshot_path = Path(snapshot_path)
+        if self.__connections.is_in_transaction():
+            raise RuntimeError('snapshot cannot be exported inside a transaction, export it after the transaction ends')
+        if snapshot_path.exists():
+            raise FileExistsError(f'"{snapshot_path}" already exists')
+
+        with self.__connections.connection() as con:
+            if version_path_ids is None:
+                con.execute('VACUUM INTO ?', (str(snapshot_path),))
+            else:
+                with sqlite3.connect(snapshot_path) as snapshot_con:
+                    snapshot_con.executescript(_init_script)
+                snapshot_con.close()
+                con.execute('ATTACH DATABASE ? AS snapshot', (str(snapshot_path),))
+                try:
+                    # deferred transaction, so everything is read from the same state of main db
+                    with self.__connections.transaction(immediate=False):
+                        self.__export_versions_closure(con.cursor(), version_path_ids)
+                finally:
+                    con.execute('DETACH DATABASE snapshot')
+
+        # snapshots are never written to, so they don't need wal
+        snapshot_con = sqlite3.connect(snapshot_path)
+        try:
+            snapshot_con.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            snapshot_con.close()
+
+    def __export_versions_closure(self, cur: sqlite3.Cursor, version_path_ids: Iterable[str]):
+        version_path_ids = list(version_path_ids)
+        all_version_path_ids = json.dumps(list({*version_path_ids,
+                                                *(x.depends_on for x in self.get_transitive_dependencies(version_path_ids))}))
+        cur.execute('INSERT INTO snapshot.assets (pathid, name, description, type_name) '
+                    'SELECT pathid, name, description, type_name FROM main.assets '
+                    'WHERE pathid IN (SELECT asset_pathid FROM main.asset_versions WHERE pathid IN (SELECT value FROM json_each(?)))',
+                    (all_version_path_ids,))
+        cur.execute(f'INSERT INTO snapshot.asset_versions ({_asset_version_columns}) '
+                    f'SELECT {_asset_version_columns} FROM main.asset_versions WHERE pathid IN (SELECT value FROM json_each(?))',
+                    (all_version_path_ids,))
+        # set of versions is closed upstream, so all their dependencies are exported too
+        cur.execute('INSERT INTO snapshot.asset_version_dependencies (dependant, depends_on) '
+                    'SELECT dependant, depends_on FROM main.asset_version_dependencies WHERE dependant IN (SELECT value FROM json_each(?))',
+                    (all_version_path_ids,))
+        if self.__is_closure_valid(cur):
+            cur.execute('INSERT INTO snapshot.asset_version_closure (dependant, depends_on, path_count) '
+                        'SELECT dependant, depends_on, path_count FROM main.asset_version_closure WHERE dependant IN (SELECT value FROM json_each(?))',
+                        (all_version_path_ids,))
+            cur.execute('INSERT INTO snapshot.pipeline_meta (key, value) VALUES (?, 1)', (_meta_closure_valid,))
+        # derived data is rebuilt for the exported subset
+        self.__rebuild_latest_versions(cur, 'snapshot')
+        self.__rebuild_leaf_versions(cur, 'snapshot')
+        cur.execute(f'PRAGMA snapshot.user_version = {_schema_version}')
 
     def get_asset_type_name(self, asset_path_id: str):
-        with sqlite3.connect(self.__db_path) as con:
-            con.row_factory = sqlite3.Row
+        with self.__connections.connection() as con:
             cur = con.cursor()
             cur.execute(f'SELECT type_name FROM assets WHERE pathid == ?', (asset_path_id,))
             type_name = cur.fetchone()
@@ -33,8 +181,7 @@ class SqliteDataManagerWithLifeblood(DataAccessInterface, TaskSchedulingResultRe
         return type_name['type_name']
 
     def get_asset_datas(self, asset_path_ids: Iterable[str]) -> List[AssetData]:
-        with sqlite3.connect(self.__db_path) as con:
-            con.row_factory = sqlite3.Row
+        with self.__connections.connection() as con:
             cur = con.cursor()
             asset_path_ids = tuple(asset_path_ids)
             cur.execute(f'SELECT * FROM assets WHERE pathid IN ({",".join("?"*len(asset_path_ids))})', asset_path_ids)
@@ -43,68 +190,190 @@ class SqliteDataManagerWithLifeblood(DataAccessInterface, TaskSchedulingResultRe
         for data in datas:
             assdata = AssetData(path_id=data['pathid'],
                                 name=data['name'],
-                                description=data['description'])
+                                description=data['description'],
+                                type_name=data['type_name'])
             ret.append(assdata)
         return ret
 
     def get_asset_version_datas(self, asset_path_id_version_pairs: Iterable[Tuple[str, Optional[Tuple[int, int, int]]]]) -> List[AssetVersionData]:
-        with sqlite3.connect(self.__db_path) as con:
-            con.row_factory = sqlite3.Row
+        # whole request is passed as a single json array, so the number of statements does not depend on request size
+        # each request element becomes [asset_pathid, version_0, version_1, version_2], or [asset_pathid] to fetch the latest
+        # latest versions are looked up through maintained asset_latest_versions pointers
+        request = json.dumps([(pid,) if v is None else (pid, *v) for pid, v in asset_path_id_version_pairs])
+        with self.__connections.connection() as con:
             cur = con.cursor()
-            datas = []
-            for pid, v in asset_path_id_version_pairs:
-                # print(pid, v)
-                if v is None:  # fetch latest
-                    cur.execute('SELECT "pathid", "asset_pathid", version_0, version_1, version_2, data_task_attr, data_produced, data_calculator_id, data '
-                                'FROM asset_versions WHERE asset_pathid == ? '
-                                'ORDER BY version_0 DESC, version_1 DESC, version_2 DESC LIMIT 1', (pid,))
-                else:
-                    cur.execute('SELECT "pathid", "asset_pathid", version_0, version_1, version_2, data_task_attr, data_produced, data_calculator_id, data '
-                                'FROM asset_versions WHERE asset_pathid == ? AND version_0 == ? AND version_1 == ? AND version_2 == ?', (pid, *v))
-                datas.extend(cur.fetchall())
-        ret = []
-        for data in datas:
-            assdata = AssetVersionData(path_id=data['pathid'],
-                                       asset_path_id=data['asset_pathid'],
-                                       version_id=(data['version_0'], data['version_1'], data['version_2']),
-                                       data_producer_task_attrs=GenerationTaskParameters.deserialize(data['data_task_attr']),
-                                       data_availability=DataState(data['data_produced']),
-                                       data_calculator_id=data['data_calculator_id'],
-                                       data=json.loads(data['data']) if data['data'] is not None else None)
-            ret.append(assdata)
-        return ret
+            cur.execute(f'WITH request AS ('
+                        f"  SELECT key AS idx, json_extract(value, '$[0]') AS pid, "
+                        f"  json_extract(value, '$[1]') AS v0, json_extract(value, '$[2]') AS v1, json_extract(value, '$[3]') AS v2 "
+                        f'  FROM json_each(?)'
+                        f') '
+                        f'SELECT request.idx, {_asset_version_columns_prefixed} '
+                        f'FROM request INNER JOIN asset_versions ON asset_versions.asset_pathid == request.pid '
+                        f'AND asset_versions.version_0 == request.v0 AND asset_versions.version_1 == request.v1 AND asset_versions.version_2 == request.v2 '
+                        f'UNION ALL '
+                        f'SELECT request.idx, {_asset_version_columns_prefixed} '
+                        f'FROM request INNER JOIN asset_latest_versions AS latest ON latest.asset_pathid == request.pid '
+                        f'INNER JOIN asset_versions ON asset_versions.pathid == latest.pathid '
+                        f'WHERE request.v0 IS NULL '
+                        f'ORDER BY 1', (request,))
+            datas = cur.fetchall()
+        return [self._asset_version_data_from_row(data) for data in datas]
 
     def get_asset_version_datas_from_path_id(self, asset_version_path_ids: Iterable[str]) -> List[AssetVersionData]:
-        # TODO: this func and above are almost identical up to WHERE condition, so yeah...
-        with sqlite3.connect(self.__db_path) as con:
-            con.row_factory = sqlite3.Row
+        request = json.dumps(list(asset_version_path_ids))
+        with self.__connections.connection() as con:
             cur = con.cursor()
-            datas = []
-            for path_id in asset_version_path_ids:
-                cur.execute('SELECT "pathid", "asset_pathid", version_0, version_1, version_2, data_task_attr, data_produced, data_calculator_id, data '
-                            'FROM asset_versions WHERE pathid == ?', (path_id,))
-                datas.extend(cur.fetchall())
-        ret = []
-        for data in datas:
+            cur.execute(f'SELECT {_asset_version_columns_prefixed} '
+                        f'FROM json_each(?) AS request INNER JOIN asset_versions ON asset_versions.pathid == request.value '
+                        f'ORDER BY request.key', (request,))
+            datas = cur.fetchall()
+        return [self._asset_version_data_from_row(data) for data in datas]
+
+    @staticmethod
+    def _asset_version_data_from_row(data: sqlite3.Row) -> AssetVersionData:
+        # decoding of task attrs and data is postponed until they are needed
+        return LazyAssetVersionData(path_id=data['pathid'],
+                                    asset_path_id=data['asset_pathid'],
+                                    version_id=(data['version_0'], data['version_1'], data['version_2']),
+                                    serialized_data_producer_task_attrs=data['data_task_attr'],
+                                    data_availability=DataState(data['data_produced']),
+                                    data_calculator_id=data['data_calculator_id'],
+                                    serialized_data=data['data'])
+
+    def get_data_availabilities(self, asset_version_path_ids: Iterable[str]) -> Dict[str, DataState]:
+        with self.__connections.connection() as con:
+            cur = con.cursor()
+            cur.execute('SELECT pathid, data_produced '
+                        'FROM json_each(?) AS request INNER JOIN asset_versions ON asset_versions.pathid == request.value',
+                        (json.dumps(list(asset_version_path_ids)),))
+            return {x['pathid']: DataState(x['data_produced']) for x in cur.fetchall()}
+
+    def get_asset_versions_data_fields(self, asset_version_path_ids: Iterable[str], keys: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        keys = list(keys)
+        if any('"' in key for key in keys):  # such keys cannot be expressed as json path
+            return super().get_asset_versions_data_fields(asset_version_path_ids, keys)
+        # fields are extracted by sqlite, so data json is never fully decoded
+        # json_type is NULL for missing keys, and tells us how to interpret json_extract result
+        with self.__connections.connection() as con:
+            cur = con.cursor()
+            cur.execute('SELECT asset_versions.pathid, field.key AS field_idx, '
+                        'json_type(asset_versions.data, field.value) AS field_type, json_extract(asset_versions.data, field.value) AS field_value '
+                        'FROM json_each(?) AS request INNER JOIN asset_versions ON asset_versions.pathid == request.value '
+                        'LEFT JOIN json_each(?) AS field ON asset_versions.data IS NOT NULL',
+                        (json.dumps(list(asset_version_path_ids)),
+                         json.dumps([f'$."{key}"' for key in keys])))
+            rows = cur.fetchall()
+        result = {}
+        for row in rows:
+            fields = result.setdefault(row['pathid'], {})
+            field_type = row['field_type']
+            if field_type is None:  # no data, or no such key
+                continue
+            key = keys[row['field_idx']]
+            if field_type in ('object', 'array'):
+                fields[key] = timed_json_loads(row['field_value'])
+            elif field_type in ('true', 'false'):
+                fields[key] = field_type == 'true'
+            else:
+                fields[key] = row['field_value']
+        return result
+
+    @staticmethod
+    def __prefix_range(prefix: str) -> Tuple[str, str]:
+        """
+        [start, end) range of strings starting with non-empty prefix.
+        range instead of LIKE/substr to stay sargable
+        """
+        return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
 
-            assdata = AssetVersionData(path_id=data['pathid'],
-                                       asset_path_id=data['asset_pathid'],
-                                       version_id=(data['version_0'], data['version_1'], data['version_2']),
-                                       data_producer_task_attrs=GenerationTaskParameters.deserialize(data['data_task_attr']),
-                                       data_availability=DataState(data['data_produced']),
-                                       data_calculator_id=data['data_calculator_id'],
-                                       data=json.loads(data['data']) if data['data'] is not None else None)
-            ret.append(assdata)
-        return ret
+    @staticmethod
+    def __keyset_page_query(select: str, conditions: List[str], args: List[Any],
+                            after_path_id: Optional[str], limit: Optional[int]) -> Tuple[str, List[Any]]:
+        """
+        query and its args for one page of select's rows with given conditions, in pathid order, starting after after_path_id
+        """
+        conditions = list(conditions)
+        args = list(args)
+        if after_path_id is not None:
+            conditions.append('pathid > ?')
+            args.append(after_path_id)
+        query = select
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY pathid'
+        if limit is not None:
+            query += ' LIMIT ?'
+            args.append(limit)
+        return query, args
+
+    def get_leaf_asset_version_pathids(self, *,
+                                       asset_type_name: Optional[str] = None,
+                                       asset_path_id_prefix: Optional[str] = None,
+                                       after_path_id: Optional[str] = None,
+                                       limit: Optional[int] = None) -> List[str]:
+        # leaf set is maintained on every dependency change, so this never looks at versions or edges
+        conditions = []
+        args = []
+        if asset_type_name is not None:
+            conditions.append('type_name == ?')
+            args.append(asset_type_name)
+        if asset_path_id_prefix:
+            conditions.append('asset_pathid >= ? AND asset_pathid < ?')
+            args += self.__prefix_range(asset_path_id_prefix)
+        query, args = self.__keyset_page_query('SELECT pathid FROM asset_version_leaves', conditions, args, after_path_id, limit)
+
+        with self.__connections.connection() as con:
+            cur = con.cursor()
+            cur.execute(query, args)
+            return [x['pathid'] for x in cur.fetchall()]
 
-    def get_leaf_asset_version_pathids(self) -> List[str]:
-        with sqlite3.connect(self.__db_path) as con:
-            con.row_factory = sqlite3.Row
+    # catalogue listing
+
+    def get_asset_datas_page(self, *,
+                             type_name: Optional[str] = None,
+                             prefix: Optional[str] = None,
+                             after_path_id: Optional[str] = None,
+                             limit: Optional[int] = None) -> List[AssetData]:
+        conditions = []
+        args = []
+        if type_name is not None:
+            conditions.append('type_name == ?')
+            args.append(type_name)
+        if prefix:
+            conditions.append('pathid >= ? AND pathid < ?')
+            args += self.__prefix_range(prefix)
+        query, args = self.__keyset_page_query('SELECT pathid, name, description, type_name FROM assets', conditions, args, after_path_id, limit)
+
+        with self.__connections.connection() as con:
             cur = con.cursor()
-            cur.execute('SELECT "pathid" FROM asset_versions WHERE (NOT EXISTS(SELECT "pathid" FROM asset_version_dependencies '
-                        'WHERE asset_version_dependencies.depends_on == asset_versions.pathid))')
+            cur.execute(query, args)
+            return [AssetData(path_id=x['pathid'], name=x['name'], description=x['description'], type_name=x['type_name']) for x in cur.fetchall()]
+
+    def get_asset_version_datas_page(self, *,
+                                     asset_path_id: Optional[str] = None,
+                                     state: Optional[DataState] = None,
+                                     after_path_id: Optional[str] = None,
+                                     limit: Optional[int] = None) -> List[AssetVersionData]:
+        # walks primary key from after_path_id, other conditions just filter the walk
+        conditions = []
+        args = []
+        if asset_path_id is not None:
+            conditions.append('asset_pathid == ?')
+            args.append(asset_path_id)
+        if state is not None:
+            conditions.append('data_produced == ?')
+            args.append(state.value)
+        query, args = self.__keyset_page_query(f'SELECT {_asset_version_columns} FROM asset_versions', conditions, args, after_path_id, limit)
+
+        with self.__connections.connection() as con:
+            cur = con.cursor()
+            cur.execute(query, args)
+            return [self._asset_version_data_from_row(x) for x in cur.fetchall()]
 
-            return [x['pathid'] for x in cur.fetchall()]
+    @contextmanager
+    def transaction(self, wait: bool = True) -> Iterator[None]:
+        with self.__connections.transaction(wait=wait):
+            yield
 
     def publish_new_asset_version(self, asset_path_id: str, version_data: AssetVersionData, dependencies: Iterable[str]):
         """
@@ -112,71 +381,87 @@ class SqliteDataManagerWithLifeblood(DataAccessInterface, TaskSchedulingResultRe
         if version_id is None - next available version_id will be assigned automatically
 
         """
-        with sqlite3.connect(self.__db_path) as con:
+        with self.__connections.transaction() as con:
+            return self.__publish_new_asset_version(con.cursor(), asset_path_id, version_data, dependencies)
+
+    def publish_new_asset_versions(self, batch: Iterable[Tuple[str, AssetVersionData, Iterable[str]]]) -> List[AssetVersionData]:
+        """
+        publish whole batch in a single transaction, either all versions are published, or none
+        """
+        with self.__connections.transaction() as con:
             cur = con.cursor()
-            cur.execute('SELECT pathid FROM assets WHERE pathid == ?', (asset_path_id,))
-            if cur.fetchone() is None:
-                raise RuntimeError('bad asset_path_id')
-            cur.execute('BEGIN IMMEDIATE')
-
-            if version_data.version_id is None:
-                cur.execute('SELECT version_0, version_1, version_2 FROM asset_versions WHERE asset_pathid == ? '
-                            'ORDER BY version_0 DESC, version_1 DESC, version_2 DESC LIMIT 1', (asset_path_id,))
-                ver = list(cur.fetchone() or [0, -1, -1])
-                bump_idx = max(0, ver.index(-1)-1) if -1 in ver else 2
-                ver[bump_idx] += 1
-                version_data.version_id = tuple(ver)
-            else:  # otherwise ensure version_id is legal
-                cur.execute('SELECT pathid FROM asset_versions WHERE version_0 == ? AND version_1 == ? AND version_2 == ?', version_data.version_id)
-                if cur.fetchone() is not None:
-                    con.rollback()
-                    raise RuntimeError(f'version_id "{version_data.version_id}" is already published')
-
-            version_string = '.'.join(str(x) for x in version_data.version_id if x != -1)
-            pathid = version_data.path_id or f'{asset_path_id}/{version_string}'
-            cur.execute('INSERT INTO asset_versions ("pathid", "asset_pathid", version_0, version_1, version_2, "data_task_attr") '
-                        'VALUES (?, ?, ?,?,?, ?)',
-                        (pathid,
-                         asset_path_id,
-                         *version_data.version_id,
-                         version_data.data_producer_task_attrs.serialize()))
-
-            if dependencies:
-                cur.executemany('INSERT OR IGNORE INTO asset_version_dependencies (dependant, depends_on) VALUES (?, ?)',
-                                ((pathid, dep) for dep in dependencies))
-
-            # update version_data fields
-            version_data.path_id = pathid
-            version_data.asset_path_id = asset_path_id
-            version_data.data_availability = DataState.NOT_COMPUTED
-            version_data.data_calculator_id = None
-            version_data.data = None
-            con.commit()
+            return [self.__publish_new_asset_version(cur, asset_path_id, version_data, dependencies)
+                    for asset_path_id, version_data, dependencies in batch]
+
+    def __publish_new_asset_version(self, cur: sqlite3.Cursor, asset_path_id: str, version_data: AssetVersionData, dependencies: Iterable[str]) -> AssetVersionData:
+        cur.execute('SELECT pathid FROM assets WHERE pathid == ?', (asset_path_id,))
+        if cur.fetchone() is None:
+            raise RuntimeError('bad asset_path_id')
+
+        if version_data.version_id is None:
+            # next version is a bump of the latest one
+            cur.execute('SELECT version_0, version_1, version_2 FROM asset_latest_versions WHERE asset_pathid == ?', (asset_path_id,))
+            ver = list(cur.fetchone() or [0, -1, -1])
+            bump_idx = max(0, ver.index(-1)-1) if -1 in ver else 2
+            ver[bump_idx] += 1
+            version_data.version_id = tuple(ver)
+        else:  # otherwise ensure version_id is legal
+            cur.execute('SELECT pathid FROM asset_versions WHERE asset_pathid == ? AND version_0 == ? AND version_1 == ? AND version_2 == ?',
+                        (asset_path_id, *version_data.version_id))
+            if cur.fetchone() is not None:
+                raise RuntimeError(f'version_id "{version_data.version_id}" is already published')
+
+        version_string = '.'.join(str(x) for x in version_data.version_id if x != -1)
+        pathid = version_data.path_id or f'{asset_path_id}/{version_string}'
+        cur.execute('INSERT INTO asset_versions ("pathid", "asset_pathid", version_0, version_1, version_2, "data_task_attr") '
+                    'VALUES (?, ?, ?,?,?, ?)',
+                    (pathid,
+                     asset_path_id,
+                     *version_data.version_id,
+                     version_data.data_producer_task_attrs.serialize()))
+        cur.execute('INSERT INTO asset_latest_versions (asset_pathid, pathid, version_0, version_1, version_2) VALUES (?, ?, ?, ?, ?) '
+                    'ON CONFLICT (asset_pathid) DO UPDATE SET pathid = excluded.pathid, '
+                    'version_0 = excluded.version_0, version_1 = excluded.version_1, version_2 = excluded.version_2 '
+                    'WHERE (excluded.version_0, excluded.version_1, excluded.version_2) > (version_0, version_1, version_2)',
+                    (asset_path_id, pathid, *version_data.version_id))
+        # nothing can depend on a version that was just created
+        cur.execute('INSERT INTO asset_version_leaves (pathid, asset_pathid, type_name) '
+                    'SELECT ?, pathid, type_name FROM assets WHERE pathid == ?', (pathid, asset_path_id))
+
+        self.__log_change(cur, ChangeType.VERSION_PUBLISHED, pathid, asset_path_id)
+
+        if dependencies:
+            self.__insert_dependency_edges(cur, pathid, dependencies)
+
+        # update version_data fields
+        version_data.path_id = pathid
+        version_data.asset_path_id = asset_path_id
+        version_data.data_availability = DataState.NOT_COMPUTED
+        version_data.data_calculator_id = None
+        version_data.data = None
         return version_data
 
     def create_new_asset(self, asset_type: str, asset_data: AssetData) -> AssetData:
         pathid = asset_data.path_id or re.sub(r'\W', '_', asset_data.name)
-        with sqlite3.connect(self.__db_path) as con:
+        with self.__connections.transaction() as con:
             cur = con.cursor()
             cur.execute('INSERT INTO assets ("pathid", "name", "description", "type_name") VALUES (?, ?, ?, ?)',
                         (pathid,
                          asset_data.name,
                          asset_data.description,
                          asset_type))
+            self.__log_change(cur, ChangeType.ASSET_CREATED, pathid)
             asset_data.path_id = pathid
-            con.commit()
+            asset_data.type_name = asset_type
         return asset_data
 
     def schedule_data_computation_for_asset_version(self, path_id) -> FutureResult:
-        with sqlite3.connect(self.__db_path) as con:
-            con.row_factory = sqlite3.Row
-            con.execute('BEGIN IMMEDIATE')  # we start transaction here already to ensure consistency
+        with self.__connections.transaction() as con:  # we start transaction here already to ensure consistency
             cur = con.cursor()
             cur.execute('SELECT asset_pathid, data_produced, data_task_attr, data_calculator_id, version_0, version_1, version_2 '
                         'FROM asset_versions WHERE pathid == ?', (path_id,))
             data = cur.fetchone()
             if data is None:
-                con.rollback()
                 raise ValueError('path id "{}" does not exist'.format(path_id))
             state = DataState(data['data_produced'])
             version_string = '.'.join(str(x) for x in (data[f'version_{i}'] for i in (0, 1, 2)) if x != -1)
@@ -184,7 +469,6 @@ class SqliteDataManagerWithLifeblood(DataAccessInterface, TaskSchedulingResultRe
             if state == DataState.IS_COMPUTING:
                 fut = self.get_task_scheduler().get_schedule_event_future(data['data_calculator_id'])
                 # fut = LifebloodTaskFuture(self.__lb_addr, data['data_calculator_id'])
-                con.rollback()
                 return fut
 
             # schedule data coputation
@@ -216,70 +500,255 @@ class SqliteDataManagerWithLifeblood(DataAccessInterface, TaskSchedulingResultRe
             cur.execute('UPDATE asset_versions SET data_produced = ?, data_calculator_id = ? WHERE pathid == ?', (DataState.IS_COMPUTING.value,
                                                                                                                   task_id,
                                                                                                                   path_id))
-            con.commit()
+            self.__log_change(cur, ChangeType.VERSION_DATA_STATE_CHANGED, path_id)
             return future
 
     def data_computation_completed_callback(self, path_id: str, data: dict):
         """
         Callback to be called by TaskScheduler when job is done
         """
-        with sqlite3.connect(self.__db_path) as con:
+        with self.__connections.transaction() as con:
+            self.__complete_data_computation(con.cursor(), path_id, json.dumps(data))
+
+    def data_computations_completed_callback(self, completions: Iterable[Tuple[str, dict]]) -> List[Optional[Exception]]:
+        """
+        all completions are applied in a single transaction, except for the failed ones
+        """
+        errors: List[Optional[Exception]] = []
+        with self.__connections.transaction() as con:
+            cur = con.cursor()
+            for path_id, data in completions:
+                # nothing is written before the checks, so a failed completion leaves nothing to roll back
+                try:
+                    self.__complete_data_computation(cur, path_id, json.dumps(data))
+                except (RuntimeError, TypeError, ValueError) as e:
+                    errors.append(e)
+                else:
+                    errors.append(None)
+        return errors
+
+    def __complete_data_computation(self, cur: sqlite3.Cursor, path_id: str, serialized_data: str):
+        cur.execute('SELECT data_produced, data FROM asset_versions WHERE pathid == ?', (path_id,))
+        check_data = cur.fetchone()
+        if check_data is not None and check_data[0] == DataState.AVAILABLE.value and check_data[1] == serialized_data:
+            # same completion delivered again, for example retried by a caller that did not see the first one succeed
+            return
+        if check_data is None or check_data[0] != DataState.IS_COMPUTING.value:
+            raise RuntimeError('data computation was not started, inconsistency!')
+        cur.execute('UPDATE asset_versions SET data_produced = ?, data_calculator_id = ?, data = ? '
+                    'WHERE pathid == ?', (DataState.AVAILABLE.value,
+                                          -1,
+                                          serialized_data,
+                                          path_id)
+                    )
+        self.__log_change(cur, ChangeType.VERSION_DATA_STATE_CHANGED, path_id)
+
+    # change feed
+    # every write appends to change_log in the same transaction, so seq order is commit order.
+    # AUTOINCREMENT ensures seq numbers are never reused, even after log is trimmed
+
+    @staticmethod
+    def __log_change(cur: sqlite3.Cursor, change_type: ChangeType, path_id: str, other_path_id: Optional[str] = None):
+        cur.execute('INSERT INTO change_log (change_type, path_id, other_path_id) VALUES (?, ?, ?)',
+                    (change_type.value, path_id, other_path_id))
+
+    def get_changes_since(self, seq: int, limit: Optional[int] = None) -> List[ChangeRecord]:
+        with self.__connections.connection() as con:
             cur = con.cursor()
-            cur.execute('BEGIN IMMEDIATE')
-            cur.execute('SELECT data_produced FROM asset_versions WHERE pathid == ?', (path_id,))
-            check_data = cur.fetchone()
-            if check_data is None or check_data[0] != DataState.IS_COMPUTING.value:
-                con.rollback()
-                raise RuntimeError('data computation was not started, inconsistency!')
-            cur.execute('UPDATE asset_versions SET data_produced = ?, data_calculator_id = ?, data = ? '
-                        'WHERE pathid == ?', (DataState.AVAILABLE.value,
-                                              -1,
-                                              json.dumps(data),
-                                              path_id)
-                        )
-            con.commit()
+            cur.execute('SELECT value FROM pipeline_meta WHERE key == ?', (_meta_change_log_trimmed_up_to,))
+            trimmed_up_to = cur.fetchone()
+            if trimmed_up_to is not None and seq < int(trimmed_up_to['value']):
+                raise ChangeLogTrimmedError(f'changes after {seq} up to {trimmed_up_to["value"]} were trimmed from change log')
+            cur.execute('SELECT seq, change_type, path_id, other_path_id FROM change_log WHERE seq > ? ORDER BY seq LIMIT ?',
+                        (seq, -1 if limit is None else limit))
+            return [ChangeRecord(row['seq'], ChangeType(row['change_type']), row['path_id'], row['other_path_id']) for row in cur.fetchall()]
+
+    def get_last_change_seq(self) -> int:
+        with self.__connections.connection() as con:
+            cur = con.cursor()
+            # sqlite_sequence only exists once anything was ever inserted into an AUTOINCREMENT table
+            cur.execute("SELECT count(*) FROM sqlite_master WHERE type == 'table' AND name == 'sqlite_sequence'")
+            if cur.fetchone()[0] == 0:
+                return 0
+            cur.execute("SELECT seq FROM sqlite_sequence WHERE name == 'change_log'")
+            row = cur.fetchone()
+            return 0 if row is None else row['seq']
+
+    def trim_change_log(self, up_to_seq: int):
+        """
+        remove changes with seq up to and including up_to_seq from the log.
+        clients that have not yet seen them will get ChangeLogTrimmedError and will have to re-read everything
+        """
+        with self.__connections.transaction() as con:
+            cur = con.cursor()
+            cur.execute('DELETE FROM change_log WHERE seq <= ?', (up_to_seq,))
+            cur.execute('INSERT INTO pipeline_meta (key, value) VALUES (?, ?) '
+                        'ON CONFLICT (key) DO UPDATE SET value = excluded.value WHERE CAST(excluded.value AS INTEGER) > CAST(value AS INTEGER)',
+                        (_meta_change_log_trimmed_up_to, up_to_seq))
 
     # dependencies
     def get_version_dependencies(self, version_path_id: str) -> Iterable[str]:
-        with sqlite3.connect(self.__db_path) as con:
+        with self.__connections.connection() as con:
             cur = con.cursor()
             cur.execute('SELECT depends_on FROM asset_version_dependencies WHERE dependant == ?', (version_path_id,))
             return [x[0] for x in cur.fetchall()]
 
     def get_dependent_versions(self, version_path_id: str) -> Iterable[str]:
-        with sqlite3.connect(self.__db_path) as con:
+        with self.__connections.connection() as con:
             cur = con.cursor()
             cur.execute('SELECT dependant FROM asset_version_dependencies WHERE depends_on == ?', (version_path_id,))
             return [x[0] for x in cur.fetchall()]
 
+    def get_transitive_dependencies(self, version_path_ids: Iterable[str], max_depth: Optional[int] = None) -> List[DependencyEdge]:
+        return self.__walk_dependency_edges(version_path_ids, max_depth, downstream=False)
+
+    def get_transitive_dependants(self, version_path_ids: Iterable[str], max_depth: Optional[int] = None) -> List[DependencyEdge]:
+        return self.__walk_dependency_edges(version_path_ids, max_depth, downstream=True)
+
+    def __walk_dependency_edges(self, version_path_ids: Iterable[str], max_depth: Optional[int], downstream: bool) -> List[DependencyEdge]:
+        # walk the whole graph in one statement.
+        # same edge may be reached by paths of different length, we report the shortest one.
+        # depth limit also guarantees termination in case graph got a cycle somehow
+        start, walk_from = ('depends_on', 'dependant') if downstream else ('dependant', 'depends_on')
+        with self.__connections.connection() as con:
+            cur = con.cursor()
+            cur.execute(f'WITH RECURSIVE walk(dependant, depends_on, depth) AS ('
+                        f'  SELECT dependant, depends_on, 1 FROM asset_version_dependencies '
+                        f'  WHERE {start} IN (SELECT value FROM json_each(?)) '
+                        f'  UNION '
+                        f'  SELECT dep.dependant, dep.depends_on, walk.depth + 1 '
+                        f'  FROM walk INNER JOIN asset_version_dependencies AS dep ON dep.{start} == walk.{walk_from} '
+                        f'  WHERE walk.depth < ?'
+                        f') '
+                        f'SELECT dependant, depends_on, min(depth) AS depth FROM walk GROUP BY dependant, depends_on ORDER BY depth',
+                        (json.dumps(list(version_path_ids)),
+                         max_depth if max_depth is not None else _max_dependency_walk_depth))
+            return [DependencyEdge(x['dependant'], x['depends_on'], x['depth']) for x in cur.fetchall()]
+
     def add_dependencies(self, version_path_id: str, dependency_path_ids: Iterable[str]):
         if not dependency_path_ids:
             return
-        with sqlite3.connect(self.__db_path) as con:
-            cur = con.cursor()
-            cur.executemany('INSERT OR IGNORE INTO asset_version_dependencies (dependant, depends_on) VALUES (?, ?)',
-                            ((version_path_id, dep) for dep in dependency_path_ids))
-            con.commit()
+        with self.__connections.transaction() as con:
+            self.__insert_dependency_edges(con.cursor(), version_path_id, dependency_path_ids)
 
     def remove_dependencies(self, version_path_id: str, dependency_path_ids: Iterable[str]):
         if not dependency_path_ids:
             return
-        with sqlite3.connect(self.__db_path) as con:
+        with self.__connections.transaction() as con:
+            self.__delete_dependency_edges(con.cursor(), version_path_id, dependency_path_ids)
+
+    def __insert_dependency_edges(self, cur: sqlite3.Cursor, version_path_id: str, dependency_path_ids: Iterable[str]):
+        dependency_path_ids = list(dependency_path_ids)
+        maintain_closure = self.__maintain_closure and self.__is_closure_valid(cur)
+        for dep in dependency_path_ids:
+            if maintain_closure and (dep == version_path_id or self.__closure_reaches(cur, dep, version_path_id)):
+                raise DependencyCycleError(f'"{version_path_id}" cannot depend on "{dep}": "{dep}" already depends on it')
+            cur.execute('INSERT OR IGNORE INTO asset_version_dependencies (dependant, depends_on) VALUES (?, ?)',
+                        (version_path_id, dep))
+            if cur.rowcount == 0:  # edge already existed, nothing changed
+                continue
+            self.__log_change(cur, ChangeType.DEPENDENCY_ADDED, version_path_id, dep)
+            if maintain_closure:
+                self.__closure_update_for_edge(cur, version_path_id, dep, 1)
+        if not maintain_closure:
+            self.__invalidate_closure(cur)
+        cur.executemany('DELETE FROM asset_version_leaves WHERE pathid == ?', ((dep,) for dep in dependency_path_ids))
+
+    def __delete_dependency_edges(self, cur: sqlite3.Cursor, version_path_id: str, dependency_path_ids: Iterable[str]):
+        dependency_path_ids = list(dependency_path_ids)
+        maintain_closure = self.__maintain_closure and self.__is_closure_valid(cur)
+        for dep in dependency_path_ids:
+            cur.execute('DELETE FROM asset_version_dependencies WHERE dependant == ? AND depends_on == ?',
+                        (version_path_id, dep))
+            if cur.rowcount == 0:
+                continue
+            self.__log_change(cur, ChangeType.DEPENDENCY_REMOVED, version_path_id, dep)
+            if maintain_closure:
+                self.__closure_update_for_edge(cur, version_path_id, dep, -1)
+        if not maintain_closure:
+            self.__invalidate_closure(cur)
+        # versions that lost their last dependant become leaves again
+        cur.executemany('INSERT OR IGNORE INTO asset_version_leaves (pathid, asset_pathid, type_name) '
+                        'SELECT asset_versions.pathid, asset_versions.asset_pathid, assets.type_name '
+                        'FROM asset_versions INNER JOIN assets ON assets.pathid == asset_versions.asset_pathid '
+                        'WHERE asset_versions.pathid == ?1 '
+                        'AND NOT EXISTS(SELECT dependant FROM asset_version_dependencies WHERE depends_on == ?1)',
+                        ((dep,) for dep in dependency_path_ids))
+
+    # dependency closure
+    # closure holds a row for every pair of versions where dependant (transitively) depends on depends_on,
+    # together with the number of distinct dependency paths between them.
+    # path counts is what allows to maintain closure incrementally on edge removal too.
+    # (dependency graph is a DAG, so paths through edge x->y are just (paths into x) * (paths out of y))
+
+    @staticmethod
+    def __is_closure_valid(cur: sqlite3.Cursor) -> bool:
+        cur.execute('SELECT value FROM main.pipeline_meta WHERE key == ?', (_meta_closure_valid,))
+        return cur.fetchone() is not None
+
+    @staticmethod
+    def __invalidate_closure(cur: sqlite3.Cursor):
+        cur.execute('DELETE FROM pipeline_meta WHERE key == ?', (_meta_closure_valid,))
+
+    @staticmethod
+    def __closure_reaches(cur: sqlite3.Cursor, version_path_id: str, dependency_path_id: str) -> bool:
+        cur.execute('SELECT 1 FROM asset_version_closure WHERE dependant == ? AND depends_on == ?', (version_path_id, dependency_path_id))
+        return cur.fetchone() is not None
+
+    @staticmethod
+    def __closure_update_for_edge(cur: sqlite3.Cursor, version_path_id: str, dependency_path_id: str, sign: int):
+        cur.execute('INSERT INTO asset_version_closure (dependant, depends_on, path_count) '
+                    'SELECT down.node, up.node, ? * down.cnt * up.cnt FROM '
+                    '(SELECT ? AS node, 1 AS cnt UNION ALL SELECT dependant, path_count FROM asset_version_closure WHERE depends_on == ?) AS down, '
+                    '(SELECT ? AS node, 1 AS cnt UNION ALL SELECT depends_on, path_count FROM asset_version_closure WHERE dependant == ?) AS up '
+                    'WHERE true '  # this is required to disambiguate ON CONFLICT when inserting from SELECT
+                    'ON CONFLICT (dependant, depends_on) DO UPDATE SET path_count = path_count + excluded.path_count',
+                    (sign, version_path_id, version_path_id, dependency_path_id, dependency_path_id))
+        if sign < 0:
+            cur.execute('DELETE FROM asset_version_closure WHERE path_count <= 0')
+
+    def __rebuild_closure(self, cur: sqlite3.Cursor):
+        cur.execute('DELETE FROM asset_version_closure')
+        cur.execute('SELECT dependant, depends_on FROM asset_version_dependencies')
+        for dependant, depends_on in cur.fetchall():
+            if dependant == depends_on or self.__closure_reaches(cur, depends_on, dependant):
+                raise DependencyCycleError(f'dependency "{dependant}" -> "{depends_on}" forms a cycle')
+            self.__closure_update_for_edge(cur, dependant, depends_on, 1)
+        cur.execute('INSERT OR REPLACE INTO pipeline_meta (key, value) VALUES (?, 1)', (_meta_closure_valid,))
+
+    def rebuild_dependency_closure(self):
+        """
+        rebuild dependency closure from scratch, making it valid again
+        """
+        with self.__connections.transaction() as con:
+            self.__rebuild_closure(con.cursor())
+
+    def version_depends_on(self, version_path_id: str, dependency_path_id: str) -> bool:
+        with self.__connections.connection() as con:
             cur = con.cursor()
-            cur.executemany('DELETE FROM asset_version_dependencies WHERE dependant == ? AND depends_on == ?',
-                            ((version_path_id, dep) for dep in dependency_path_ids))
-            con.commit()
+            if self.__maintain_closure and self.__is_closure_valid(cur):
+                return self.__closure_reaches(cur, version_path_id, dependency_path_id)
+        return super().version_depends_on(version_path_id, dependency_path_id)
+
+    def get_impacted_versions(self, version_path_ids: Iterable[str]) -> List[str]:
+        version_path_ids = list(version_path_ids)
+        with self.__connections.connection() as con:
+            cur = con.cursor()
+            if self.__maintain_closure and self.__is_closure_valid(cur):
+                cur.execute('SELECT DISTINCT dependant FROM asset_version_closure WHERE depends_on IN (SELECT value FROM json_each(?))',
+                            (json.dumps(version_path_ids),))
+                return [x['dependant'] for x in cur.fetchall()]
+        return super().get_impacted_versions(version_path_ids)
 
     # templates
     def get_asset_template_datas_for_asset_path_id(self, asset_path_ids: Iterable[str]) -> List[AssetTemplateData]:
-        with sqlite3.connect(self.__db_path) as con:
-            con.row_factory = sqlite3.Row
+        request = json.dumps(list(asset_path_ids))
+        with self.__connections.connection() as con:
             cur = con.cursor()
-            datas = []
-            for asset_path_id in asset_path_ids:  # not optimal
-                cur.execute('SELECT asset_path_id, data_task_attr FROM asset_templates WHERE asset_path_id == ?',
-                            (asset_path_id,))
-                datas.extend(cur.fetchall())
+            cur.execute('SELECT asset_templates.asset_path_id, data_task_attr '
+                        'FROM json_each(?) AS request INNER JOIN asset_templates ON asset_templates.asset_path_id == request.value '
+                        'ORDER BY request.key', (request,))
+            datas = cur.fetchall()
 
         assdatas = []
         for data in datas:
@@ -291,33 +760,45 @@ class SqliteDataManagerWithLifeblood(DataAccessInterface, TaskSchedulingResultRe
     def create_asset_template(self, asset_template_data: AssetTemplateData,
                                     trigger_asset_path_ids: Iterable[str],
                                     asset_version_dependencies: Iterable[str]) -> AssetTemplateData:
-        with sqlite3.connect(self.__db_path) as con:
-            con.row_factory = sqlite3.Row
-            con.execute('PRAGMA foreign_keys = ON')  # that fucker is OFF by default, remember that!
+        with self.__connections.transaction() as con:
             cur = con.cursor()
             cur.execute('INSERT OR REPLACE INTO asset_templates (asset_path_id, data_task_attr) VALUES (?, ?)',
                         (asset_template_data.asset_path_id,
                          asset_template_data.data_producer_task_attrs.serialize()))
+            self.__log_change(cur, ChangeType.TEMPLATE_CHANGED, asset_template_data.asset_path_id)
+            # replaced template gets new inputs. foreign key cascade would do that, but it may be turned off
+            cur.execute('DELETE FROM asset_template_version_inputs WHERE asset_path_id == ?', (asset_template_data.asset_path_id,))
+            cur.execute('DELETE FROM asset_template_trigger_inputs WHERE asset_path_id == ?', (asset_template_data.asset_path_id,))
             cur.executemany('INSERT INTO asset_template_version_inputs (asset_path_id, depends_on) VALUES (?, ?)',
                             ((asset_template_data.asset_path_id, x) for x in asset_version_dependencies))
             cur.executemany('INSERT INTO asset_template_trigger_inputs (asset_path_id, depends_on) VALUES (?, ?)',
                             ((asset_template_data.asset_path_id, x) for x in trigger_asset_path_ids))
-            con.commit()
         return asset_template_data
 
     def update_asset_template_data(self, asset_template_data: AssetTemplateData):
-        with sqlite3.connect(self.__db_path) as con:
-            con.row_factory = sqlite3.Row
-            con.execute('PRAGMA foreign_keys = ON')  # that fucker is OFF by default, remember that!
+        with self.__connections.transaction() as con:
             cur = con.cursor()
             cur.execute('UPDATE asset_templates SET data_task_attr=? WHERE asset_path_id==?',
                         (asset_template_data.data_producer_task_attrs.serialize(),
                          asset_template_data.asset_path_id))
-            con.commit()
+            if cur.rowcount > 0:
+                self.__log_change(cur, ChangeType.TEMPLATE_CHANGED, asset_template_data.asset_path_id)
+
+    def update_asset_template_datas(self, asset_template_datas: Iterable[AssetTemplateData]):
+        asset_template_datas = list(asset_template_datas)
+        with self.__connections.transaction() as con:
+            cur = con.cursor()
+            cur.executemany('UPDATE asset_templates SET data_task_attr=? WHERE asset_path_id==?',
+                            ((x.data_producer_task_attrs.serialize(), x.asset_path_id) for x in asset_template_datas))
+            # only templates that exist were updated
+            cur.execute('INSERT INTO change_log (change_type, path_id) '
+                        'SELECT ?, asset_templates.asset_path_id '
+                        'FROM json_each(?) AS request INNER JOIN asset_templates ON asset_templates.asset_path_id == request.value '
+                        'ORDER BY request.key',
+                        (ChangeType.TEMPLATE_CHANGED.value, json.dumps([x.asset_path_id for x in asset_template_datas])))
 
     def get_asset_templates_triggered_by(self, asset_path_id: str) -> List[AssetTemplateData]:
-        with sqlite3.connect(self.__db_path) as con:
-            con.row_factory = sqlite3.Row
+        with self.__connections.connection() as con:
             cur = con.cursor()
             cur.execute('SELECT asset_templates.asset_path_id, data_task_attr '
                         'FROM asset_templates INNER JOIN asset_template_trigger_inputs '
@@ -331,9 +812,33 @@ class SqliteDataManagerWithLifeblood(DataAccessInterface, TaskSchedulingResultRe
                                               ))
         return assdatas
 
+    def get_asset_templates_downstream_of(self, asset_path_ids: Iterable[str]) -> List[Tuple[str, AssetTemplateData]]:
+        # walk reaches every asset once, UNION drops repeated ones, so diamonds and cycles are fine
+        with self.__connections.connection() as con:
+            cur = con.cursor()
+            cur.execute('WITH RECURSIVE reachable(path_id) AS ('
+                        '  SELECT value FROM json_each(?) '
+                        '  UNION '
+                        '  SELECT asset_template_trigger_inputs.asset_path_id '
+                        '  FROM reachable INNER JOIN asset_template_trigger_inputs ON asset_template_trigger_inputs.depends_on == reachable.path_id'
+                        ') '
+                        'SELECT asset_template_trigger_inputs.depends_on, asset_templates.asset_path_id, asset_templates.data_task_attr '
+                        'FROM reachable INNER JOIN asset_template_trigger_inputs ON asset_template_trigger_inputs.depends_on == reachable.path_id '
+                        'INNER JOIN asset_templates ON asset_templates.asset_path_id == asset_template_trigger_inputs.asset_path_id',
+                        (json.dumps(list(asset_path_ids)),))
+            datas = cur.fetchall()
+        template_datas: Dict[str, AssetTemplateData] = {}
+        edges = []
+        for data in datas:
+            template_data = template_datas.get(data['asset_path_id'])
+            if template_data is None:
+                template_data = template_datas[data['asset_path_id']] = AssetTemplateData(data['asset_path_id'],
+                                                                                          GenerationTaskParameters.deserialize(data['data_task_attr']))
+            edges.append((data['depends_on'], template_data))
+        return edges
+
     def get_template_fixed_dependencies(self, asset_path_id: str) -> Iterable[str]:
-        with sqlite3.connect(self.__db_path) as con:
-            con.row_factory = sqlite3.Row
+        with self.__connections.connection() as con:
             cur = con.cursor()
             cur.execute('SELECT depends_on '
                         'FROM asset_template_version_inputs '
@@ -341,6 +846,19 @@ class SqliteDataManagerWithLifeblood(DataAccessInterface, TaskSchedulingResultRe
             datas = cur.fetchall()
         return [x['depends_on'] for x in datas]
 
+    def get_templates_fixed_dependencies(self, asset_path_ids: Iterable[str]) -> Dict[str, List[str]]:
+        with self.__connections.connection() as con:
+            cur = con.cursor()
+            cur.execute('SELECT asset_template_version_inputs.asset_path_id, depends_on '
+                        'FROM json_each(?) AS request '
+                        'INNER JOIN asset_template_version_inputs ON asset_template_version_inputs.asset_path_id == request.value',
+                        (json.dumps(list(asset_path_ids)),))
+            datas = cur.fetchall()
+        result: Dict[str, List[str]] = {}
+        for data in datas:
+            result.setdefault(data['asset_path_id'], []).append(data['depends_on'])
+        return result
+
     # files location
     def get_pipeline_render_root(self) -> Path:
         return Path(os.environ['PIPELINE_STORAGE_ROOT'])/'render'
@@ -352,6 +870,14 @@ class SqliteDataManagerWithLifeblood(DataAccessInterface, TaskSchedulingResultRe
         return Path(os.environ['PIPELINE_STORAGE_ROOT'])/'source'
 
 
+_schema_version = 2
+_max_dependency_walk_depth = 100000
+_meta_closure_valid = 'dependency_closure_valid'
+_meta_change_log_trimmed_up_to = 'change_log_trimmed_up_to'
+
+_asset_version_columns = '"pathid", "asset_pathid", version_0, version_1, version_2, data_task_attr, data_produced, data_calculator_id, data'
+_asset_version_columns_prefixed = ', '.join(f'asset_versions.{x.strip()}' for x in _asset_version_columns.split(','))
+
 _init_script = \
 '''
 BEGIN TRANSACTION;
@@ -402,9 +928,47 @@ CREATE TABLE IF NOT EXISTS "asset_template_trigger_inputs" (
     FOREIGN KEY("depends_on") REFERENCES "assets"("pathid") ON UPDATE CASCADE ON DELETE RESTRICT,
     UNIQUE("asset_path_id","depends_on")
 );
+CREATE TABLE IF NOT EXISTS "asset_version_closure" (
+    "dependant"    TEXT NOT NULL,
+    "depends_on"   TEXT NOT NULL,
+    "path_count"   INTEGER NOT NULL,
+    PRIMARY KEY("dependant","depends_on")
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS "asset_latest_versions" (
+    "asset_pathid" TEXT NOT NULL,
+    "pathid"       TEXT NOT NULL,
+    "version_0"    INTEGER NOT NULL,
+    "version_1"    INTEGER NOT NULL,
+    "version_2"    INTEGER NOT NULL,
+    FOREIGN KEY("asset_pathid") REFERENCES "assets"("pathid") ON UPDATE CASCADE ON DELETE CASCADE,
+    FOREIGN KEY("pathid") REFERENCES "asset_versions"("pathid") ON UPDATE CASCADE ON DELETE CASCADE,
+    PRIMARY KEY("asset_pathid")
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS "asset_version_leaves" (
+    "pathid"       TEXT NOT NULL,
+    "asset_pathid" TEXT NOT NULL,
+    "type_name"    TEXT,
+    FOREIGN KEY("pathid") REFERENCES "asset_versions"("pathid") ON UPDATE CASCADE ON DELETE CASCADE,
+    PRIMARY KEY("pathid")
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS "change_log" (
+    "seq"           INTEGER PRIMARY KEY AUTOINCREMENT,
+    "change_type"   INTEGER NOT NULL,
+    "path_id"       TEXT NOT NULL,
+    "other_path_id" TEXT
+);
+CREATE TABLE IF NOT EXISTS "pipeline_meta" (
+    "key"    TEXT NOT NULL,
+    "value"  TEXT,
+    PRIMARY KEY("key")
+);
 
-CREATE INDEX IF NOT EXISTS "asset_versions_asset_pathid_idx" ON "asset_versions" (
-    "asset_pathid"
+DROP INDEX IF EXISTS "asset_versions_asset_pathid_idx";  -- superseded by the composite one below
+CREATE INDEX IF NOT EXISTS "asset_versions_asset_pathid_version_idx" ON "asset_versions" (
+    "asset_pathid",
+    "version_0",
+    "version_1",
+    "version_2"
 );
 
 CREATE INDEX IF NOT EXISTS "asset_version_dependencies_dependant" ON "asset_version_dependencies" (
@@ -415,6 +979,24 @@ CREATE INDEX IF NOT EXISTS "asset_version_dependencies_depends_on" ON "asset_ver
     "depends_on"
 );
 
+CREATE INDEX IF NOT EXISTS "asset_version_leaves_type_name" ON "asset_version_leaves" (
+    "type_name",
+    "pathid"
+);
+
+CREATE INDEX IF NOT EXISTS "asset_version_leaves_asset_pathid" ON "asset_version_leaves" (
+    "asset_pathid"
+);
+
+CREATE INDEX IF NOT EXISTS "asset_template_trigger_inputs_depends_on" ON "asset_template_trigger_inputs" (
+    "depends_on",
+    "asset_path_id"
+);
+
+CREATE INDEX IF NOT EXISTS "asset_version_closure_depends_on" ON "asset_version_closure" (
+    "depends_on"
+);
+
 COMMIT;
 PRAGMA journal_mode=wal;
 PRAGMA synchronous=NORMAL;
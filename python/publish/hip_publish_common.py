@@ -17,7 +17,7 @@ def _get_sources_iter(usd_node):
 
 def list_sources(node):
     director = get_director()
-    return [director.get_asset_version(pid) for pid in _get_sources_iter(node.stage().GetPrimAtPath('/'))]
+    return director.get_asset_versions(_get_sources_iter(node.stage().GetPrimAtPath('/')))
 
 
 def _get_locked_versions_iter(usd_node):
@@ -40,8 +40,8 @@ def _get_locked_versions_iter(usd_node):
 
 def get_locked_versions(node):
     director = get_director()
-    return {director.get_asset_version(pathid).asset.path_id: pathid
-            for pathid in _get_locked_versions_iter(node.stage().GetPrimAtPath('/'))}
+    return {asset_version.asset.path_id: asset_version.path_id
+            for asset_version in director.get_asset_versions(_get_locked_versions_iter(node.stage().GetPrimAtPath('/')))}
 
 
 def __old_get_locked_versions(node):
@@ -0,0 +1,496 @@
+import sys
+import asyncio
+import sqlite3
+import argparse
+import tempfile
+import threading
+import traceback
+from pathlib import Path
+from pipeline.async_director import AsyncDirector
+from pipeline.asset_data import AssetData, AssetVersionData, AssetTemplateData, DataState, ChangeType
+from pipeline.cached_data_access import CachedDataAccessInterface
+from pipeline.completion_queue import GroupCommitCompletionQueue, CompletionQueueClosedError
+from pipeline.data_access_interface import DataAccessInterface, NotFoundError, DependencyCycleError, ChangeLogTrimmedError, WriteLockBusyError
+from pipeline.future import CompletedFuture, FutureResult
+from pipeline.generation_task_parameters import GenerationTaskParameters, EnvironmentResolverParameters
+from pipeline.task_scheduling_interface import TaskSchedulingInterface
+from pipeline.version_locks import get_version_lock_context
+from pipeline_impl.asset_version_uri_handler import AssetVersionUriHandler
+from pipeline_impl.memory_data_manager import InMemoryDataManager
+from pipeline_impl.sharded_data_manager import ShardedDataManager
+from pipeline_impl.specialized_assets import CacheAsset
+from pipeline_impl.specialized_director import PipelineDirector
+from pipeline_impl.sqlite_data_manager import SqliteDataManagerWithLifeblood
+
+from typing import Callable, Dict, List, Tuple
+
+
+# shared semantics checks, run against every DataAccessInterface implementation
+# every check gets a fresh empty data accessor
+
+
+class _CountingScheduler(TaskSchedulingInterface):
+    def __init__(self):
+        super().__init__()
+        self.scheduled_count = 0
+
+    def schedule_data_generation_task(self, asset_version_data: AssetVersionData, task_data_generation_data: GenerationTaskParameters) -> (FutureResult, str):
+        self.scheduled_count += 1
+        return CompletedFuture(True), f'task_{self.scheduled_count}'
+
+    def get_schedule_event_future(self, event_id: str) -> FutureResult:
+        return CompletedFuture(True)
+
+
+def _params(**attribs) -> GenerationTaskParameters:
+    return GenerationTaskParameters({}, {'attribs': attribs}, EnvironmentResolverParameters('StandardEnvironmentResolver', {}))
+
+
+def _new_version(data_accessor: DataAccessInterface, asset_path_id: str, version_id=None, dependencies=(), **attribs) -> AssetVersionData:
+    return data_accessor.publish_new_asset_version(asset_path_id, AssetVersionData(None, None, version_id, _params(**attribs), None, None, None), dependencies)
+
+
+def _new_assets(data_accessor: DataAccessInterface, *path_ids: str, asset_type: str = 'cache'):
+    for path_id in path_ids:
+        data_accessor.create_new_asset(asset_type, AssetData(path_id, f'{path_id} name', f'{path_id} description'))
+
+
+def _expect(exception_type, func, *args):
+    try:
+        func(*args)
+    except exception_type:
+        return
+    names = ' or '.join(x.__name__ for x in (exception_type if isinstance(exception_type, tuple) else (exception_type,)))
+    raise AssertionError(f'{func.__name__} did not raise {names}')
+
+
+def check_assets(data_accessor: DataAccessInterface):
+    _new_assets(data_accessor, 'a', 'b')
+    _new_assets(data_accessor, 'c', asset_type='comp')
+    assert data_accessor.create_new_asset('cache', AssetData(None, 'some name!', '')).path_id == 'some_name_'
+    assert sorted(x.path_id for x in data_accessor.get_asset_datas(['c', 'nope', 'a'])) == ['a', 'c']
+    assert data_accessor.get_asset_data('b') == AssetData('b', 'b name', 'b description', 'cache')
+    assert data_accessor.get_asset_type_name('c') == 'comp'
+    _expect(NotFoundError, data_accessor.get_asset_data, 'nope')
+    _expect(NotFoundError, data_accessor.get_asset_type_name, 'nope')
+
+
+def check_versions(data_accessor: DataAccessInterface):
+    _new_assets(data_accessor, 'a', 'b')
+    v1 = _new_version(data_accessor, 'a', foo=1)
+    assert (v1.path_id, v1.asset_path_id, v1.version_id, v1.data_availability) == ('a/1', 'a', (1, -1, -1), DataState.NOT_COMPUTED)
+    assert _new_version(data_accessor, 'a').version_id == (2, -1, -1)
+    assert _new_version(data_accessor, 'a', (2, 1, -1)).path_id == 'a/2.1'
+    assert _new_version(data_accessor, 'a').version_id == (2, 2, -1)
+    assert _new_version(data_accessor, 'a', (1, 5, -1)).path_id == 'a/1.5'
+    assert data_accessor.get_asset_version_data('a', None).path_id == 'a/2.2'  # latest is the biggest, not the last one
+    _expect(RuntimeError, _new_version, data_accessor, 'a', (2, 1, -1))
+    assert _new_version(data_accessor, 'b', (2, 1, -1)).path_id == 'b/2.1'  # same version id in another asset is fine
+    _expect(RuntimeError, _new_version, data_accessor, 'nope')
+
+    datas = data_accessor.get_asset_version_datas([('b', None), ('a', (1, -1, -1)), ('nope', None), ('a', (9, -1, -1))])
+    assert [x.path_id for x in datas] == ['b/2.1', 'a/1']
+    assert datas[1].data_producer_task_attrs.attributes == {'attribs': {'foo': 1}}
+    assert [x.path_id for x in data_accessor.get_asset_version_datas_from_path_id(['a/2', 'nope', 'a/1'])] == ['a/2', 'a/1']
+    _expect(NotFoundError, data_accessor.get_asset_version_data_from_path_id, 'nope')
+    _expect(NotFoundError, data_accessor.get_asset_version_data, 'a', (7, -1, -1))
+
+    # returned objects must not share state with stored ones
+    data_accessor.get_asset_version_data_from_path_id('a/1').data_producer_task_attrs.attributes['attribs']['foo'] = 2
+    assert data_accessor.get_asset_version_data_from_path_id('a/1').data_producer_task_attrs.attributes == {'attribs': {'foo': 1}}
+
+
+def check_batch_publish(data_accessor: DataAccessInterface):
+    _new_assets(data_accessor, 'a', 'b')
+    _new_version(data_accessor, 'a')
+    published = data_accessor.publish_new_asset_versions([
+        ('a', AssetVersionData(None, None, None, _params(), None, None, None), ()),
+        ('b', AssetVersionData(None, None, None, _params(), None, None, None), ('a/2',)),
+    ])
+    assert [x.path_id for x in published] == ['a/2', 'b/1']
+    assert data_accessor.get_version_dependencies('b/1') == ['a/2']
+
+    # failed batch leaves no trace
+    _expect(RuntimeError, data_accessor.publish_new_asset_versions, [
+        ('a', AssetVersionData(None, None, None, _params(), None, None, None), ()),
+        ('a', AssetVersionData(None, None, (1, -1, -1), _params(), None, None, None), ()),
+    ])
+    assert data_accessor.get_asset_version_data('a', None).path_id == 'a/2'
+    assert data_accessor.get_asset_version_datas_from_path_id(['a/3']) == []
+
+    # dependency on a version published earlier in the same batch is fine, on a version that does not exist is not,
+    # even if it belongs to an asset that is published in the same batch
+    _expect((NotFoundError, sqlite3.IntegrityError), data_accessor.publish_new_asset_versions, [
+        ('a', AssetVersionData(None, None, None, _params(), None, None, None), ()),
+        ('a', AssetVersionData(None, None, None, _params(), None, None, None), ('a/999',)),
+    ])
+    assert data_accessor.get_asset_version_datas_from_path_id(['a/3', 'a/4']) == []
+    published = data_accessor.publish_new_asset_versions([
+        ('a', AssetVersionData(None, None, None, _params(), None, None, None), ()),
+        ('a', AssetVersionData(None, None, None, _params(), None, None, None), ('a/3',)),
+    ])
+    assert [x.path_id for x in published] == ['a/3', 'a/4']
+    assert data_accessor.get_version_dependencies('a/4') == ['a/3']
+
+
+def check_transaction(data_accessor: DataAccessInterface):
+    _new_assets(data_accessor, 'a', 'b')
+    with data_accessor.transaction():
+        _new_version(data_accessor, 'a')
+        with data_accessor.transaction():
+            _new_version(data_accessor, 'b', dependencies=['a/1'])
+        # reads inside see writes made so far
+        assert data_accessor.get_asset_version_data('b', None).path_id == 'b/1'
+    assert data_accessor.get_version_dependencies('b/1') == ['a/1']
+
+    # failure anywhere inside rolls back everything, including what nested blocks did
+    def _failing():
+        with data_accessor.transaction():
+            _new_version(data_accessor, 'a')
+            with data_accessor.transaction():
+                _new_version(data_accessor, 'b')
+            assert data_accessor.get_asset_version_data('a', None).path_id == 'a/2'
+            raise RuntimeError('rollback')
+    _expect(RuntimeError, _failing)
+    assert data_accessor.get_asset_version_data('a', None).path_id == 'a/1'
+    assert data_accessor.get_asset_version_data('b', None).path_id == 'b/1'
+
+
+def check_transaction_without_waiting(data_accessor: DataAccessInterface):
+    _new_assets(data_accessor, 'a')
+    written, release = threading.Event(), threading.Event()
+
+    def _hold():
+        with data_accessor.transaction():
+            _new_version(data_accessor, 'a')
+            written.set()
+            release.wait(10)
+
+    def _write_without_waiting():
+        with data_accessor.transaction(wait=False):
+            _new_version(data_accessor, 'a')
+
+    holder = threading.Thread(target=_hold)
+    holder.start()
+    try:
+        assert written.wait(10)
+        _expect(WriteLockBusyError, _write_without_waiting)
+    finally:
+        release.set()
+        holder.join()
+    _write_without_waiting()  # nobody is writing now
+    assert [x.path_id for x in data_accessor.get_asset_version_datas_page(asset_path_id='a')] == ['a/1', 'a/2']
+
+
+def check_dependencies(data_accessor: DataAccessInterface):
+    _new_assets(data_accessor, 'a', 'b')
+    _new_assets(data_accessor, 'c', asset_type='comp')
+    a1 = _new_version(data_accessor, 'a')
+    b1 = _new_version(data_accessor, 'b', dependencies=[a1.path_id])
+    c1 = _new_version(data_accessor, 'c', dependencies=[a1.path_id, b1.path_id])
+    a2 = _new_version(data_accessor, 'a')
+    assert sorted(data_accessor.get_version_dependencies('c/1')) == ['a/1', 'b/1']
+    assert sorted(data_accessor.get_dependent_versions('a/1')) == ['b/1', 'c/1']
+    assert list(data_accessor.get_version_dependencies('nope')) == []
+
+    edges = data_accessor.get_transitive_dependencies(['c/1'])
+    assert sorted((x.dependant, x.depends_on, x.depth) for x in edges) == [('b/1', 'a/1', 2), ('c/1', 'a/1', 1), ('c/1', 'b/1', 1)]
+    assert sorted((x.dependant, x.depends_on) for x in data_accessor.get_transitive_dependencies(['c/1'], 1)) == [('c/1', 'a/1'), ('c/1', 'b/1')]
+    assert sorted((x.dependant, x.depends_on, x.depth) for x in data_accessor.get_transitive_dependants(['a/1'])) == [('b/1', 'a/1', 1), ('c/1', 'a/1', 1), ('c/1', 'b/1', 2)]
+    assert data_accessor.version_depends_on('c/1', 'a/1')
+    assert not data_accessor.version_depends_on('a/1', 'c/1')
+    assert sorted(data_accessor.get_impacted_versions(['a/1'])) == ['b/1', 'c/1']
+
+    assert data_accessor.get_leaf_asset_version_pathids() == ['a/2', 'c/1']
+    assert data_accessor.get_leaf_asset_version_pathids(asset_type_name='cache') == ['a/2']
+    assert data_accessor.get_leaf_asset_version_pathids(asset_path_id_prefix='c') == ['c/1']
+    assert data_accessor.get_leaf_asset_version_pathids(limit=1) == ['a/2']
+    assert data_accessor.get_leaf_asset_version_pathids(after_path_id='a/2') == ['c/1']
+
+    _expect(DependencyCycleError, data_accessor.add_dependencies, a1.path_id, [c1.path_id])
+    _expect(DependencyCycleError, data_accessor.add_dependencies, a1.path_id, [a1.path_id])
+    data_accessor.add_dependencies(c1.path_id, [a2.path_id, a1.path_id])  # existing edges are ignored
+    assert sorted(data_accessor.get_version_dependencies('c/1')) == ['a/1', 'a/2', 'b/1']
+    assert data_accessor.get_leaf_asset_version_pathids() == ['c/1']
+    data_accessor.remove_dependencies(c1.path_id, [a2.path_id, 'a/1', 'nope'])  # missing edges are ignored
+    assert sorted(data_accessor.get_version_dependencies('c/1')) == ['b/1']
+    assert data_accessor.get_leaf_asset_version_pathids() == ['a/2', 'c/1']
+
+
+def check_data_computation(data_accessor: DataAccessInterface):
+    scheduler: _CountingScheduler = data_accessor.get_task_scheduler()
+    _new_assets(data_accessor, 'a')
+    v = _new_version(data_accessor, 'a')
+    _expect(RuntimeError, data_accessor.data_computation_completed_callback, v.path_id, {})
+    data_accessor.schedule_data_computation_for_asset_version(v.path_id)
+    assert data_accessor.get_data_availability(v.path_id) == DataState.IS_COMPUTING
+    data_accessor.schedule_data_computation_for_asset_version(v.path_id)
+    assert scheduler.scheduled_count == 1  # already computing is not rescheduled
+    _expect(ValueError, data_accessor.schedule_data_computation_for_asset_version, 'nope')
+
+    data_accessor.data_computation_completed_callback(v.path_id, {'path': '/some/$F.bgeo', 'range': [1, 10], 'flag': True, 'nested': {'x': 1}})
+    v = data_accessor.get_asset_version_data_from_path_id(v.path_id)
+    assert v.data_availability == DataState.AVAILABLE
+    assert v.data == {'path': '/some/$F.bgeo', 'range': [1, 10], 'flag': True, 'nested': {'x': 1}}
+    # same completion delivered again is a no-op, a different one is still an inconsistency
+    data_accessor.data_computation_completed_callback(v.path_id, {'path': '/some/$F.bgeo', 'range': [1, 10], 'flag': True, 'nested': {'x': 1}})
+    _expect(RuntimeError, data_accessor.data_computation_completed_callback, v.path_id, {'path': '/other'})
+    assert data_accessor.get_data_availabilities([v.path_id, 'nope']) == {v.path_id: DataState.AVAILABLE}
+    assert data_accessor.get_asset_versions_data_fields([v.path_id, 'nope'], ['range', 'flag', 'nested', 'missing']) == \
+           {v.path_id: {'range': [1, 10], 'flag': True, 'nested': {'x': 1}}}
+    assert data_accessor.get_asset_version_data_fields('a/1', ['path']) == {'path': '/some/$F.bgeo'}
+
+
+def check_batched_completion(data_accessor: DataAccessInterface):
+    _new_assets(data_accessor, 'a', 'b', 'c')
+    versions = [_new_version(data_accessor, name) for name in ('a', 'b', 'c', 'a')]
+    for v in versions[:3]:
+        data_accessor.schedule_data_computation_for_asset_version(v.path_id)
+    # one not started and one unknown completion must not prevent the others from being applied
+    errors = data_accessor.data_computations_completed_callback([(v.path_id, {'i': i}) for i, v in enumerate(versions)] + [('nope/1', {})])
+    assert [type(e) for e in errors] == [type(None)] * 3 + [RuntimeError, RuntimeError]
+    assert data_accessor.get_data_availabilities([v.path_id for v in versions]) == \
+           {**{v.path_id: DataState.AVAILABLE for v in versions[:3]}, versions[3].path_id: DataState.NOT_COMPUTED}
+    assert data_accessor.get_asset_version_data_fields(versions[2].path_id, ['i']) == {'i': 2}
+
+    data_accessor.schedule_data_computation_for_asset_version(versions[3].path_id)
+    with GroupCommitCompletionQueue(data_accessor, window=0.01, max_batch=2) as queue:
+        futures = [queue.submit(versions[3].path_id, {'i': 3}), queue.submit(versions[0].path_id, {})]
+        queue.flush()
+        assert all(f.is_result_ready() for f in futures)
+        futures[0].wait_for_result()
+        _expect(RuntimeError, futures[1].wait_for_result)
+        _expect(RuntimeError, queue.data_computation_completed_callback, versions[0].path_id, {})
+    _expect(CompletionQueueClosedError, queue.submit, versions[0].path_id, {})
+    assert data_accessor.get_asset_version_data_fields(versions[3].path_id, ['i']) == {'i': 3}
+
+
+def check_listing(data_accessor: DataAccessInterface):
+    _new_assets(data_accessor, 'b', 'ab')
+    _new_assets(data_accessor, 'a', asset_type='other')
+    _new_assets(data_accessor, 'c')
+    assert [x.path_id for x in data_accessor.iter_assets(page_size=1)] == ['a', 'ab', 'b', 'c']
+    assert [x.path_id for x in data_accessor.iter_assets(type_name='cache', page_size=2)] == ['ab', 'b', 'c']
+    assert [x.path_id for x in data_accessor.iter_assets(prefix='a', page_size=1)] == ['a', 'ab']
+    assert [x.path_id for x in data_accessor.get_asset_datas_page(after_path_id='ab', limit=1)] == ['b']
+    assert list(data_accessor.iter_assets(type_name='nope')) == []
+
+    versions = [_new_version(data_accessor, name) for name in ('c', 'a', 'c', 'b', 'a', 'c')]
+    data_accessor.schedule_data_computation_for_asset_version('c/2')
+    all_path_ids = sorted(v.path_id for v in versions)
+    for page_size in (1, 2, 6, 100):
+        assert [x.path_id for x in data_accessor.iter_asset_versions(page_size=page_size)] == all_path_ids
+    assert [x.path_id for x in data_accessor.iter_asset_versions('c', page_size=2)] == ['c/1', 'c/2', 'c/3']
+    assert [x.path_id for x in data_accessor.iter_asset_versions(state=DataState.IS_COMPUTING)] == ['c/2']
+    assert [x.path_id for x in data_accessor.iter_asset_versions('a', state=DataState.NOT_COMPUTED, page_size=1)] == ['a/1', 'a/2']
+    assert [x.path_id for x in data_accessor.get_asset_version_datas_page(after_path_id='b/1', limit=2)] == ['c/1', 'c/2']
+    assert data_accessor.get_asset_version_datas_page(asset_path_id='nope') == []
+    assert next(data_accessor.iter_asset_versions('b')).data_producer_task_attrs == _params()
+    _expect(ValueError, lambda: next(data_accessor.iter_assets(page_size=0)))
+
+
+def check_templates(data_accessor: DataAccessInterface):
+    _new_assets(data_accessor, 'a', 'b', 'c')
+    a1 = _new_version(data_accessor, 'a')
+    data_accessor.create_asset_template(AssetTemplateData('c', _params(t=1)), ['a', 'b'], [a1.path_id])
+    assert data_accessor.get_asset_template_data_for_asset_path_id('c').data_producer_task_attrs == _params(t=1)
+    assert [x.asset_path_id for x in data_accessor.get_asset_template_datas_for_asset_path_id(['b', 'c'])] == ['c']
+    _expect(NotFoundError, data_accessor.get_asset_template_data_for_asset_path_id, 'a')
+    assert [x.asset_path_id for x in data_accessor.get_asset_templates_triggered_by('b')] == ['c']
+    assert data_accessor.get_asset_templates_triggered_by('c') == []
+    assert list(data_accessor.get_template_fixed_dependencies('c')) == ['a/1']
+
+    data_accessor.update_asset_template_data(AssetTemplateData('c', _params(t=2)))
+    assert data_accessor.get_asset_templates_triggered_by('a')[0].data_producer_task_attrs == _params(t=2)
+
+    # diamond a -> d, e -> f, and a cycle f -> g -> f
+    _new_assets(data_accessor, 'd', 'e', 'f', 'g')
+    for path_id, triggers in (('d', ['a']), ('e', ['a']), ('f', ['d', 'e', 'g']), ('g', ['f'])):
+        data_accessor.create_asset_template(AssetTemplateData(path_id, _params(t=path_id)), triggers, [])
+    edges = data_accessor.get_asset_templates_downstream_of(['a'])
+    assert sorted((x, t.asset_path_id) for x, t in edges) == [('a', 'c'), ('a', 'd'), ('a', 'e'), ('d', 'f'), ('e', 'f'), ('f', 'g'), ('g', 'f')]
+    assert all(t.data_producer_task_attrs == _params(t=2 if t.asset_path_id == 'c' else t.asset_path_id) for _, t in edges)
+    assert sorted((x, t.asset_path_id) for x, t in data_accessor.get_asset_templates_downstream_of(['g', 'b'])) == [('b', 'c'), ('f', 'g'), ('g', 'f')]
+    assert data_accessor.get_asset_templates_downstream_of(['c']) == []
+
+    data_accessor.update_asset_template_datas([AssetTemplateData('d', _params(t=3)), AssetTemplateData('e', _params(t=4)), AssetTemplateData('a', _params())])
+    assert [x.data_producer_task_attrs for x in data_accessor.get_asset_template_datas_for_asset_path_id(['d', 'e'])] == [_params(t=3), _params(t=4)]
+    _expect(NotFoundError, data_accessor.get_asset_template_data_for_asset_path_id, 'a')
+    # assets without fixed dependencies may be omitted
+    assert {k: v for k, v in data_accessor.get_templates_fixed_dependencies(['c', 'd', 'a']).items() if v} == {'c': ['a/1']}
+
+
+def check_change_feed(data_accessor: DataAccessInterface):
+    if isinstance(data_accessor, ShardedDataManager):  # shards have separate feeds
+        return
+    assert data_accessor.get_last_change_seq() == 0
+    _new_assets(data_accessor, 'a', 'b')
+    start = data_accessor.get_last_change_seq()
+    a1 = _new_version(data_accessor, 'a')
+    _new_version(data_accessor, 'b', dependencies=[a1.path_id])
+    data_accessor.add_dependencies('b/1', ['a/1'])  # nothing changes
+    data_accessor.remove_dependencies('b/1', ['a/1'])
+    data_accessor.create_asset_template(AssetTemplateData('b', _params()), ['a'], [])
+    data_accessor.schedule_data_computation_for_asset_version('a/1')
+    data_accessor.data_computation_completed_callback('a/1', {})
+
+    changes = data_accessor.get_changes_since(start)
+    assert [(x.change_type, x.path_id, x.other_path_id) for x in changes] == [
+        (ChangeType.VERSION_PUBLISHED, 'a/1', 'a'),
+        (ChangeType.VERSION_PUBLISHED, 'b/1', 'b'),
+        (ChangeType.DEPENDENCY_ADDED, 'b/1', 'a/1'),
+        (ChangeType.DEPENDENCY_REMOVED, 'b/1', 'a/1'),
+        (ChangeType.TEMPLATE_CHANGED, 'b', None),
+        (ChangeType.VERSION_DATA_STATE_CHANGED, 'a/1', None),
+        (ChangeType.VERSION_DATA_STATE_CHANGED, 'a/1', None),
+    ]
+    assert [x.seq for x in changes] == list(range(start + 1, start + 1 + len(changes)))
+    assert changes[-1].seq == data_accessor.get_last_change_seq()
+    assert data_accessor.get_changes_since(start, 2) == changes[:2]
+    assert data_accessor.get_changes_since(changes[-1].seq) == []
+
+    trim_change_log = getattr(data_accessor, 'trim_change_log', None)
+    if trim_change_log is not None:
+        trim_change_log(start + 1)
+        _expect(ChangeLogTrimmedError, data_accessor.get_changes_since, start)
+        assert data_accessor.get_changes_since(start + 1) == changes[1:]
+
+
+def check_cache_sync(data_accessor: DataAccessInterface):
+    # changes made directly in the backend behind cache's back must be seen after sync
+    if not isinstance(data_accessor, CachedDataAccessInterface):
+        return
+    backend = data_accessor.get_backend()
+    _new_assets(data_accessor, 'a', 'b')
+    _new_version(data_accessor, 'a')
+    _new_version(data_accessor, 'b')
+    assert data_accessor.get_asset_version_data('a', None).path_id == 'a/1'
+    assert data_accessor.get_version_dependencies('b/1') == []
+    _new_version(backend, 'a')
+    backend.add_dependencies('b/1', ['a/2'])
+    data_accessor.sync()
+    assert data_accessor.get_asset_version_data('a', None).path_id == 'a/2'
+    assert data_accessor.get_version_dependencies('b/1') == ['a/2']
+
+
+def check_async_director_context(data_accessor: DataAccessInterface):
+    # calls AsyncDirector runs on its executor must see caller's version locks and director session
+    director = PipelineDirector(data_accessor)
+    director.register_uri_handler(AssetVersionUriHandler(director))
+    _new_assets(data_accessor, 'a', asset_type=CacheAsset.type_name())
+    _new_version(data_accessor, 'a')
+    _new_version(data_accessor, 'a')
+    async_director = AsyncDirector(director, max_concurrency=2)
+
+    async def fetch_default_version(locks: Dict[str, str]) -> str:
+        with get_version_lock_context().overridden(locks):
+            return (await async_director.fetch_uri('assetver:a')).path_id
+
+    async def run():
+        # concurrent with different locks, so must not be coalesced
+        assert await asyncio.gather(fetch_default_version({'a': 'a/1'}), fetch_default_version({})) == ['a/1', 'a/2']
+        with director.session():
+            first, second = await asyncio.gather(async_director.get_asset_version('a/1'), async_director.get_asset_version('a/1'))
+            assert first is second is director.get_asset_version('a/1')
+        assert await async_director.get_asset_version('a/1') is not first
+
+    try:
+        asyncio.run(run())
+    finally:
+        async_director.shutdown()
+
+
+checks: List[Callable[[DataAccessInterface], None]] = [
+    check_assets,
+    check_versions,
+    check_batch_publish,
+    check_transaction,
+    check_transaction_without_waiting,
+    check_dependencies,
+    check_data_computation,
+    check_batched_completion,
+    check_listing,
+    check_templates,
+    check_change_feed,
+    check_cache_sync,
+    check_async_director_context,
+]
+
+
+def _make_sqlite(tmp_dir: Path, scheduler: TaskSchedulingInterface) -> DataAccessInterface:
+    # cycle detection needs closure
+    return SqliteDataManagerWithLifeblood(tmp_dir/'pipeline.db', scheduler, maintain_dependency_closure=True)
+
+
+def _make_memory(tmp_dir: Path, scheduler: TaskSchedulingInterface) -> DataAccessInterface:
+    return InMemoryDataManager(scheduler, tmp_dir)
+
+
+_sharded_routing = {'c': 3}
+
+
+def _make_sharded_sqlite(tmp_dir: Path, scheduler: TaskSchedulingInterface) -> DataAccessInterface:
+    # enough shards for the handful of assets in checks to land in different ones
+    return ShardedDataManager.from_sqlite_paths([tmp_dir/f'shard{i}.db' for i in range(4)], scheduler, routing=_sharded_routing)
+
+
+def _make_sharded_cached_sqlite(tmp_dir: Path, scheduler: TaskSchedulingInterface) -> DataAccessInterface:
+    # sharded data is cached shard by shard
+    shards = _make_sharded_sqlite(tmp_dir, scheduler).get_shards()
+    return ShardedDataManager([CachedDataAccessInterface(shard) for shard in shards], scheduler, routing=_sharded_routing)
+
+
+backends: Dict[str, Callable[[Path, TaskSchedulingInterface], DataAccessInterface]] = {
+    'sqlite': _make_sqlite,
+    'memory': _make_memory,
+    'cached_sqlite': lambda tmp_dir, scheduler: CachedDataAccessInterface(_make_sqlite(tmp_dir, scheduler)),
+    'cached_memory': lambda tmp_dir, scheduler: CachedDataAccessInterface(_make_memory(tmp_dir, scheduler)),
+    'sharded_sqlite': _make_sharded_sqlite,
+    'sharded_cached_sqlite': _make_sharded_cached_sqlite,
+}
+
+
+def run_checks(backend_names: List[str], verbose: bool = False) -> List[Tuple[str, str]]:
+    """
+    run all checks against given backends, return list of (backend, check) pairs that failed
+    """
+    failed = []
+    for backend_name in backend_names:
+        for check in checks:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                scheduler = _CountingScheduler()
+                data_accessor = backends[backend_name](Path(tmp_dir), scheduler)
+                scheduler.add_task_completion_callback_receiver(data_accessor)
+                try:
+                    check(data_accessor)
+                except Exception:
+                    failed.append((backend_name, check.__name__))
+                    print(f'FAIL {backend_name} {check.__name__}')
+                    traceback.print_exc()
+                else:
+                    if verbose:
+                        print(f'ok   {backend_name} {check.__name__}')
+                finally:
+                    close = getattr(data_accessor, 'close', None)
+                    if close is not None:
+                        close()
+    return failed
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='check that all data access backends behave the same')
+    parser.add_argument('backend', nargs='*', help=f'backends to check, all by default. one of: {", ".join(backends.keys())}')
+    parser.add_argument('-v', '--verbose', action='store_true')
+
+    opts = parser.parse_args(argv[1:])
+    for backend_name in opts.backend:
+        if backend_name not in backends:
+            parser.error(f'unknown backend "{backend_name}"')
+
+    failed = run_checks(opts.backend or list(backends.keys()), opts.verbose)
+    print(f'{len(failed)} failed' if failed else 'all passed')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
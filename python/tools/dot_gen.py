@@ -4,32 +4,33 @@ import argparse
 import subprocess
 import tempfile
 from demo_pipeline import get_director
+from pipeline.utils import denormalize_version
 from typing import Iterable, Optional
 
 
-def gen_dot(root_version_uris: Iterable[str] = ()) -> str:
+def _dot_id(path_id: str) -> str:
+    return path_id.replace("/", "____")
+
+
+def gen_dot(root_version_uris: Iterable[str] = (), leaf_asset_type_name: Optional[str] = None, leaf_asset_path_id_prefix: Optional[str] = None) -> str:
     director = get_director()
+    data_accessor = director.get_data_accessor()
 
     if not root_version_uris:
-        root_version_pathids = director.get_data_accessor().get_leaf_asset_version_pathids()
+        root_version_pathids = data_accessor.get_leaf_asset_version_pathids(asset_type_name=leaf_asset_type_name,
+                                                                            asset_path_id_prefix=leaf_asset_path_id_prefix)
     else:
         root_version_pathids = [director.fetch_uri(uri).path_id for uri in root_version_uris]
     print(root_version_pathids)
 
-    root_versions = [director.get_asset_version(x) for x in root_version_pathids]
-    all_versions = set(x.path_id for x in root_versions)
-    versions = list(root_versions)
-    for version in versions:
-        print(version.path_id)
-        new_versions = set(x for x in version.get_dependencies() if x.path_id not in all_versions)
-        all_versions.update(x.path_id for x in new_versions)
-        versions.extend(new_versions)
-
-    dot_labels = [f'{x.path_id.replace("/", "____")} [label = "{x.asset.name} {x.version_id}"];' for x in versions]
-    connections = []
+    # whole upstream graph is fetched at once, then all versions and assets it touches
+    edges = data_accessor.get_transitive_dependencies(root_version_pathids)
+    version_pathids = list(dict.fromkeys([*root_version_pathids, *(x.depends_on for x in edges)]))
+    versions = data_accessor.get_asset_version_datas_from_path_id(version_pathids)
+    asset_names = {x.path_id: x.name for x in data_accessor.get_asset_datas({x.asset_path_id for x in versions})}
 
-    for version in versions:
-        connections.extend([f'{x.path_id.replace("/", "____")} -> {version.path_id.replace("/", "____")};' for x in version.get_dependencies()])
+    dot_labels = [f'{_dot_id(x.path_id)} [label = "{asset_names[x.asset_path_id]} {denormalize_version(x.version_id)}"];' for x in versions]
+    connections = [f'{_dot_id(x.depends_on)} -> {_dot_id(x.dependant)};' for x in edges]
 
     return 'digraph{\n' + \
            '\n'.join(dot_labels) + \
@@ -41,10 +42,12 @@ def gen_dot(root_version_uris: Iterable[str] = ()) -> str:
 def main(argv):
     parser = argparse.ArgumentParser(description='generate image of asset dependencies')
     parser.add_argument('uri', nargs='*')
+    parser.add_argument('--type', help='when no uris given - only start from leaf versions of assets of this type')
+    parser.add_argument('--prefix', help='when no uris given - only start from leaf versions of assets with path_id starting with this')
 
     opts = parser.parse_args(argv[1:])
 
-    dot_code = gen_dot(opts.uri)
+    dot_code = gen_dot(opts.uri, opts.type, opts.prefix)
     # print(dot_code)
 
     fd, path = tempfile.mkstemp('.png')
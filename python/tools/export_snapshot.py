@@ -0,0 +1,24 @@
+import sys
+import argparse
+from demo_pipeline import get_director, get_sqlite_data_manager
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='export read-only snapshot of pipeline database for farm workers. '
+                                                 'point workers to it with PIPELINE_SNAPSHOT_DB env variable')
+    parser.add_argument('output', help='snapshot file to create')
+    parser.add_argument('uri', nargs='*', help='only export these asset versions and everything they depend on')
+
+    opts = parser.parse_args(argv[1:])
+
+    try:
+        data_manager = get_sqlite_data_manager()
+    except RuntimeError as e:
+        parser.error(f'cannot export snapshot: {e}')
+    director = get_director()
+    version_pathids = [director.fetch_uri(uri).path_id for uri in opts.uri] or None
+    data_manager.export_snapshot(opts.output, version_pathids)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,19 @@
+import sys
+import argparse
+from demo_pipeline import get_sqlite_data_manager
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='rebuild asset version dependency closure from scratch. '
+                                                 'closure is only maintained by pipeline processes run with PIPELINE_DEPENDENCY_CLOSURE=1')
+    parser.parse_args(argv[1:])
+
+    try:
+        data_manager = get_sqlite_data_manager()
+    except RuntimeError as e:
+        parser.error(f'cannot rebuild dependency closure: {e}')
+    data_manager.rebuild_dependency_closure()
+
+
+if __name__ == '__main__':
+    main(sys.argv)